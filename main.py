@@ -1,16 +1,29 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.graph_objects as go
 import yfinance as yf
 import requests
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime, Boolean
+from sqlalchemy import create_engine, inspect, text, insert, update, func, Index, Column, Integer, String, Text, Float, Date, DateTime, Boolean
 from sqlalchemy.orm import sessionmaker, declarative_base
 from streamlit_autorefresh import st_autorefresh
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from concurrent.futures import ThreadPoolExecutor, wait
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+from yfinance.exceptions import YFTickerMissingError
+import threading
+import time
+import zlib
+import glob
 import os
 
 st.set_page_config(page_title="Morning Alpha Dashboard", layout="wide")
 
+# Süre bütçesini aşan indirmeler her tam çalıştırmada yeniden toplanır
+st.session_state.partial_futures = []
+
 REFRESH_INTERVALS = {
     "Kapalı": 0,
     "30 Saniye": 30000,
@@ -20,7 +33,9 @@ REFRESH_INTERVALS = {
 }
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
-engine = create_engine(DATABASE_URL)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "10"))
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", "1800"))
 Base = declarative_base()
 
 class UserPortfolio(Base):
@@ -33,6 +48,10 @@ class UserPortfolio(Base):
     added_at = Column(DateTime, default=datetime.now)
     portfolio_name = Column(String(100), default='Portföy 1')
     time_period = Column(String(20), default='5 Gün')
+    __table_args__ = (
+        Index('ix_user_portfolio_name_symbol', 'portfolio_name', 'symbol'),
+        Index('ix_user_portfolio_symbol', 'symbol'),
+    )
 
 class PriceAlert(Base):
     __tablename__ = 'price_alerts'
@@ -43,37 +62,349 @@ class PriceAlert(Base):
     is_triggered = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.now)
     triggered_at = Column(DateTime, nullable=True)
+    trigger_bar_at = Column(DateTime, nullable=True)
+    trigger_price = Column(Float, nullable=True)
+    __table_args__ = (
+        Index('ix_price_alerts_triggered_at', 'is_triggered', 'triggered_at'),
+        Index('ix_price_alerts_symbol_triggered', 'symbol', 'is_triggered'),
+    )
+
+class NotificationQueue(Base):
+    __tablename__ = 'notification_queue'
+    id = Column(Integer, primary_key=True)
+    chat_id = Column(String(64), nullable=False)
+    message = Column(Text, nullable=False)
+    status = Column(String(20), default='pending')
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.now)
+    last_error = Column(String(255), nullable=True)
+    created_at = Column(DateTime, default=datetime.now)
+    sent_at = Column(DateTime, nullable=True)
+    __table_args__ = (
+        Index('ix_notification_queue_due', 'status', 'next_attempt_at'),
+    )
+
+class PortfolioSnapshot(Base):
+    __tablename__ = 'portfolio_snapshots'
+    id = Column(Integer, primary_key=True)
+    snapshot_date = Column(Date, nullable=False)
+    portfolio_name = Column(String(100), nullable=False)
+    value = Column(Float)
+    cost = Column(Float)
+    position_count = Column(Integer)
+    created_at = Column(DateTime, default=datetime.now)
+    __table_args__ = (
+        Index('ux_portfolio_snapshots_name_date', 'portfolio_name', 'snapshot_date', unique=True),
+        Index('ix_portfolio_snapshots_date', 'snapshot_date'),
+    )
+
+class PositionSnapshot(Base):
+    __tablename__ = 'position_snapshots'
+    id = Column(Integer, primary_key=True)
+    snapshot_date = Column(Date, nullable=False)
+    portfolio_name = Column(String(100), nullable=False)
+    symbol = Column(String(10), nullable=False)
+    quantity = Column(Float)
+    price = Column(Float, nullable=True)
+    value = Column(Float, nullable=True)
+    cost = Column(Float)
+    __table_args__ = (
+        Index('ix_position_snapshots_name_date', 'portfolio_name', 'snapshot_date'),
+    )
+
+class SymbolFundamentals(Base):
+    __tablename__ = 'symbol_fundamentals'
+    symbol = Column(String(16), primary_key=True)
+    short_name = Column(String(100))
+    sector = Column(String(100))
+    beta = Column(Float)
+    forward_pe = Column(Float)
+    trailing_pe = Column(Float)
+    peg_ratio = Column(Float)
+    dividend_yield = Column(Float)
+    debt_to_equity = Column(Float)
+    revenue_growth = Column(Float)
+    profit_margin = Column(Float)
+    recommendation_mean = Column(Float)
+    market_cap = Column(Float)
+    updated_at = Column(DateTime, default=datetime.now, index=True)
+
+class ScreenResult(Base):
+    __tablename__ = 'screen_results'
+    id = Column(Integer, primary_key=True)
+    index_name = Column(String(50), nullable=False)
+    as_of = Column(DateTime, nullable=False)
+    rank = Column(Integer, nullable=False)
+    symbol = Column(String(16), nullable=False)
+    short_name = Column(String(100))
+    sector = Column(String(100))
+    price = Column(Float)
+    daily_change = Column(Float)
+    momentum = Column(Float)
+    volume_change = Column(Float)
+    money_flow_change = Column(Float)
+    valuation_score = Column(Float)
+    growth_score = Column(Float)
+    profitability_score = Column(Float)
+    momentum_score = Column(Float)
+    revision_score = Column(Float)
+    total_score = Column(Float)
+    money_flow_score = Column(Float)
+    __table_args__ = (
+        Index('ix_screen_results_index_rank', 'index_name', 'rank'),
+    )
+
+class RecommendationSnapshot(Base):
+    __tablename__ = 'recommendation_snapshots'
+    id = Column(Integer, primary_key=True)
+    as_of = Column(DateTime, nullable=False)
+    market = Column(String(8), nullable=False)
+    period = Column(String(20), nullable=False)
+    weighting = Column(String(10), nullable=False)
+    strategy = Column(String(20), nullable=False)
+    rank = Column(Integer, nullable=False)
+    symbol = Column(String(16), nullable=False)
+    company = Column(String(100))
+    sector = Column(String(100))
+    price = Column(Float)
+    daily_change = Column(Float)
+    total_score = Column(Float)
+    money_flow_score = Column(Float)
+    sector_change = Column(Float)
+    sector_volume_change = Column(Float)
+    sector_money_flow = Column(Float)
+    __table_args__ = (
+        Index('ix_recommendation_snapshots_key', 'market', 'weighting', 'strategy', 'period', 'as_of'),
+        Index('ix_recommendation_snapshots_as_of', 'as_of'),
+    )
+
+class SchemaMigration(Base):
+    __tablename__ = 'schema_migrations'
+    version = Column(Integer, primary_key=True)
+    name = Column(String(100), nullable=False)
+    applied_at = Column(DateTime, default=datetime.now)
+
+# create_all mevcut tablolara sütun ve dizin eklemez; eski veritabanları sürümlü göçlerle tamamlanır.
+# Her göç tekrar çalıştırılabilir olmalı: yeni kurulumda create_all aynı şemayı zaten oluşturmuş olur.
+def add_alert_trigger_columns(conn):
+    existing = {c["name"] for c in inspect(conn).get_columns("price_alerts")}
+    for column_name, column_type in {"trigger_bar_at": "TIMESTAMP", "trigger_price": "FLOAT"}.items():
+        if column_name not in existing:
+            conn.execute(text(f"ALTER TABLE price_alerts ADD COLUMN {column_name} {column_type}"))
 
-Base.metadata.create_all(engine, checkfirst=True)
-Session = sessionmaker(bind=engine)
+def add_query_indexes(conn):
+    for model in (UserPortfolio, PriceAlert, NotificationQueue):
+        for index in model.__table__.indexes:
+            index.create(conn, checkfirst=True)
+
+def add_snapshot_tables(conn):
+    Base.metadata.create_all(conn, tables=[PortfolioSnapshot.__table__, PositionSnapshot.__table__], checkfirst=True)
+
+def add_screening_tables(conn):
+    Base.metadata.create_all(conn, tables=[SymbolFundamentals.__table__, ScreenResult.__table__], checkfirst=True)
+
+def add_recommendation_snapshots(conn):
+    Base.metadata.create_all(conn, tables=[RecommendationSnapshot.__table__], checkfirst=True)
+
+MIGRATIONS = [
+    (1, "price_alerts tetikleme barı sütunları", add_alert_trigger_columns),
+    (2, "portföy, alarm ve bildirim sorgu dizinleri", add_query_indexes),
+    (3, "günlük portföy ve pozisyon anlık görüntüleri", add_snapshot_tables),
+    (4, "temel veri önbelleği ve endeks tarama sonuçları", add_screening_tables),
+    (5, "öneri anlık görüntüleri", add_recommendation_snapshots),
+]
+MIGRATION_LOCK_KEY = 72010036
+FUNDAMENTALS_WRITE_LOCK_KEY = 72010037
+SCREEN_WRITE_LOCK_KEY = 72010038
+
+def advisory_xact_lock(session, key):
+    """PostgreSQL'de işlem sonuna kadar süren danışma kilidi; satırları silip yeniden yazan kopyalar sırayla çalışır"""
+    if session.get_bind().dialect.name == "postgresql":
+        session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": key})
+
+def run_migrations(engine):
+    """Uygulanmamış göçleri sırayla tek işlemde uygular ve sürümlerini schema_migrations tablosuna yazar"""
+    with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # Aynı anda açılan kopyalar göçleri sırayla görsün
+            conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        applied = set(conn.execute(text("SELECT version FROM schema_migrations")).scalars())
+        for version, name, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            migrate(conn)
+            conn.execute(SchemaMigration.__table__.insert().values(version=version, name=name, applied_at=datetime.now()))
+
+@st.cache_resource
+def get_engine():
+    """Motoru ve bağlantı havuzunu süreç başına bir kez kurar; şema da yalnızca burada oluşturulur"""
+    engine_options = {"pool_pre_ping": True, "pool_recycle": DB_POOL_RECYCLE}
+    if not DATABASE_URL.startswith("sqlite"):
+        engine_options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW)
+    engine = create_engine(DATABASE_URL, **engine_options)
+    Base.metadata.create_all(engine, checkfirst=True)
+    run_migrations(engine)
+    return engine
+
+@st.cache_resource
+def get_session_factory():
+    return sessionmaker(bind=get_engine())
 
 def get_session():
-    return Session()
+    return get_session_factory()()
 
 NEWSAPI_KEY = os.environ.get("NEWSAPI_KEY")
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.environ.get("TELEGRAM_CHAT_ID")
 
-def send_telegram_message(message):
-    """Send a message via Telegram bot"""
-    if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_ID:
-        st.sidebar.error("Token veya Chat ID eksik")
-        return False
+NOTIFY_POLL_SECONDS = float(os.environ.get("NOTIFY_POLL_SECONDS", "2"))
+# Telegram aynı sohbete saniyede yaklaşık bir mesaj kabul eder; aradaki mesajlar tek özette birleşir
+TELEGRAM_CHAT_MIN_INTERVAL_SECONDS = float(os.environ.get("TELEGRAM_CHAT_MIN_INTERVAL_SECONDS", "3"))
+TELEGRAM_MESSAGE_LIMIT = 4096
+NOTIFY_BATCH_SIZE = 200
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get("NOTIFY_MAX_ATTEMPTS", "6"))
+NOTIFY_BACKOFF_SECONDS = 5
+NOTIFY_MAX_BACKOFF_SECONDS = 600
+
+def post_telegram_message(message, chat_id=None):
+    """Telegram'a mesaj gönderir; arayüze dokunmaz: (başarılı mı, hata mesajı, bekleme süresi) döndürür"""
+    chat_id = chat_id or TELEGRAM_CHAT_ID
+    if not TELEGRAM_BOT_TOKEN or not chat_id:
+        return False, "Token veya Chat ID eksik", None
     try:
         url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
         data = {
-            "chat_id": TELEGRAM_CHAT_ID,
+            "chat_id": chat_id,
             "text": message,
             "parse_mode": "HTML"
         }
         response = requests.post(url, data=data, timeout=10)
         if response.status_code != 200:
-            error_info = response.json().get("description", "Bilinmeyen hata")
-            st.sidebar.error(f"Telegram hatası: {error_info}")
-        return response.status_code == 200
+            payload = response.json()
+            error_info = payload.get("description", "Bilinmeyen hata")
+            # 429 yanıtı ne kadar beklenmesi gerektiğini bildirir
+            retry_after = payload.get("parameters", {}).get("retry_after")
+            return False, f"Telegram hatası: {error_info}", retry_after
+        return True, None, None
     except Exception as e:
-        st.sidebar.error(f"Bağlantı hatası: {str(e)}")
+        return False, f"Bağlantı hatası: {str(e)}", None
+
+def queue_notification(session, message, chat_id=None):
+    """Mesajı verilen oturuma kuyruk kaydı olarak ekler; kayıt oturumun işlemiyle birlikte kalıcı olur"""
+    chat_id = chat_id or TELEGRAM_CHAT_ID
+    if not TELEGRAM_BOT_TOKEN or not chat_id:
         return False
+    session.add(NotificationQueue(chat_id=str(chat_id), message=message))
+    return True
+
+def enqueue_notification(message, chat_id=None):
+    """Mesajı gönderim kuyruğuna yazar; arayüze dokunmaz: (kuyruğa alındı mı, hata mesajı) döndürür"""
+    session = get_session()
+    try:
+        if not queue_notification(session, message, chat_id):
+            return False, "Token veya Chat ID eksik"
+        session.commit()
+        return True, None
+    except Exception as e:
+        session.rollback()
+        return False, f"Kuyruk hatası: {str(e)}"
+    finally:
+        session.close()
+
+def send_telegram_message(message):
+    """Mesajı Telegram kuyruğuna ekler; gönderimi arka plandaki bildirim işçisi yapar"""
+    queued, error = enqueue_notification(message)
+    if error:
+        st.sidebar.error(error)
+    return queued
+
+def take_digest(rows, limit=TELEGRAM_MESSAGE_LIMIT):
+    """Sıradaki mesajları Telegram'ın uzunluk sınırına sığdığı kadar tek metinde birleştirir"""
+    digest = [rows[0]]
+    length = len(rows[0].message)
+    for row in rows[1:]:
+        length += 2 + len(row.message)
+        if length > limit:
+            break
+        digest.append(row)
+    return digest, "\n\n".join(row.message for row in digest)[:limit]
+
+class NotificationSender:
+    """Bildirim kuyruğunu arka planda boşaltır: sohbet başına özet gönderir, hız sınırına uyar, hatada geri çekilerek yeniden dener"""
+
+    def __init__(self, session_factory, interval=NOTIFY_POLL_SECONDS, chat_interval=TELEGRAM_CHAT_MIN_INTERVAL_SECONDS):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.chat_interval = chat_interval
+        self.next_send_at = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="bildirim-gonderici", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.drain_once()
+            except Exception:
+                pass
+            self.stop_event.wait(self.interval)
+
+    def drain_once(self):
+        """Zamanı gelmiş mesajları sohbetlere göre gruplar ve her sohbete en fazla bir özet gönderir"""
+        session = self.session_factory()
+        sent_count = 0
+        try:
+            query = (
+                session.query(NotificationQueue)
+                .filter(NotificationQueue.status == "pending", NotificationQueue.next_attempt_at <= datetime.now())
+                .order_by(NotificationQueue.id)
+                .limit(NOTIFY_BATCH_SIZE)
+            )
+            if session.get_bind().dialect.name == "postgresql":
+                # Birden fazla kopya aynı mesajı göndermesin
+                query = query.with_for_update(skip_locked=True)
+            by_chat = {}
+            for row in query.all():
+                by_chat.setdefault(row.chat_id, []).append(row)
+            
+            for chat_id, rows in by_chat.items():
+                if self.next_send_at.get(chat_id, 0) > time.monotonic():
+                    continue
+                digest, text_body = take_digest(rows)
+                sent, error, retry_after = post_telegram_message(text_body, chat_id)
+                self.next_send_at[chat_id] = time.monotonic() + max(self.chat_interval, retry_after or 0)
+                now = datetime.now()
+                for row in digest:
+                    if sent:
+                        row.status = "sent"
+                        row.sent_at = now
+                        continue
+                    row.attempts += 1
+                    row.last_error = error[:255]
+                    if row.attempts >= NOTIFY_MAX_ATTEMPTS:
+                        row.status = "failed"
+                    else:
+                        backoff = retry_after or min(NOTIFY_BACKOFF_SECONDS * 2 ** (row.attempts - 1), NOTIFY_MAX_BACKOFF_SECONDS)
+                        row.next_attempt_at = now + timedelta(seconds=backoff)
+                if sent:
+                    sent_count += len(digest)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        return sent_count
+
+@st.cache_resource
+def get_notification_sender():
+    sender = NotificationSender(get_session_factory())
+    sender.start()
+    return sender
 
 @st.cache_data(ttl=900)
 def fetch_market_news(market="US"):
@@ -87,7 +418,7 @@ def fetch_market_news(market="US"):
         else:
             url = f"https://newsapi.org/v2/everything?q=borsa+istanbul+OR+BIST+OR+türk+ekonomi&language=tr&sortBy=publishedAt&pageSize=5&apiKey={NEWSAPI_KEY}"
         
-        response = requests.get(url, timeout=10)
+        response = coalesced_get(url)
         if response.status_code == 200:
             data = response.json()
             articles = data.get("articles", [])
@@ -101,53 +432,462 @@ def fetch_market_news(market="US"):
     except Exception:
         return None
 
-@st.cache_data(ttl=60)
-def get_vix_data():
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = int(os.environ.get("CIRCUIT_RESET_SECONDS", "60"))
+QUOTE_TTL_SECONDS = 60
+INFO_TTL_SECONDS = 3600
+SECTION_DEADLINE_SECONDS = float(os.environ.get("SECTION_DEADLINE_SECONDS", "3"))
+PARTIAL_REFRESH_SECONDS = 3
+# Kanonik günlük bar penceresi en uzun canlı dönemi ("1 Yıl" = 252 işlem günü) karşılar
+CANONICAL_HISTORY_DAYS = 400
+# Temettü/bölünme düzeltmeleri geçmiş barları değiştirir; tablo günde bir kez baştan indirilir
+CANONICAL_FULL_REFRESH_SECONDS = 24 * 3600
+# Önbellek en uzun süredir kullanılmayan kayıtları atarak bu boyutta tutulur
+DATA_CACHE_MAX_ENTRIES = int(os.environ.get("DATA_CACHE_MAX_ENTRIES", "5000"))
+
+class DataNotFound(Exception):
+    """Sağlayıcı yanıt verdi ama istenen sembol(ler) için veri yok; kullanıcı girdisi hatasıdır, devre kesici hatası sayılmaz"""
+
+# Bu hatalar bulunamadı sonucu olarak önbelleğe yazılır; diğer tüm hatalar sağlayıcı/ağ hatasıdır
+NOT_FOUND_ERRORS = (DataNotFound, YFTickerMissingError)
+
+class CircuitBreaker:
+    """Art arda hata veren bir veri sağlayıcısına istekleri bir süreliğine keser"""
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def allow_request(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            # Bekleme süresi dolduysa tek bir deneme isteğine izin ver (yarı açık durum)
+            if time.monotonic() - self.opened_at >= self.reset_seconds:
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+class SingleFlight:
+    """Aynı anahtar için eşzamanlı çağrıları tek bir sağlayıcı isteğinde birleştirir"""
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = {"done": threading.Event(), "result": None, "error": None}
+                self.calls[key] = call
+        if not is_leader:
+            # Devam eden isteğin sonucunu bekle ve paylaş
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except Exception as e:
+            call["error"] = e
+            raise
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+            call["done"].set()
+
+class StaleWhileRevalidateCache:
+    """Son başarılı değeri saklar; süresi dolan değeri hemen döndürüp arka planda yeniler
+    Bulunamayan semboller değeri None olan negatif kayıt olarak saklanır; kayıt sayısı max_entries ile sınırlıdır (LRU)"""
+
+    def __init__(self, executor, single_flight, max_entries=DATA_CACHE_MAX_ENTRIES):
+        self.executor = executor
+        self.single_flight = single_flight
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+    def contains(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key, loader, ttl, breaker):
+        """(değer, bayatlık_saniyesi) döndürür; taze değerde bayatlık None, hiç veri yoksa değer None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+        if entry is not None:
+            value, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < ttl:
+                return value, None
+            self._refresh_in_background(key, loader, breaker)
+            return value, age
+        if not breaker.allow_request():
+            return None, None
+        return self._load(key, loader, breaker), None
+
+    def load_now(self, key, loader, breaker):
+        """Süreyi beklemeden değeri hemen indirir ve saklar; güncel değer şart olan işler için, alınamazsa None"""
+        if not breaker.allow_request():
+            return None
+        return self._load(key, loader, breaker)
+
+    def _load(self, key, loader, breaker):
+        # Aynı anahtarı aynı anda isteyen oturumlar tek bir indirmeyi bekler
+        return self.single_flight.do(key, lambda: self._fetch_and_store(key, loader, breaker))
+
+    def _fetch_and_store(self, key, loader, breaker):
+        try:
+            value = loader()
+        except NOT_FOUND_ERRORS:
+            value = None
+        except Exception:
+            breaker.record_failure()
+            return None
+        with self.lock:
+            previous = self.entries.get(key)
+        if value is None and previous is not None and previous[0] is not None:
+            # Daha önce verisi olan sembolün boş dönmesi sağlayıcı aksaklığıdır; son geçerli değerin üzerine yazılmaz
+            breaker.record_failure()
+            return None
+        breaker.record_success()
+        with self.lock:
+            self.entries[key] = (value, time.time())
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def _refresh_in_background(self, key, loader, breaker):
+        with self.lock:
+            if key in self.refreshing:
+                return
+            if not breaker.allow_request():
+                return
+            self.refreshing.add(key)
+
+        def refresh():
+            try:
+                self._load(key, loader, breaker)
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+
+        self.executor.submit(refresh)
+
+class DailyBarStore:
+    """Sembol başına tek kanonik günlük bar tablosu; yenilemede yalnızca son bardan sonrası indirilir"""
+
+    def __init__(self):
+        self.frames = {}
+        self.covered_from = {}
+        self.full_fetched_at = {}
+        self.lock = threading.Lock()
+
+    def covering(self, symbol, start):
+        """Tablo 'start' tarihinden itibaren veri içeriyorsa tabloyu, yoksa None döndürür"""
+        start = pd.Timestamp(start).date()
+        with self.lock:
+            covered_from = self.covered_from.get(symbol)
+            if covered_from is None or start < covered_from:
+                return None
+            return self.frames[symbol]
+
+    def load(self, symbol, start=None):
+        """Tabloyu günceller ve döndürür; 'start' mevcut pencereden eskiyse pencere geriye genişletilir"""
+        with self.lock:
+            current = self.frames.get(symbol)
+            covered_from = self.covered_from.get(symbol)
+            full_fetched_at = self.full_fetched_at.get(symbol, 0)
+        default_start = (datetime.now() - timedelta(days=CANONICAL_HISTORY_DAYS)).date()
+        start = min(d for d in (pd.Timestamp(start).date() if start is not None else None, covered_from, default_start) if d is not None)
+        ticker = yf.Ticker(symbol)
+        full = current is None or start < covered_from or time.time() - full_fetched_at >= CANONICAL_FULL_REFRESH_SECONDS
+        if full:
+            bars = ticker.history(start=start, raise_errors=True)
+            if len(bars) == 0:
+                return current
+        else:
+            # Son bar gün içinde henüz kapanmamış olabilir; o bardan itibaren yeniden indir
+            recent = ticker.history(start=current.index[-1].date(), raise_errors=True)
+            bars = pd.concat([current[current.index < recent.index[0]], recent]) if len(recent) > 0 else current
+        with self.lock:
+            self.frames[symbol] = bars
+            self.covered_from[symbol] = start
+            if full:
+                self.full_fetched_at[symbol] = time.time()
+        return bars
+
+class DailyPanelStore:
+    """Sembol kümesi başına tek günlük bar paneli; tam pencere günde bir kez, arada yalnızca son bardan sonrası toplu indirilir"""
+
+    def __init__(self):
+        self.panels = {}
+        self.full_fetched_at = {}
+        self.lock = threading.Lock()
+
+    def load(self, symbols):
+        """Paneli günceller ve döndürür: {alan: tarih x sembol tablosu}"""
+        symbols = tuple(symbols)
+        with self.lock:
+            current = self.panels.get(symbols)
+            full_fetched_at = self.full_fetched_at.get(symbols, 0)
+        full = current is None or time.time() - full_fetched_at >= CANONICAL_FULL_REFRESH_SECONDS
+        if full:
+            panel = download_panel(symbols, (datetime.now() - timedelta(days=CANONICAL_HISTORY_DAYS)).date())
+        else:
+            # Son bar gün içinde henüz kapanmamış olabilir; o bardan itibaren yeniden indir
+            recent = download_panel(symbols, current["Close"].index[-1].date())
+            panel = {field: pd.concat([frame[frame.index < recent[field].index[0]], recent[field]]) for field, frame in current.items()}
+        with self.lock:
+            self.panels[symbols] = panel
+            if full:
+                self.full_fetched_at[symbols] = time.time()
+        return panel
+
+class DataSources:
+    """Veri hattının süreç düzeyindeki bağımlılıkları; arka plan işleri hattı st önbellek fonksiyonlarını çağırmadan bunlarla çalıştırır"""
+
+    def __init__(self, data_cache, fetch_executor, breakers, bar_store, panel_store, session_factory, sector_index_memo):
+        self.data_cache = data_cache
+        self.fetch_executor = fetch_executor
+        self.breakers = breakers
+        self.bar_store = bar_store
+        self.panel_store = panel_store
+        self.session_factory = session_factory
+        self.sector_index_memo = sector_index_memo
+
+@st.cache_resource
+def get_background_executor():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="veri-yenileme")
+
+@st.cache_resource
+def get_fetch_executor():
+    return ThreadPoolExecutor(max_workers=32, thread_name_prefix="veri-cekme")
+
+@st.cache_resource
+def get_single_flight():
+    return SingleFlight()
+
+@st.cache_resource
+def get_data_cache():
+    return StaleWhileRevalidateCache(get_background_executor(), get_single_flight())
+
+@st.cache_resource
+def get_circuit_breaker(provider):
+    return CircuitBreaker()
+
+@st.cache_resource
+def get_daily_bar_store():
+    return DailyBarStore()
+
+@st.cache_resource
+def get_daily_panel_store():
+    return DailyPanelStore()
+
+@st.cache_resource
+def get_data_sources():
+    return DataSources(get_data_cache(), get_fetch_executor(), {"yahoo": get_circuit_breaker("yahoo")}, get_daily_bar_store(), get_daily_panel_store(), get_session_factory(), get_sector_index_memo())
+
+def cached_fetch(provider, key, loader, ttl=QUOTE_TTL_SECONDS):
+    """Sağlayıcı çağrısını eski-değer-sun/arka-planda-yenile önbelleği ve devre kesici üzerinden yapar"""
+    return get_data_cache().get((provider,) + tuple(key), loader, ttl, get_circuit_breaker(provider))
+
+def coalesced_get(url, timeout=10):
+    """Aynı URL için eşzamanlı HTTP isteklerini tek bir istekte birleştirir"""
+    return get_single_flight().do(("http", url), lambda: requests.get(url, timeout=timeout))
+
+def daily_bars_request(symbol, sources=None):
+    """Sembolün kanonik günlük bar tablosu; tüm dönemler bu tablodan kesilir"""
+    store = sources.bar_store if sources is not None else get_daily_bar_store()
+    return "yahoo", ("bars", symbol), lambda: store.load(symbol), QUOTE_TTL_SECONDS
+
+def slice_period(bars, period):
+    """Kanonik tablodan yfinance 'period' karşılığını keser: '10d' son 10 işlem günü, '1mo' son bir takvim ayı"""
+    if bars is None:
+        return None
+    if period.endswith("mo"):
+        return bars[bars.index > bars.index[-1] - pd.DateOffset(months=int(period[:-2]))]
+    if period.endswith("y"):
+        return bars[bars.index > bars.index[-1] - pd.DateOffset(years=int(period[:-1]))]
+    return bars.iloc[-int(period[:-1]):]
+
+def slice_range(bars, start, end):
+    """Kanonik tablodan [start, end) tarih aralığını keser"""
+    start = pd.Timestamp(start).tz_localize(bars.index.tz)
+    end = pd.Timestamp(end).tz_localize(bars.index.tz)
+    return bars[(bars.index >= start) & (bars.index < end)]
+
+def info_request(symbol):
+    def load():
+        return yf.Ticker(symbol).info
+    return "yahoo", ("info", symbol), load, INFO_TTL_SECONDS
+
+def get_price_history(symbol, period):
+    """Yahoo fiyat geçmişini döndürür: (hist, bayatlık_saniyesi); veri yoksa hist None"""
+    bars, stale_age = cached_fetch(*daily_bars_request(symbol))
+    return slice_period(bars, period), stale_age
+
+def get_price_history_range(symbol, start, end):
+    """Tarih aralığı için fiyat geçmişi; kanonik tablo gerekirse bir kez geriye genişletilir"""
+    store = get_daily_bar_store()
+    bars = store.covering(symbol, start)
+    if bars is None:
+        bars = get_single_flight().do(("yahoo", "bars", symbol, str(start)), lambda: store.load(symbol, start))
+    if bars is None:
+        return pd.DataFrame()
+    return slice_range(bars, start, end)
+
+def get_ticker_info(symbol):
+    """Yahoo şirket bilgilerini döndürür: (info, bayatlık_saniyesi)"""
+    return cached_fetch(*info_request(symbol))
+
+def section_deadline():
+    """Bir sayfa bölümünün veri bekleyebileceği son anı döndürür"""
+    return time.monotonic() + SECTION_DEADLINE_SECONDS
+
+def closes_to_quotes(closes):
+    """Sütunları sembol olan kapanış tablosundan son fiyat ve günlük değişim tablosu üretir"""
+    last = closes.ffill().iloc[-1]
+    previous = closes.apply(lambda col: col.dropna().iloc[-2] if col.count() >= 2 else np.nan)
+    quotes = pd.DataFrame({"price": last, "change_pct": (last - previous) / previous * 100})
+    quotes["change_pct"] = quotes["change_pct"].fillna(0)
+    return quotes.dropna(subset=["price"])
+
+def empty_download_error(symbols):
+    """yf.download hataları yutup boş tablo döndürür; nedeni ilk sembolle tek bir denemeyle ayrılır
+    Sembol bulunamadıysa DataNotFound, sağlayıcı/ağ hatasıysa o hata döndürülür"""
     try:
-        vix = yf.Ticker("^VIX")
-        hist = vix.history(period="5d")
-        if len(hist) >= 2:
-            current = hist['Close'].iloc[-1]
-            previous = hist['Close'].iloc[-2]
-            change = ((current - previous) / previous) * 100
-            return current, change
-        elif len(hist) == 1:
-            return hist['Close'].iloc[-1], 0
-        return 18.5, 0
-    except:
-        return 18.5, 0
+        bars = yf.Ticker(list(symbols)[0]).history(period="5d", raise_errors=True)
+    except NOT_FOUND_ERRORS as e:
+        return DataNotFound(str(e))
+    except Exception as e:
+        return e
+    return ValueError("Toplu fiyat isteği boş döndü") if len(bars) > 0 else DataNotFound("Toplu fiyat isteği boş döndü")
+
+def quote_snapshot_request(symbols):
+    symbols = tuple(sorted(set(symbols)))
+    def load():
+        data = yf.download(list(symbols), period="5d", group_by="ticker", auto_adjust=True, progress=False, threads=True)
+        if data.empty:
+            raise empty_download_error(symbols)
+        if isinstance(data.columns, pd.MultiIndex):
+            closes = data.xs("Close", axis=1, level=1)
+        else:
+            closes = data[["Close"]].set_axis(list(symbols), axis=1)
+        return closes_to_quotes(closes)
+    return "yahoo", ("quotes",) + symbols, load, QUOTE_TTL_SECONDS
+
+def get_quote_snapshot(symbols):
+    """Sembollerin son fiyat/değişimini tek toplu istekle döndürür: (tablo, bayatlık_saniyesi)"""
+    if len(symbols) == 0:
+        return pd.DataFrame(columns=["price", "change_pct"]), None
+    quotes, stale_age = cached_fetch(*quote_snapshot_request(symbols))
+    if quotes is None:
+        return pd.DataFrame(columns=["price", "change_pct"]), None
+    return quotes, stale_age
+
+def fetch_within(requests_by_name, deadline=None, sources=None):
+    """İstekleri paralel çalıştırır; süre dolunca gelen sonuçları ve eksik kalan isimleri döndürür"""
+    if deadline is None:
+        deadline = section_deadline()
+    if sources is None:
+        sources = get_data_sources()
+    cache = sources.data_cache
+    executor = sources.fetch_executor
+    results = {}
+    futures = {}
+    for name, (provider, key, loader, ttl) in requests_by_name.items():
+        cache_key = (provider,) + tuple(key)
+        breaker = sources.breakers[provider]
+        if cache.contains(cache_key):
+            # Önbellekteki (taze ya da bayat) değer beklemeden döner
+            results[name] = cache.get(cache_key, loader, ttl, breaker)
+        else:
+            futures[executor.submit(cache.get, cache_key, loader, ttl, breaker)] = name
+    done, not_done = wait(futures, timeout=max(0.0, deadline - time.monotonic()))
+    results.update({futures[f]: f.result() for f in done})
+    missing = [futures[f] for f in not_done]
+    if not_done and get_script_run_ctx(suppress_warning=True) is not None:
+        # Süresi dolan indirmeler arka planda sürer; bitince bölüm fragment yenilemesiyle tamamlanır
+        st.session_state.setdefault("partial_futures", []).extend(not_done)
+    return results, missing
+
+def fetch_holdings_within(holdings, period="10d", deadline=None, sources=None):
+    """Hisselerin fiyat geçmişi ve şirket bilgilerini süre bütçesi içinde toplar: ({sembol: (hist, info)}, eksikler)"""
+    requests_by_name = {}
+    for symbol in holdings:
+        requests_by_name[("history", symbol)] = daily_bars_request(symbol, sources)
+        requests_by_name[("info", symbol)] = info_request(symbol)
+    results, missing = fetch_within(requests_by_name, deadline, sources)
+    missing_symbols = {name[1] for name in missing}
+    fetched = {}
+    for symbol in holdings:
+        if symbol in missing_symbols:
+            continue
+        hist = slice_period(results[("history", symbol)][0], period)
+        if hist is None:
+            continue
+        fetched[symbol] = (hist, results[("info", symbol)][0] or {})
+    return fetched, [s for s in holdings if s in missing_symbols]
+
+def with_missing(df, missing):
+    df.attrs["missing"] = list(missing)
+    return df
+
+def show_missing_data_badge(df):
+    """Süre bütçesine yetişmeyen semboller için 'eksik veri' rozeti gösterir"""
+    missing = df.attrs.get("missing") or []
+    if missing:
+        names = [m.replace(".IS", "") for m in missing]
+        more = f" +{len(names) - 8}" if len(names) > 8 else ""
+        st.caption(f"🟠 **eksik veri:** {', '.join(names[:8])}{more} - yüklenince bölüm otomatik tamamlanacak")
+
+def format_stale_age(stale_age):
+    if stale_age < 120:
+        return f"{int(stale_age)} sn"
+    return f"{int(stale_age // 60)} dk"
+
+def get_index_quote(symbol):
+    """Endeks/kur için (son değer, günlük değişim %, bayatlık_saniyesi) döndürür"""
+    hist, stale_age = get_price_history(symbol, "5d")
+    if hist is None:
+        return None, None, None
+    if len(hist) >= 2:
+        current = hist['Close'].iloc[-1]
+        previous = hist['Close'].iloc[-2]
+        change = ((current - previous) / previous) * 100
+        return current, change, stale_age
+    return hist['Close'].iloc[-1], 0, stale_age
+
+def get_vix_data():
+    return get_index_quote("^VIX")
 
-@st.cache_data(ttl=60)
 def get_bist100_data():
-    try:
-        xu100 = yf.Ticker("XU100.IS")
-        hist = xu100.history(period="5d")
-        if len(hist) >= 2:
-            current = hist['Close'].iloc[-1]
-            previous = hist['Close'].iloc[-2]
-            change = ((current - previous) / previous) * 100
-            return current, change
-        elif len(hist) == 1:
-            return hist['Close'].iloc[-1], 0
-        return 10000, 0
-    except:
-        return 10000, 0
+    return get_index_quote("XU100.IS")
 
-@st.cache_data(ttl=60)
 def get_usdtry_data():
-    try:
-        usdtry = yf.Ticker("USDTRY=X")
-        hist = usdtry.history(period="5d")
-        if len(hist) >= 2:
-            current = hist['Close'].iloc[-1]
-            previous = hist['Close'].iloc[-2]
-            change = ((current - previous) / previous) * 100
-            return current, change
-        elif len(hist) == 1:
-            return hist['Close'].iloc[-1], 0
-        return 35.0, 0
-    except:
-        return 35.0, 0
+    return get_index_quote("USDTRY=X")
 
 PERIOD_OPTIONS = {
     "1 Gün": ("2d", 1),
@@ -164,60 +904,92 @@ MARKET_OPTIONS = {
     "BIST (Borsa İstanbul)": "BIST"
 }
 
-US_SECTOR_ETFS = {
-    "Temel Malzemeler (XLB)": "XLB",
-    "İletişim Hizmetleri (XLC)": "XLC",
-    "Döngüsel Tüketici (XLY)": "XLY",
-    "Savunmacı Tüketici (XLP)": "XLP",
-    "Enerji (XLE)": "XLE",
-    "Finans (XLF)": "XLF",
-    "Sağlık (XLV)": "XLV",
-    "Sanayi (XLI)": "XLI",
-    "Gayrimenkul (XLRE)": "XLRE",
-    "Teknoloji (XLK)": "XLK",
-    "Kamu Hizmetleri (XLU)": "XLU"
+SECTOR_WEIGHTING_OPTIONS = {
+    "Eşit Ağırlık": "equal",
+    "Piyasa Değeri Ağırlığı": "cap"
 }
 
-BIST_SECTORS = {
-    "Bankacılık": "BANK",
-    "Holding": "HOLD",
-    "Demir Çelik": "STEEL",
-    "Havacılık": "AIR",
-    "Otomotiv": "AUTO",
-    "Perakende": "RETAIL",
-    "Enerji": "ENERGY",
-    "Telekomünikasyon": "TELCO",
-    "İnşaat & GYO": "CONST",
-    "Gıda & İçecek": "FOOD"
-}
+UNIVERSE_PATH = os.environ.get("UNIVERSE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "universe.csv"))
+UNIVERSE_INDEX_PATH = os.environ.get("UNIVERSE_INDEX_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "index_members.csv"))
+INDEX_BY_MARKET = {"US": "S&P 500", "BIST": "BIST 100"}
 
-BIST_SECTOR_HOLDINGS = {
-    "BANK": ["GARAN.IS", "AKBNK.IS", "YKBNK.IS", "ISCTR.IS", "HALKB.IS", "VAKBN.IS", "TSKB.IS", "ALBRK.IS"],
-    "HOLD": ["SAHOL.IS", "KCHOL.IS", "DOHOL.IS", "TAVHL.IS", "TKFEN.IS", "AGHOL.IS", "KOZAL.IS", "ECZYT.IS"],
-    "STEEL": ["EREGL.IS", "KRDMD.IS", "KRDMA.IS", "KRDMB.IS", "CELHA.IS", "BRSAN.IS", "BURCE.IS", "CEMTS.IS"],
-    "AIR": ["THYAO.IS", "PGSUS.IS", "CLEBI.IS", "TAVHL.IS"],
-    "AUTO": ["TOASO.IS", "FROTO.IS", "DOAS.IS", "OTKAR.IS", "ASUZU.IS", "TTRAK.IS"],
-    "RETAIL": ["BIMAS.IS", "MGROS.IS", "SOKM.IS", "BIZIM.IS", "MAVI.IS", "VAKKO.IS"],
-    "ENERGY": ["TUPRS.IS", "PETKM.IS", "AYEN.IS", "AKSEN.IS", "ODAS.IS", "ZOREN.IS", "AYDEM.IS", "ENJSA.IS"],
-    "TELCO": ["TCELL.IS", "TTKOM.IS", "NETAS.IS"],
-    "CONST": ["EKGYO.IS", "ISGYO.IS", "ENKAI.IS", "KLGYO.IS", "HLGYO.IS", "TRGYO.IS"],
-    "FOOD": ["ULKER.IS", "CCOLA.IS", "AEFES.IS", "BANVT.IS", "TATGD.IS", "KERVT.IS", "PENGD.IS"]
-}
+class UniverseRegistry:
+    """Pazar/sektör/sembol evreni: tamsayı sembol kimlikleri, sembol→sektörler ters dizini ve tekilleştirilmiş indirme kümesi"""
+
+    def __init__(self, members, index_members=None):
+        # Satır sırası korunur: sektörler ve sektör içindeki hisseler dosyadaki sırayla listelenir
+        self.members = members.reset_index(drop=True)
+        self.index_table = index_members if index_members is not None else pd.DataFrame(columns=["index", "market", "symbol"])
+        self.symbols = pd.Index(self.members["symbol"].unique())
+        self.members["symbol_id"] = self.symbols.get_indexer(self.members["symbol"])
+        self.sectors_by_symbol = self.members.groupby("symbol", sort=False)["sector_key"].agg(tuple).to_dict()
+
+    @classmethod
+    def from_csv(cls, path, index_path=None):
+        index_members = None
+        if index_path is not None and os.path.exists(index_path):
+            index_members = pd.read_csv(index_path, dtype=str, keep_default_na=False)
+        return cls(pd.read_csv(path, dtype=str, keep_default_na=False), index_members)
+
+    def market_members(self, market):
+        return self.members[self.members["market"] == market]
+
+    def sector_map(self, market):
+        """{sektör adı: sektör anahtarı}"""
+        sectors = self.market_members(market).drop_duplicates("sector_key")
+        return dict(zip(sectors["sector_name"], sectors["sector_key"]))
+
+    def holdings(self, market):
+        """{sektör anahtarı: [semboller]}"""
+        rows = self.market_members(market)
+        return {key: list(group["symbol"]) for key, group in rows.groupby("sector_key", sort=False)}
+
+    def symbol_id(self, symbol):
+        return int(self.symbols.get_loc(symbol))
+
+    def sectors_of(self, symbol):
+        return self.sectors_by_symbol.get(symbol, ())
+
+    def fetch_set(self, market, sector_keys=None, per_sector=None):
+        """Sektör üyelerini, birden fazla sektördeki semboller bir kez geçecek şekilde döndürür"""
+        rows = self.market_members(market)
+        if sector_keys is not None:
+            rows = rows[rows["sector_key"].isin(list(sector_keys))]
+        if per_sector is not None:
+            rows = rows.groupby("sector_key", sort=False).head(per_sector)
+        return list(rows["symbol"].drop_duplicates())
+
+    def index_members(self, index_name):
+        """Endeksin tüm bileşenleri (ör. S&P 500, BIST 100)"""
+        rows = self.index_table[self.index_table["index"] == index_name]
+        return list(rows["symbol"].drop_duplicates())
+
+@st.cache_resource
+def get_universe():
+    return UniverseRegistry.from_csv(UNIVERSE_PATH, UNIVERSE_INDEX_PATH)
+
+UNIVERSE = get_universe()
+US_SECTOR_ETFS = UNIVERSE.sector_map("US")
+BIST_SECTORS = UNIVERSE.sector_map("BIST")
+BIST_SECTOR_HOLDINGS = UNIVERSE.holdings("BIST")
 
 SECTOR_ETFS = US_SECTOR_ETFS
 
-SECTOR_HOLDINGS = {
-    "XLB": ["LIN", "APD", "SHW", "ECL", "DD", "FCX", "NEM", "DOW", "NUE", "VMC"],
-    "XLC": ["META", "GOOGL", "NFLX", "DIS", "T", "VZ", "CMCSA", "CHTR", "TMUS", "EA"],
-    "XLY": ["AMZN", "TSLA", "HD", "MCD", "NKE", "LOW", "SBUX", "TJX", "BKNG", "CMG"],
-    "XLP": ["PG", "KO", "PEP", "COST", "WMT", "PM", "MO", "CL", "MDLZ", "KHC"],
-    "XLE": ["XOM", "CVX", "COP", "SLB", "EOG", "MPC", "PSX", "VLO", "OXY", "HAL"],
-    "XLF": ["BRK-B", "JPM", "V", "MA", "BAC", "WFC", "GS", "MS", "AXP", "C"],
-    "XLV": ["UNH", "JNJ", "LLY", "PFE", "ABBV", "MRK", "TMO", "DHR", "ABT", "BMY"],
-    "XLI": ["CAT", "UNP", "HON", "BA", "GE", "RTX", "DE", "LMT", "UPS", "MMM"],
-    "XLRE": ["PLD", "AMT", "EQIX", "CCI", "SPG", "PSA", "O", "DLR", "WELL", "AVB"],
-    "XLK": ["AAPL", "MSFT", "NVDA", "AVGO", "CRM", "ADBE", "CSCO", "ACN", "ORCL", "IBM"],
-    "XLU": ["NEE", "DUK", "SO", "D", "AEP", "SRE", "EXC", "XEL", "PEG", "ED"]
+SECTOR_HOLDINGS = UNIVERSE.holdings("US")
+
+# Endeks taramasındaki şirketler Yahoo sektörleriyle gelir; ABD sektör ETF'leri bu sektörlere bire bir karşılık gelir
+US_SECTOR_PROVIDER_SECTORS = {
+    "XLB": "Basic Materials",
+    "XLC": "Communication Services",
+    "XLY": "Consumer Cyclical",
+    "XLP": "Consumer Defensive",
+    "XLE": "Energy",
+    "XLF": "Financial Services",
+    "XLV": "Healthcare",
+    "XLI": "Industrials",
+    "XLRE": "Real Estate",
+    "XLK": "Technology",
+    "XLU": "Utilities",
 }
 
 st.sidebar.header("🌍 Pazar Seçimi")
@@ -241,50 +1013,146 @@ else:
     CURRENCY_SYMBOL = "₺"
     PRICE_COL_NAME = "Fiyat (₺)"
 
-st.sidebar.divider()
+BIST_SECTOR_WEIGHTING = "equal"
+if selected_market == "BIST":
+    BIST_SECTOR_WEIGHTING = SECTOR_WEIGHTING_OPTIONS[st.sidebar.radio(
+        "Sektör endeksi ağırlığı:",
+        options=list(SECTOR_WEIGHTING_OPTIONS.keys()),
+        index=0,
+        help="BIST sektörleri bileşen hisselerden hesaplanan sentetik endekslerle izlenir"
+    )]
 
-st.sidebar.header("👤 Yatırımcı Profiline Göre Hisse Seçimi")
-investor_profile = st.sidebar.selectbox(
-    "Yatırımcı Profilinizi Seçin:",
-    options=["Seçiniz", "Muhafazakar", "Orta Riskli", "Riski Seven"],
-    index=0
-)
+st.sidebar.divider()
 
-INVESTOR_PROFILES = {
+# Kural: (alan, operatör, sınırlar, ağırlık); alanlar profile_metrics sütunlarıdır
+DEFAULT_INVESTOR_PROFILES = {
     "Muhafazakar": {
         "description": "Sermaye Koruma ve Düzenli Gelir",
-        "beta_min": 0.50, "beta_max": 0.85,
-        "pe_max": 15,
-        "dividend_min": 3.0,
-        "debt_equity_max": 0.50,
-        "preferred": "Blue-Chip, Temettü Aristokratları"
+        "preferred": "Blue-Chip, Temettü Aristokratları",
+        "rules": [
+            ("beta", "between", (0.50, 0.85), 1),
+            ("pe", "positive_max", 15, 1),
+            ("dividend_yield", "min", 3.0, 1),
+            ("debt_equity", "max", 0.50, 1),
+        ]
     },
     "Orta Riskli": {
         "description": "Dengeli Büyüme ve Enflasyon Üstü Getiri",
-        "beta_min": 0.90, "beta_max": 1.10,
-        "pe_min": 10, "pe_max": 25,
-        "peg_min": 1.0, "peg_max": 1.5,
-        "dividend_min": 1.0, "dividend_max": 2.0,
-        "debt_equity_max": 1.20,
-        "preferred": "Mega-Cap Growth ve Value Hisseleri"
+        "preferred": "Mega-Cap Growth ve Value Hisseleri",
+        "rules": [
+            ("beta", "between", (0.90, 1.10), 1),
+            ("pe", "between", (10, 25), 1),
+            ("peg", "between", (1.0, 1.5), 1),
+            ("dividend_yield", "between", (1.0, 2.0), 1),
+            ("debt_equity", "max", 1.20, 1),
+        ]
     },
     "Riski Seven": {
         "description": "Maksimum Sermaye Değerlemesi (Alfa)",
-        "beta_min": 1.20, "beta_max": 3.00,
-        "pe_min": 25,
-        "peg_max": 1.0,
-        "dividend_max": 0.5,
-        "preferred": "Small-Cap, Teknoloji, Biyoteknoloji"
+        "preferred": "Small-Cap, Teknoloji, Biyoteknoloji",
+        "rules": [
+            ("beta", "between", (1.20, 3.00), 1),
+            ("pe", "min", 25, 1),
+            ("peg", "positive_max", 1.0, 1),
+            ("dividend_yield", "max", 0.5, 1),
+        ]
     }
 }
 
+PROFILE_FIELD_LABELS = {
+    "beta": "Beta",
+    "pe": "F/K",
+    "peg": "PEG",
+    "dividend_yield": "Temettü (%)",
+    "debt_equity": "Borç/Özkaynak",
+}
+
+RULE_OPERATORS = {
+    "between": lambda bounds: lambda x: (x >= bounds[0]) & (x <= bounds[1]),
+    "min": lambda bound: lambda x: x >= bound,
+    "max": lambda bound: lambda x: x <= bound,
+    # F/K ve PEG'de sıfır ya da negatif değer "veri yok / zarar" demektir, ucuz sayılmaz
+    "positive_max": lambda bound: lambda x: (x > 0) & (x <= bound),
+}
+
+PROFILE_RULES_GLOB = os.environ.get("PROFILE_RULES_GLOB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "attached_assets", "profil_kriterleri_*.xlsx"))
+PROFILE_RULE_COLUMNS = ["Profil", "Alan", "Operatör", "Alt", "Üst", "Ağırlık"]
+
+def compile_profile_rules(rules):
+    """Kuralları bir kez derler: profil metrikleri tablosundan sembol başına uyum yüzdesi üreten fonksiyon"""
+    fields = [field for field, _, _, _ in rules]
+    predicates = [RULE_OPERATORS[op](bounds) for _, op, bounds, _ in rules]
+    weights = np.array([weight for _, _, _, weight in rules], dtype=float)
+
+    def match_percent(metrics):
+        if not rules or weights.sum() <= 0:
+            return pd.Series(0.0, index=metrics.index)
+        masks = np.column_stack([predicate(metrics[field].to_numpy(dtype=float)) for field, predicate in zip(fields, predicates)])
+        return pd.Series(masks @ weights / weights.sum() * 100, index=metrics.index)
+    return match_percent
+
+def describe_rule(rule):
+    field, op, bounds, _ = rule
+    if op == "between":
+        return f"**{PROFILE_FIELD_LABELS[field]}:** {bounds[0]} - {bounds[1]}"
+    return f"**{PROFILE_FIELD_LABELS[field]}:** {'>' if op == 'min' else '<'} {bounds}"
+
+def load_profile_rules(pattern):
+    """Kural tablosu biçimindeki profil dosyalarını okur (Profil, Alan, Operatör, Alt, Üst, Ağırlık; isteğe bağlı Hedef, Tercih); bu sütunları taşımayan dosyalar atlanır"""
+    profiles = {}
+    for path in sorted(glob.glob(pattern)):
+        try:
+            table = pd.read_excel(path)
+        except Exception:
+            continue
+        if not set(PROFILE_RULE_COLUMNS).issubset(table.columns):
+            continue
+        table = table.dropna(subset=["Profil", "Alan", "Operatör"])
+        for name, rows in table.groupby("Profil", sort=False):
+            rules = []
+            for row in rows.to_dict("records"):
+                field, op = str(row["Alan"]).strip(), str(row["Operatör"]).strip()
+                if field not in PROFILE_FIELD_LABELS or op not in RULE_OPERATORS:
+                    continue
+                try:
+                    low, high = float(row["Alt"]), float(row["Üst"])
+                    weight = float(row["Ağırlık"]) if pd.notna(row["Ağırlık"]) else 1.0
+                except (TypeError, ValueError):
+                    continue
+                bounds = (low, high) if op == "between" else low if op == "min" else high
+                if np.isnan(bounds).any():
+                    continue
+                rules.append((field, op, bounds, weight))
+            if rules:
+                profiles[str(name).strip()] = {
+                    "description": str(rows["Hedef"].dropna().iloc[0]) if "Hedef" in rows and rows["Hedef"].notna().any() else "",
+                    "preferred": str(rows["Tercih"].dropna().iloc[0]) if "Tercih" in rows and rows["Tercih"].notna().any() else "",
+                    "rules": rules
+                }
+    return profiles
+
+@st.cache_resource
+def get_investor_profiles():
+    """Varsayılan ve dosyadan yüklenen profiller; her profilin kuralları süreç başına bir kez derlenir"""
+    profiles = dict(DEFAULT_INVESTOR_PROFILES)
+    profiles.update(load_profile_rules(PROFILE_RULES_GLOB))
+    return {name: dict(profile, match_percent=compile_profile_rules(profile["rules"])) for name, profile in profiles.items()}
+
+INVESTOR_PROFILES = get_investor_profiles()
+
+st.sidebar.header("👤 Yatırımcı Profiline Göre Hisse Seçimi")
+investor_profile = st.sidebar.selectbox(
+    "Yatırımcı Profilinizi Seçin:",
+    options=["Seçiniz", *INVESTOR_PROFILES],
+    index=0
+)
+
 st.sidebar.divider()
 
 st.title("📊 Yatırım Karar Destek Paneli")
 market_label = "ABD Borsaları" if selected_market == "US" else "BIST (Borsa İstanbul)"
 st.subheader(f"Piyasa Analizi ve Sektörel Fırsatlar - {market_label}")
 
-@st.cache_data(ttl=60)
 def calculate_mfi(hist, period=14):
     """Finviz tarzı Money Flow Index hesaplar"""
     # MFI için minimum 5 günlük veri gerekli, aksi halde anlamlı sonuç üretilemez
@@ -324,7 +1192,98 @@ def calculate_mfi(hist, period=14):
     mfi = 100 - (100 / (1 + money_ratio))
     return round(mfi, 2)
 
-def get_sector_data(period_key="1 Gün", market="US"):
+SECTOR_DATA_COLUMNS = ["Sektör", "Değişim (%)", "Hacim Değişim (%)", "Para Akışı (%)", "MFI"]
+
+def download_panel(symbols, start):
+    """Sembollerin 'start' tarihinden bugüne günlük barları tek toplu istekte: {alan: tarih x sembol tablosu}"""
+    data = yf.download(list(symbols), start=start, group_by="ticker", auto_adjust=True, progress=False, threads=True)
+    if data.empty:
+        raise empty_download_error(symbols)
+    if isinstance(data.columns, pd.MultiIndex):
+        return {field: data.xs(field, axis=1, level=1) for field in ("Close", "High", "Low", "Volume")}
+    return {field: data[[field]].set_axis(list(symbols), axis=1) for field in ("Close", "High", "Low", "Volume")}
+
+def sector_panel_request(symbols, sources=None):
+    """Sektör bileşenlerinin kanonik pencere boyunca günlük barları: {alan: tarih x sembol tablosu}; yenilemede yalnızca son barlar indirilir"""
+    symbols = tuple(symbols)
+    store = sources.panel_store if sources is not None else get_daily_panel_store()
+    return "yahoo", ("panel",) + symbols, lambda: store.load(symbols), QUOTE_TTL_SECONDS
+
+def sector_weights(members, weighting, session_factory):
+    """Eşit ağırlık ya da önbellekteki piyasa değerleri; piyasa değeri bilinmeyen bileşene sektör ortalaması verilir"""
+    if weighting != "cap":
+        return pd.Series(1.0, index=members)
+    session = session_factory()
+    try:
+        caps = load_fundamentals(session, members)["market_cap"].reindex(members)
+    finally:
+        session.close()
+    caps = caps.where(caps > 0)
+    return caps.fillna(caps.mean()).fillna(1.0)
+
+def synthetic_sector_index(panel, members, weights):
+    """Bileşenlerin günlük getirilerinden ağırlıklı sektör endeksi; High/Low bileşenlerin gün içi aralığından,
+    Volume ise endeksin tipik fiyatı x hacmi bileşenlerin toplam para akışına eşit olacak şekilde kurulur"""
+    closes = panel["Close"].reindex(columns=members)
+    priced = closes.notna()
+    returns = closes.pct_change(fill_method=None)
+    return_weights = returns.notna().mul(weights, axis=1)
+    index_returns = (returns.fillna(0) * return_weights).sum(axis=1) / return_weights.sum(axis=1).where(lambda w: w > 0)
+    level = 100 * (1 + index_returns.fillna(0)).cumprod()
+    price_weights = priced.mul(weights, axis=1)
+    price_weight_sum = price_weights.sum(axis=1).where(lambda w: w > 0)
+    high_ratio = (panel["High"].reindex(columns=members) / closes * price_weights).sum(axis=1) / price_weight_sum
+    low_ratio = (panel["Low"].reindex(columns=members) / closes * price_weights).sum(axis=1) / price_weight_sum
+    typical = (panel["High"].reindex(columns=members) + panel["Low"].reindex(columns=members) + closes) / 3
+    money_flow = (typical * panel["Volume"].reindex(columns=members)).sum(axis=1)
+    index = pd.DataFrame({"Close": level, "High": level * high_ratio, "Low": level * low_ratio})
+    index["Volume"] = money_flow / ((index["High"] + index["Low"] + index["Close"]) / 3)
+    return index[priced.any(axis=1)].dropna()
+
+@st.cache_resource
+def get_sector_index_memo():
+    return {}
+
+def get_bist_sector_indices(panel, weighting, sources):
+    """Tüm BIST sektör endeksleri; aynı panel ve ağırlık için süreç içinde bir kez hesaplanır"""
+    memo = sources.sector_index_memo
+    entry = memo.get(weighting)
+    if entry is not None and entry[0] is panel:
+        return entry[1]
+    indices = {}
+    for sector_key, members in BIST_SECTOR_HOLDINGS.items():
+        members = [s for s in members if s in panel["Close"].columns]
+        if members:
+            indices[sector_key] = synthetic_sector_index(panel, members, sector_weights(members, weighting, sources.session_factory))
+    memo[weighting] = (panel, indices)
+    return indices
+
+def sector_metrics(hist, lookback_days):
+    """Sektör serisinden (ETF ya da sentetik endeks) değişim, hacim değişimi ve MFI; veri yetersizse None"""
+    if len(hist) > lookback_days:
+        current = hist['Close'].iloc[-1]
+        previous = hist['Close'].iloc[-(lookback_days + 1)]
+        current_vol = hist['Volume'].iloc[-lookback_days:].sum()
+        previous_vol = hist['Volume'].iloc[-lookback_days*2:-lookback_days].sum() if len(hist) > lookback_days*2 else hist['Volume'].iloc[0]
+        mfi = calculate_mfi(hist, period=max(1, min(lookback_days, len(hist) - 1)))
+    elif len(hist) >= 2:
+        current = hist['Close'].iloc[-1]
+        previous = hist['Close'].iloc[0]
+        current_vol = hist['Volume'].iloc[-1]
+        previous_vol = hist['Volume'].iloc[0]
+        mfi = calculate_mfi(hist, period=min(lookback_days, len(hist)-1))
+    else:
+        return None
+    change = ((current - previous) / previous) * 100
+    vol_change = ((current_vol - previous_vol) / previous_vol * 100) if previous_vol > 0 else 0
+    return {"Değişim (%)": round(change, 2), "Hacim Değişim (%)": round(vol_change, 2), "Para Akışı (%)": round(mfi - 50, 2), "MFI": round(mfi, 2)}
+
+def get_sector_data(period_key="1 Gün", market="US", deadline=None, weighting="equal", sources=None):
+    """Sektör değişim/hacim/MFI tablosu; ABD'de sektör ETF'lerinden, BIST'te bileşenlerden kurulan sentetik endekslerden
+    weighting: BIST sentetik endeksleri için 'equal' ya da 'cap'
+    """
+    if sources is None:
+        sources = get_data_sources()
     if market == "US":
         sector_map = US_SECTOR_ETFS
     else:
@@ -332,95 +1291,44 @@ def get_sector_data(period_key="1 Gün", market="US"):
     
     fetch_period, lookback_days = PERIOD_OPTIONS.get(period_key, ("2d", 1))
     
+    if market == "US":
+        fetched, missing = fetch_within({s: daily_bars_request(s, sources) for s in sector_map.values()}, deadline, sources)
+    else:
+        # Tüm bileşenler tek toplu istekte gelir; sektör serileri bu panelden hesaplanır
+        members = UNIVERSE.fetch_set("BIST")
+        results, late = fetch_within({"panel": sector_panel_request(members, sources)}, deadline, sources)
+        panel, stale_age = results.get("panel", (None, None))
+        missing = members if late else []
+        indices = get_bist_sector_indices(panel, weighting, sources) if panel is not None else {}
+        fetched = {sector_key: (index, stale_age) for sector_key, index in indices.items()}
+    
     results = []
-    for name, symbol in sector_map.items():
+    stale_ages = []
+    for name, sector_key in sector_map.items():
         try:
-            if market == "US":
-                ticker = yf.Ticker(symbol)
-                hist = ticker.history(period="1mo")
-                if len(hist) > lookback_days:
-                    current = hist['Close'].iloc[-1]
-                    previous = hist['Close'].iloc[-(lookback_days + 1)]
-                    change = ((current - previous) / previous) * 100
-                    
-                    current_vol = hist['Volume'].iloc[-lookback_days:].sum()
-                    previous_vol = hist['Volume'].iloc[-lookback_days*2:-lookback_days].sum() if len(hist) > lookback_days*2 else hist['Volume'].iloc[0]
-                    vol_change = ((current_vol - previous_vol) / previous_vol * 100) if previous_vol > 0 else 0
-                    
-                    mfi_period = min(lookback_days, len(hist) - 1)
-                    mfi = calculate_mfi(hist, period=max(1, mfi_period))
-                    mfi_normalized = mfi - 50
-                    
-                    results.append({"Sektör": name, "Değişim (%)": round(change, 2), "Hacim Değişim (%)": round(vol_change, 2), "Para Akışı (%)": round(mfi_normalized, 2), "MFI": mfi})
-                elif len(hist) >= 2:
-                    current = hist['Close'].iloc[-1]
-                    previous = hist['Close'].iloc[0]
-                    change = ((current - previous) / previous) * 100
-                    current_vol = hist['Volume'].iloc[-1]
-                    previous_vol = hist['Volume'].iloc[0]
-                    vol_change = ((current_vol - previous_vol) / previous_vol * 100) if previous_vol > 0 else 0
-                    mfi = calculate_mfi(hist, period=min(lookback_days, len(hist)-1))
-                    mfi_normalized = mfi - 50
-                    results.append({"Sektör": name, "Değişim (%)": round(change, 2), "Hacim Değişim (%)": round(vol_change, 2), "Para Akışı (%)": round(mfi_normalized, 2), "MFI": mfi})
-                else:
-                    results.append({"Sektör": name, "Değişim (%)": 0, "Hacim Değişim (%)": 0, "Para Akışı (%)": 0, "MFI": 50})
-            else:
-                holdings = BIST_SECTOR_HOLDINGS.get(symbol, [])
-                if not holdings:
-                    results.append({"Sektör": name, "Değişim (%)": 0, "Hacim Değişim (%)": 0, "Para Akışı (%)": 0, "MFI": 50})
-                    continue
-                sector_changes = []
-                sector_vol_changes = []
-                sector_mfi_values = []
-                for stock_symbol in holdings[:5]:
-                    try:
-                        ticker = yf.Ticker(stock_symbol)
-                        hist = ticker.history(period="1mo")
-                        if len(hist) > lookback_days:
-                            current = hist['Close'].iloc[-1]
-                            previous = hist['Close'].iloc[-(lookback_days + 1)]
-                            change = ((current - previous) / previous) * 100
-                            sector_changes.append(change)
-                            
-                            current_vol = hist['Volume'].iloc[-lookback_days:].sum()
-                            previous_vol = hist['Volume'].iloc[-lookback_days*2:-lookback_days].sum() if len(hist) > lookback_days*2 else hist['Volume'].iloc[0]
-                            vol_change = ((current_vol - previous_vol) / previous_vol * 100) if previous_vol > 0 else 0
-                            sector_vol_changes.append(vol_change)
-                            
-                            mfi_period = min(lookback_days, len(hist) - 1)
-                            mfi = calculate_mfi(hist, period=max(1, mfi_period))
-                            sector_mfi_values.append(mfi)
-                        elif len(hist) >= 2:
-                            current = hist['Close'].iloc[-1]
-                            previous = hist['Close'].iloc[0]
-                            change = ((current - previous) / previous) * 100
-                            sector_changes.append(change)
-                            current_vol = hist['Volume'].iloc[-1]
-                            previous_vol = hist['Volume'].iloc[0]
-                            vol_change = ((current_vol - previous_vol) / previous_vol * 100) if previous_vol > 0 else 0
-                            sector_vol_changes.append(vol_change)
-                            mfi = calculate_mfi(hist, period=min(lookback_days, len(hist)-1))
-                            sector_mfi_values.append(mfi)
-                    except:
-                        pass
-                if sector_changes:
-                    avg_change = sum(sector_changes) / len(sector_changes)
-                    avg_vol_change = sum(sector_vol_changes) / len(sector_vol_changes) if sector_vol_changes else 0
-                    avg_mfi = sum(sector_mfi_values) / len(sector_mfi_values) if sector_mfi_values else 50
-                    mfi_normalized = avg_mfi - 50
-                    results.append({"Sektör": name, "Değişim (%)": round(avg_change, 2), "Hacim Değişim (%)": round(avg_vol_change, 2), "Para Akışı (%)": round(mfi_normalized, 2), "MFI": round(avg_mfi, 2)})
-                else:
-                    results.append({"Sektör": name, "Değişim (%)": 0, "Hacim Değişim (%)": 0, "Para Akışı (%)": 0, "MFI": 50})
+            hist, stale_age = fetched.get(sector_key, (None, None))
+            if hist is None:
+                # Hiç geçerli veri yoksa sahte sıfır yerine sektörü listeden çıkar
+                continue
+            if stale_age is not None:
+                stale_ages.append(stale_age)
+            # Kanonik pencere en uzun dönemi de kapsadığından her dönem kendi penceresiyle hesaplanır
+            metrics = sector_metrics(slice_period(hist, fetch_period), lookback_days)
+            if metrics is not None:
+                results.append({"Sektör": name, **metrics})
         except:
-            results.append({"Sektör": name, "Değişim (%)": 0, "Hacim Değişim (%)": 0, "Para Akışı (%)": 0, "MFI": 50})
+            continue
     
-    return pd.DataFrame(results)
+    df = pd.DataFrame(results, columns=SECTOR_DATA_COLUMNS)
+    df.attrs["stale_age"] = max(stale_ages) if stale_ages else None
+    df.attrs["missing"] = missing
+    return df
 
-@st.cache_data(ttl=60)
 def get_stock_price(symbol):
     try:
-        ticker = yf.Ticker(symbol)
-        hist = ticker.history(period="5d")
+        hist, _ = get_price_history(symbol, "5d")
+        if hist is None:
+            return None, None
         if len(hist) >= 2:
             current = hist['Close'].iloc[-1]
             previous = hist['Close'].iloc[-2]
@@ -438,8 +1346,7 @@ def normalize_score(values):
     min_val, max_val = min(values), max(values)
     return [(v - min_val) / (max_val - min_val) * 100 for v in values]
 
-@st.cache_data(ttl=60)
-def get_sector_holdings_data(sector_key, market="US"):
+def get_sector_holdings_data(sector_key, market="US", deadline=None):
     if market == "US":
         holdings = SECTOR_HOLDINGS.get(sector_key, [])
         currency = "$"
@@ -449,13 +1356,14 @@ def get_sector_holdings_data(sector_key, market="US"):
         currency = "₺"
         price_col = "Fiyat (₺)"
     
+    fetched, missing = fetch_holdings_within(holdings, deadline=deadline)
     raw_data = []
     
     for symbol in holdings:
+        if symbol not in fetched:
+            continue
         try:
-            ticker = yf.Ticker(symbol)
-            hist = ticker.history(period="10d")
-            info = ticker.info
+            hist, info = fetched[symbol]
             company_name = info.get("shortName", symbol.replace(".IS", ""))
             
             forward_pe = info.get("forwardPE", 0) or 0
@@ -493,7 +1401,7 @@ def get_sector_holdings_data(sector_key, market="US"):
             pass
     
     if not raw_data:
-        return pd.DataFrame()
+        return with_missing(pd.DataFrame(), missing)
     
     valuations = normalize_score([d["_valuation"] for d in raw_data])
     growths = normalize_score([d["_growth"] for d in raw_data])
@@ -525,10 +1433,9 @@ def get_sector_holdings_data(sector_key, market="US"):
     
     df = pd.DataFrame(final_data)
     df = df.sort_values(by="Toplam Puan", ascending=False).head(5)
-    return df
+    return with_missing(df, missing)
 
-@st.cache_data(ttl=60)
-def get_top_stocks_from_sector(sector_key, sector_name, count=2, market="US"):
+def get_top_stocks_from_sector(sector_key, sector_name, count=2, market="US", deadline=None):
     """Belirli bir sektörden en yüksek puanlı hisseleri seçer"""
     if market == "US":
         holdings = SECTOR_HOLDINGS.get(sector_key, [])
@@ -537,13 +1444,14 @@ def get_top_stocks_from_sector(sector_key, sector_name, count=2, market="US"):
         holdings = BIST_SECTOR_HOLDINGS.get(sector_key, [])
         price_col = "Fiyat (₺)"
     
+    fetched, missing = fetch_holdings_within(holdings, deadline=deadline)
     raw_data = []
     
     for symbol in holdings:
+        if symbol not in fetched:
+            continue
         try:
-            ticker = yf.Ticker(symbol)
-            hist = ticker.history(period="10d")
-            info = ticker.info
+            hist, info = fetched[symbol]
             company_name = info.get("shortName", symbol.replace(".IS", ""))
             
             forward_pe = info.get("forwardPE", 0) or 0
@@ -611,11 +1519,29 @@ def get_top_stocks_from_sector(sector_key, sector_name, count=2, market="US"):
     sorted_data = sorted(final_data, key=lambda x: x["Toplam Puan"], reverse=True)
     return sorted_data[:count]
 
-@st.cache_data(ttl=60)
-def get_all_sector_candidates(sector_key, sector_name, market="US", sort_by="score"):
-    """Bir sektördeki tüm adayları puanlarıyla döndürür
+def screen_sector_candidates(screen, sector_key, sector_name, sort_by="score"):
+    """Endeks taramasındaki bir ABD sektörünün tüm şirketlerini get_all_sector_candidates biçiminde döndürür"""
+    rows = screen[screen["sector"] == US_SECTOR_PROVIDER_SECTORS.get(sector_key)]
+    rows = rows.sort_values("money_flow_score" if sort_by == "money_flow" else "total_score", ascending=False, kind="stable")
+    names = rows["short_name"].fillna(rows["symbol"])
+    return [{
+        "Sembol": row.symbol,
+        "Şirket": name[:20],
+        "Sektör": sector_name,
+        "Fiyat ($)": round(row.price, 2),
+        "Günlük Değişim (%)": round(row.daily_change, 2),
+        "Toplam Puan": row.total_score,
+        "Para Akışı Puanı": row.money_flow_score
+    } for row, name in zip(rows.itertuples(), names)]
+
+def get_all_sector_candidates(sector_key, sector_name, market="US", sort_by="score", deadline=None, prefetched=None, screen=None, sources=None):
+    """Bir sektördeki tüm adayları puanlarıyla döndürür: (adaylar, eksik semboller)
     sort_by: 'score' = 5 kriter ortalaması, 'money_flow' = hacim/para akışı
+    prefetched: birden çok sektör için bir kez toplanmış fetch_holdings_within sonucu
+    screen: ABD için endeks taraması; verilirse adaylar sektörün tüm endeks bileşenlerinden seçilir
     """
+    if screen is not None:
+        return screen_sector_candidates(screen, sector_key, sector_name, sort_by), []
     if market == "US":
         holdings = SECTOR_HOLDINGS.get(sector_key, [])
         price_col = "Fiyat ($)"
@@ -623,13 +1549,18 @@ def get_all_sector_candidates(sector_key, sector_name, market="US", sort_by="sco
         holdings = BIST_SECTOR_HOLDINGS.get(sector_key, [])
         price_col = "Fiyat (₺)"
     
+    if prefetched is None:
+        fetched, missing = fetch_holdings_within(holdings, deadline=deadline, sources=sources)
+    else:
+        fetched, all_missing = prefetched
+        missing = [s for s in holdings if s in all_missing]
     raw_data = []
     
     for symbol in holdings:
+        if symbol not in fetched:
+            continue
         try:
-            ticker = yf.Ticker(symbol)
-            hist = ticker.history(period="10d")
-            info = ticker.info
+            hist, info = fetched[symbol]
             company_name = info.get("shortName", symbol.replace(".IS", ""))
             
             forward_pe = info.get("forwardPE", 0) or 0
@@ -677,7 +1608,7 @@ def get_all_sector_candidates(sector_key, sector_name, market="US", sort_by="sco
             pass
     
     if not raw_data:
-        return []
+        return [], missing
     
     valuations = normalize_score([d["_valuation"] for d in raw_data])
     growths = normalize_score([d["_growth"] for d in raw_data])
@@ -707,17 +1638,82 @@ def get_all_sector_candidates(sector_key, sector_name, market="US", sort_by="sco
         })
     
     if sort_by == "money_flow":
-        return sorted(final_data, key=lambda x: x["Para Akışı Puanı"], reverse=True)
-    return sorted(final_data, key=lambda x: x["Toplam Puan"], reverse=True)
+        return sorted(final_data, key=lambda x: x["Para Akışı Puanı"], reverse=True), missing
+    return sorted(final_data, key=lambda x: x["Toplam Puan"], reverse=True), missing
 
-@st.cache_data(ttl=60)
-def get_portfolio_data(period_key="1 Gün", market="US"):
-    sector_df = get_sector_data(period_key, market)
+def sector_candidate_source(market, sector_keys, deadline=None, sources=None):
+    """ABD'de hazır endeks taraması varsa onu, yoksa (ve BIST'te) seçili sektörlerin tek seferde indirilen hisselerini döndürür: (tarama, prefetched)"""
+    if market == "US":
+        if sources is None:
+            screen = load_screen_results(INDEX_BY_MARKET[market])
+        else:
+            screen = read_screen_results(sources.session_factory, INDEX_BY_MARKET[market])
+        if not screen.empty:
+            return screen, None
+    # Birden fazla sektörde bulunan hisseler bir kez indirilir
+    return None, fetch_holdings_within(UNIVERSE.fetch_set(market, sector_keys), deadline=deadline, sources=sources)
+
+class QuotaPolicy:
+    """Portföy kurma kuralı: sektör sırasına göre hisse kotaları (ilk len(quotas) sektör), tekilleştirme kuralı ve sıralama puanı
+    dedupe="best_sector": birden fazla sektörde aday olan hisse önce en yüksek puanı aldığı sektöre sunulur, kalan kota en iyi boştaki adaylarla dolar
+    dedupe="rank_order": hisseyi sıradaki ilk sektör alır"""
+    def __init__(self, quotas=(2, 2, 2, 2, 1, 1), dedupe="best_sector", score_column="Toplam Puan"):
+        self.quotas = tuple(quotas)
+        self.dedupe = dedupe
+        self.score_column = score_column
+
+    @property
+    def top_sectors(self):
+        return len(self.quotas)
+
+SYSTEM_QUOTA_POLICY = QuotaPolicy()
+MONEY_FLOW_QUOTA_POLICY = QuotaPolicy(score_column="Para Akışı Puanı")
+MOMENTUM_QUOTA_POLICY = QuotaPolicy(dedupe="rank_order", score_column="Momentum Puanı")
+
+def sector_candidate_frame(sector_candidates):
+    """{sektör: aday listesi} sözlüğünü (sektör sırasıyla) sector_rank sütunlu tek aday tablosuna çevirir"""
+    frames = [pd.DataFrame(candidates).assign(sector_rank=rank)
+              for rank, candidates in enumerate(sector_candidates.values(), start=1) if candidates]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def construct_portfolio(candidates, policy):
+    """Sembol, sector_rank ve puan sütunlu aday tablosundan kota politikasına göre portföy seçer
+    Seçilen satırları seçim sırasıyla döndürür; sektör başına tek geçiş, toplamda aday sayısıyla doğrusal"""
+    if candidates.empty:
+        return candidates
+    score = policy.score_column
+    ranked = candidates[candidates["sector_rank"] <= policy.top_sectors]
+    ranked = ranked.sort_values(["sector_rank", score], ascending=[True, False], kind="stable")
+    if policy.dedupe == "best_sector":
+        # Eşit puanda sıradaki ilk sektör kazanır
+        best_rank = (ranked.sort_values([score, "sector_rank"], ascending=[False, True], kind="stable")
+                     .drop_duplicates("Sembol").set_index("Sembol")["sector_rank"])
+        owned = ranked["Sembol"].map(best_rank) == ranked["sector_rank"]
+    else:
+        owned = pd.Series(True, index=ranked.index)
+    
+    used = set()
+    picks = []
+    for rank, rows in ranked.groupby("sector_rank", sort=True):
+        quota = policy.quotas[rank - 1]
+        available = ~rows["Sembol"].isin(used)
+        first = rows[available & owned[rows.index]].head(quota)
+        rest = rows[available & ~owned[rows.index]].head(quota - len(first))
+        chosen = pd.concat([first, rest])
+        used.update(chosen["Sembol"])
+        picks.append(chosen)
+    return pd.concat(picks)
+
+def get_portfolio_data(period_key="1 Gün", market="US", deadline=None, weighting="equal", sources=None):
+    if deadline is None:
+        deadline = section_deadline()
+    sector_df = get_sector_data(period_key, market, deadline, weighting, sources)
+    missing = list(sector_df.attrs.get("missing", []))
     
     sector_df = sector_df[sector_df["Değişim (%)"] > 0]
     
     if len(sector_df) == 0:
-        return pd.DataFrame()
+        return with_missing(pd.DataFrame(), missing)
     
     sector_df = sector_df.sort_values(by="Değişim (%)", ascending=False)
     
@@ -726,77 +1722,38 @@ def get_portfolio_data(period_key="1 Gün", market="US"):
     else:
         sector_map = BIST_SECTORS
     
-    top_6_sectors = sector_df.head(6)
+    top_sectors = sector_df.head(SYSTEM_QUOTA_POLICY.top_sectors)
+    screen, prefetched = sector_candidate_source(market, [sector_map.get(name, "") for name in top_sectors["Sektör"]], deadline, sources)
     
     sector_candidates = {}
-    sector_quotas = {}
-    
-    for idx, row in top_6_sectors.iterrows():
-        sector_name = row["Sektör"]
+    for sector_name in top_sectors["Sektör"]:
         sector_key = sector_map.get(sector_name, "")
-        rank = list(top_6_sectors.index).index(idx) + 1
-        
-        candidates = get_all_sector_candidates(sector_key, sector_name, market)
+        candidates, sector_missing = get_all_sector_candidates(sector_key, sector_name, market, deadline=deadline, prefetched=prefetched, screen=screen, sources=sources)
+        missing.extend(s for s in sector_missing if s not in missing)
         sector_candidates[sector_name] = candidates
-        sector_quotas[sector_name] = 2 if rank <= 4 else 1
-    
-    symbol_best_sector = {}
-    for sector_name, candidates in sector_candidates.items():
-        for candidate in candidates:
-            symbol = candidate["Sembol"]
-            score = candidate["Toplam Puan"]
-            if symbol not in symbol_best_sector or score > symbol_best_sector[symbol]["score"]:
-                symbol_best_sector[symbol] = {"sector": sector_name, "score": score}
-    
-    final_picks = []
-    used_symbols = set()
-    
-    for sector_name in sector_quotas.keys():
-        quota = sector_quotas[sector_name]
-        candidates = sector_candidates[sector_name]
-        selected = 0
-        
-        for candidate in candidates:
-            if selected >= quota:
-                break
-            symbol = candidate["Sembol"]
-            
-            if symbol in used_symbols:
-                continue
-            
-            if symbol_best_sector[symbol]["sector"] == sector_name:
-                final_picks.append(candidate)
-                used_symbols.add(symbol)
-                selected += 1
-            else:
-                continue
-        
-        for candidate in candidates:
-            if selected >= quota:
-                break
-            symbol = candidate["Sembol"]
-            if symbol not in used_symbols:
-                final_picks.append(candidate)
-                used_symbols.add(symbol)
-                selected += 1
-    
-    if not final_picks:
-        return pd.DataFrame()
     
-    return pd.DataFrame(final_picks)
+    picks = construct_portfolio(sector_candidate_frame(sector_candidates), SYSTEM_QUOTA_POLICY)
+    if picks.empty:
+        return with_missing(pd.DataFrame(), missing)
+    
+    result_df = with_missing(picks.drop(columns="sector_rank").reset_index(drop=True), missing)
+    result_df.attrs["sectors"] = top_sectors.to_dict("records")
+    return result_df
 
-@st.cache_data(ttl=60)
-def get_money_flow_portfolio(period_key="1 Gün", market="US"):
+def get_money_flow_portfolio(period_key="1 Gün", market="US", deadline=None, weighting="equal", sources=None):
     """Sadece para akışına göre hisse seçimi yapar - hem sektörler hem hisseler para akışına göre sıralanır"""
-    sector_df = get_sector_data(period_key, market)
+    if deadline is None:
+        deadline = section_deadline()
+    sector_df = get_sector_data(period_key, market, deadline, weighting, sources)
+    missing = list(sector_df.attrs.get("missing", []))
     
     if "Para Akışı (%)" not in sector_df.columns:
-        return pd.DataFrame()
+        return with_missing(pd.DataFrame(), missing)
     
     sector_df = sector_df[sector_df["Para Akışı (%)"] > 0]
     
     if len(sector_df) == 0:
-        return pd.DataFrame()
+        return with_missing(pd.DataFrame(), missing)
     
     sector_df = sector_df.sort_values(by="Para Akışı (%)", ascending=False)
     
@@ -805,179 +1762,92 @@ def get_money_flow_portfolio(period_key="1 Gün", market="US"):
     else:
         sector_map = BIST_SECTORS
     
-    top_6_sectors = sector_df.head(6)
+    top_sectors = sector_df.head(MONEY_FLOW_QUOTA_POLICY.top_sectors)
+    screen, prefetched = sector_candidate_source(market, [sector_map.get(name, "") for name in top_sectors["Sektör"]], deadline, sources)
     
     sector_candidates = {}
-    sector_quotas = {}
-    
-    for idx, row in top_6_sectors.iterrows():
-        sector_name = row["Sektör"]
+    for sector_name in top_sectors["Sektör"]:
         sector_key = sector_map.get(sector_name, "")
-        rank = list(top_6_sectors.index).index(idx) + 1
-        
-        candidates = get_all_sector_candidates(sector_key, sector_name, market, sort_by="money_flow")
+        candidates, sector_missing = get_all_sector_candidates(sector_key, sector_name, market, sort_by="money_flow", deadline=deadline, prefetched=prefetched, screen=screen, sources=sources)
+        missing.extend(s for s in sector_missing if s not in missing)
         sector_candidates[sector_name] = candidates
-        sector_quotas[sector_name] = 2 if rank <= 4 else 1
-    
-    symbol_best_sector = {}
-    for sector_name, candidates in sector_candidates.items():
-        for candidate in candidates:
-            symbol = candidate["Sembol"]
-            score = candidate.get("Para Akışı Puanı", 0)
-            if symbol not in symbol_best_sector or score > symbol_best_sector[symbol]["score"]:
-                symbol_best_sector[symbol] = {"sector": sector_name, "score": score}
-    
-    final_picks = []
-    used_symbols = set()
-    
-    for sector_name in sector_quotas.keys():
-        quota = sector_quotas[sector_name]
-        candidates = sector_candidates[sector_name]
-        selected = 0
-        
-        for candidate in candidates:
-            if selected >= quota:
-                break
-            symbol = candidate["Sembol"]
-            
-            if symbol in used_symbols:
-                continue
-            
-            if symbol_best_sector[symbol]["sector"] == sector_name:
-                final_picks.append(candidate)
-                used_symbols.add(symbol)
-                selected += 1
-            else:
-                continue
-        
-        for candidate in candidates:
-            if selected >= quota:
-                break
-            symbol = candidate["Sembol"]
-            if symbol not in used_symbols:
-                final_picks.append(candidate)
-                used_symbols.add(symbol)
-                selected += 1
-    
-    if not final_picks:
-        return pd.DataFrame()
     
-    result_df = pd.DataFrame(final_picks)
-    if "Para Akışı Puanı" in result_df.columns:
-        result_df = result_df.drop(columns=["Para Akışı Puanı"])
+    picks = construct_portfolio(sector_candidate_frame(sector_candidates), MONEY_FLOW_QUOTA_POLICY)
+    if picks.empty:
+        return with_missing(pd.DataFrame(), missing)
+    
+    result_df = with_missing(picks.drop(columns="sector_rank").reset_index(drop=True), missing)
+    result_df.attrs["sectors"] = top_sectors.to_dict("records")
     return result_df
 
+def profile_metrics(fundamentals):
+    """Temel veri tablosundan profil kurallarının okuduğu beta, F/K, PEG, temettü ve borç/özkaynak sütunları"""
+    forward_pe = fundamentals["forward_pe"].replace(0, np.nan)
+    trailing_pe = fundamentals["trailing_pe"].replace(0, np.nan)
+    debt_equity = fundamentals["debt_to_equity"].fillna(0)
+    return pd.DataFrame({
+        "short_name": fundamentals["short_name"],
+        "beta": fundamentals["beta"].replace(0, np.nan).fillna(1.0),
+        "pe": forward_pe.fillna(trailing_pe).fillna(0),
+        "peg": fundamentals["peg_ratio"].fillna(0),
+        "dividend_yield": fundamentals["dividend_yield"].fillna(0) * 100,
+        # Yahoo borç/özkaynağı çoğunlukla yüzde olarak verir
+        "debt_equity": debt_equity.where(debt_equity <= 10, debt_equity / 100),
+    }, index=fundamentals.index)
+
+PROFILE_MIN_MATCH = 40
+PROFILE_PICK_COUNT = 10
+
 @st.cache_data(ttl=120)
 def get_profile_based_stocks(profile_name, market="US"):
-    """Yatırımcı profiline göre hisse seçimi yapar"""
+    """Yatırımcı profiline göre hisse seçimi yapar: önce önbellekteki temel verilerle elenir, fiyat yalnızca kalanlar için istenir"""
     if profile_name not in INVESTOR_PROFILES:
         return pd.DataFrame()
     
     profile = INVESTOR_PROFILES[profile_name]
     
+    all_symbols = UNIVERSE.fetch_set(market)
     if market == "US":
-        all_symbols = []
-        for symbols in SECTOR_HOLDINGS.values():
-            all_symbols.extend(symbols)
-        all_symbols = list(set(all_symbols))
-        currency = "$"
         price_col = "Fiyat ($)"
     else:
-        all_symbols = []
-        for symbols in BIST_SECTOR_HOLDINGS.values():
-            all_symbols.extend(symbols)
-        all_symbols = list(set(all_symbols))
-        currency = "₺"
         price_col = "Fiyat (₺)"
     
-    matching_stocks = []
+    # 1. aşama: kurallar temel veri tablosunun tamamına tek seferde uygulanır; tablo arka plan taramasında tazelenir
+    session = get_session()
+    try:
+        fundamentals = load_fundamentals(session, all_symbols)
+    finally:
+        session.close()
+    if fundamentals.empty:
+        pending = pd.DataFrame()
+        pending.attrs["pending"] = True
+        return pending
     
-    for symbol in all_symbols[:50]:
-        try:
-            ticker = yf.Ticker(symbol)
-            info = ticker.info
-            hist = ticker.history(period="5d")
-            
-            if len(hist) < 2:
-                continue
-            
-            beta = info.get("beta", 1.0) or 1.0
-            pe = info.get("forwardPE") or info.get("trailingPE") or 0
-            peg = info.get("pegRatio") or 0
-            dividend_yield = (info.get("dividendYield") or 0) * 100
-            debt_equity = info.get("debtToEquity") or 0
-            if debt_equity > 10:
-                debt_equity = debt_equity / 100
-            
-            current_price = hist['Close'].iloc[-1]
-            prev_price = hist['Close'].iloc[-2]
-            daily_change = ((current_price - prev_price) / prev_price) * 100
-            
-            company_name = info.get("shortName", symbol.replace(".IS", ""))
-            
-            score = 0
-            max_score = 0
-            
-            if "beta_min" in profile and "beta_max" in profile:
-                max_score += 1
-                if profile["beta_min"] <= beta <= profile["beta_max"]:
-                    score += 1
-            
-            if "pe_max" in profile:
-                max_score += 1
-                if pe > 0 and pe <= profile["pe_max"]:
-                    score += 1
-            elif "pe_min" in profile:
-                max_score += 1
-                if pe >= profile["pe_min"]:
-                    score += 1
-            
-            if "dividend_min" in profile:
-                max_score += 1
-                if dividend_yield >= profile["dividend_min"]:
-                    score += 1
-            elif "dividend_max" in profile:
-                max_score += 1
-                if dividend_yield <= profile["dividend_max"]:
-                    score += 1
-            
-            if "debt_equity_max" in profile:
-                max_score += 1
-                if debt_equity <= profile["debt_equity_max"]:
-                    score += 1
-            
-            if "peg_max" in profile:
-                max_score += 1
-                if peg > 0 and peg <= profile["peg_max"]:
-                    score += 1
-            elif "peg_min" in profile and "peg_max" in profile:
-                max_score += 1
-                if profile["peg_min"] <= peg <= profile["peg_max"]:
-                    score += 1
-            
-            match_percent = (score / max_score * 100) if max_score > 0 else 0
-            
-            if match_percent >= 40:
-                matching_stocks.append({
-                    "Sembol": symbol,
-                    "Şirket": company_name[:25],
-                    price_col: round(current_price, 2),
-                    "Günlük Değişim (%)": round(daily_change, 2),
-                    "Beta": round(beta, 2),
-                    "F/K": round(pe, 1) if pe else "-",
-                    "Temettü (%)": round(dividend_yield, 2),
-                    "Borç/Özkaynak": round(debt_equity, 2),
-                    "Uyum (%)": round(match_percent, 0)
-                })
-        except:
-            continue
+    metrics = profile_metrics(fundamentals.reindex([s for s in all_symbols if s in fundamentals.index]))
+    metrics["match"] = profile["match_percent"](metrics)
+    survivors = metrics[metrics["match"] >= PROFILE_MIN_MATCH]
+    if survivors.empty:
+        return pd.DataFrame()
     
-    if not matching_stocks:
+    # 2. aşama: yalnızca eşleşen semboller için tek toplu fiyat isteği
+    quotes, _ = get_quote_snapshot(list(survivors.index))
+    matched = survivors.join(quotes, how="inner")
+    if matched.empty:
         return pd.DataFrame()
     
-    df = pd.DataFrame(matching_stocks)
-    df = df.sort_values(by="Uyum (%)", ascending=False).head(10)
-    return df
+    matched = matched.sort_values(by="match", ascending=False, kind="stable").head(PROFILE_PICK_COUNT)
+    names = matched["short_name"].fillna(pd.Series(matched.index.str.replace(".IS", ""), index=matched.index))
+    return pd.DataFrame({
+        "Sembol": matched.index,
+        "Şirket": names.str[:25].values,
+        price_col: matched["price"].round(2).values,
+        "Günlük Değişim (%)": matched["change_pct"].round(2).values,
+        "Beta": matched["beta"].round(2).values,
+        "F/K": [round(pe, 1) if pe else "-" for pe in matched["pe"]],
+        "Temettü (%)": matched["dividend_yield"].round(2).values,
+        "Borç/Özkaynak": matched["debt_equity"].round(2).values,
+        "Uyum (%)": matched["match"].round(0).values
+    })
 
 BACKTEST_INTERVALS = {
     "Haftalık": 7,
@@ -996,7 +1866,7 @@ def get_fmp_historical_ratios(symbol):
         return None
     try:
         url = f"https://financialmodelingprep.com/api/v3/ratios/{symbol}?limit=40&apikey={FMP_API_KEY}"
-        response = requests.get(url, timeout=10)
+        response = coalesced_get(url)
         if response.status_code == 200:
             data = response.json()
             if isinstance(data, list) and len(data) > 0:
@@ -1015,7 +1885,7 @@ def get_fmp_historical_growth(symbol):
         return None
     try:
         url = f"https://financialmodelingprep.com/api/v3/financial-growth/{symbol}?limit=40&apikey={FMP_API_KEY}"
-        response = requests.get(url, timeout=10)
+        response = coalesced_get(url)
         if response.status_code == 200:
             data = response.json()
             if isinstance(data, list) and len(data) > 0:
@@ -1034,7 +1904,7 @@ def get_fmp_analyst_estimates(symbol):
         return None
     try:
         url = f"https://financialmodelingprep.com/api/v3/analyst-estimates/{symbol}?limit=40&apikey={FMP_API_KEY}"
-        response = requests.get(url, timeout=10)
+        response = coalesced_get(url)
         if response.status_code == 200:
             data = response.json()
             if isinstance(data, list) and len(data) > 0:
@@ -1149,7 +2019,7 @@ def calculate_fmp_stock_scores_for_sector(symbols, ref_date):
     
     return sorted(scored_data, key=lambda x: x['score'], reverse=True)
 
-def run_fmp_backtest_simulation(start_date, interval_days, period_key):
+def run_fmp_backtest_simulation(start_date, interval_days, period_key, weighting="equal"):
     """FMP verileriyle tam 5 kriterli backtesting simülasyonu - canlı sistemle aynı mantık"""
     results = []
     portfolio_value = 100.0
@@ -1171,67 +2041,21 @@ def run_fmp_backtest_simulation(start_date, interval_days, period_key):
         
         sector_df = pd.DataFrame(sector_performances)
         sector_df = sector_df.sort_values(by="Performans", ascending=False)
-        top_6 = sector_df.head(6)
+        top_sectors = sector_df.head(SYSTEM_QUOTA_POLICY.top_sectors)
         
         sector_candidates = {}
-        sector_quotas = {}
-        
-        for idx, (_, row) in enumerate(top_6.iterrows()):
-            sector_name = row["Sektör"]
-            etf_symbol = row["ETF"]
-            holdings = SECTOR_HOLDINGS.get(etf_symbol, [])
-            
+        for _, row in top_sectors.iterrows():
+            holdings = SECTOR_HOLDINGS.get(row["ETF"], [])
             scored_stocks = calculate_fmp_stock_scores_for_sector(holdings, current_date)
-            sector_candidates[sector_name] = scored_stocks
-            sector_quotas[sector_name] = 2 if idx < 4 else 1
-        
-        symbol_best_sector = {}
-        for sector_name, candidates in sector_candidates.items():
-            for candidate in candidates:
-                symbol = candidate['symbol']
-                score = candidate['score']
-                if symbol not in symbol_best_sector or score > symbol_best_sector[symbol]['score']:
-                    symbol_best_sector[symbol] = {'sector': sector_name, 'score': score}
+            sector_candidates[row["Sektör"]] = [{"Sembol": s["symbol"], "Toplam Puan": s["score"]} for s in scored_stocks]
         
-        final_picks = []
-        used_symbols = set()
-        
-        for sector_name in sector_quotas.keys():
-            quota = sector_quotas[sector_name]
-            candidates = sector_candidates[sector_name]
-            selected = 0
-            
-            for candidate in candidates:
-                if selected >= quota:
-                    break
-                symbol = candidate['symbol']
-                
-                if symbol in used_symbols:
-                    continue
-                
-                if symbol_best_sector[symbol]['sector'] == sector_name:
-                    final_picks.append(symbol)
-                    used_symbols.add(symbol)
-                    selected += 1
-            
-            for candidate in candidates:
-                if selected >= quota:
-                    break
-                symbol = candidate['symbol']
-                if symbol not in used_symbols:
-                    final_picks.append(symbol)
-                    used_symbols.add(symbol)
-                    selected += 1
+        picks = construct_portfolio(sector_candidate_frame(sector_candidates), SYSTEM_QUOTA_POLICY)
+        final_picks = list(picks["Sembol"]) if not picks.empty else []
         
         if final_picks:
-            returns = []
-            for symbol in final_picks:
-                ret = get_historical_stock_return(symbol, current_date, next_date)
-                if ret is not None:
-                    returns.append(ret)
-            
-            if returns:
-                avg_return = sum(returns) / len(returns)
+            period_returns = pd.Series({symbol: get_historical_stock_return(symbol, current_date, next_date) for symbol in final_picks}, dtype=float)
+            avg_return = weighted_return(period_returns, history_weights(final_picks, current_date, weighting))
+            if avg_return is not None:
                 portfolio_value = portfolio_value * (1 + avg_return / 100)
         
         results.append({
@@ -1247,9 +2071,8 @@ def run_fmp_backtest_simulation(start_date, interval_days, period_key):
 def get_historical_sector_performance(etf_symbol, start_date, end_date):
     """Belirli tarih aralığında sektör performansını hesaplar (bir gün önceki veri)"""
     try:
-        ticker = yf.Ticker(etf_symbol)
         adj_end = end_date - timedelta(days=1)
-        hist = ticker.history(start=start_date, end=adj_end)
+        hist = get_price_history_range(etf_symbol, start_date, adj_end)
         if len(hist) >= 2:
             start_price = hist['Close'].iloc[0]
             end_price = hist['Close'].iloc[-1]
@@ -1261,8 +2084,7 @@ def get_historical_sector_performance(etf_symbol, start_date, end_date):
 def get_historical_stock_return(symbol, start_date, end_date):
     """Belirli tarih aralığında hisse getirisini hesaplar"""
     try:
-        ticker = yf.Ticker(symbol)
-        hist = ticker.history(start=start_date, end=end_date)
+        hist = get_price_history_range(symbol, start_date, end_date)
         if len(hist) >= 2:
             start_price = hist['Close'].iloc[0]
             end_price = hist['Close'].iloc[-1]
@@ -1284,10 +2106,9 @@ PERIOD_LOOKBACK_DAYS = {
 def get_historical_momentum_score(symbol, ref_date):
     """Belirli bir tarihteki hisse momentum skorunu hesaplar (bir gün önceki veri)"""
     try:
-        ticker = yf.Ticker(symbol)
         start = ref_date - timedelta(days=35)
         adj_end = ref_date - timedelta(days=1)
-        hist = ticker.history(start=start, end=adj_end)
+        hist = get_price_history_range(symbol, start, adj_end)
         
         if len(hist) >= 5:
             current = hist['Close'].iloc[-1]
@@ -1302,7 +2123,7 @@ def get_historical_momentum_score(symbol, ref_date):
     except:
         return None
 
-def run_backtest_simulation(start_date, interval_days, period_key):
+def run_backtest_simulation(start_date, interval_days, period_key, weighting="equal"):
     """Backtesting simülasyonu - momentum bazlı (tarihsel veri sınırlaması nedeniyle)"""
     results = []
     portfolio_value = 100.0
@@ -1324,50 +2145,466 @@ def run_backtest_simulation(start_date, interval_days, period_key):
         
         sector_df = pd.DataFrame(sector_performances)
         sector_df = sector_df.sort_values(by="Performans", ascending=False)
-        top_6 = sector_df.head(6)
-        
-        all_candidates = []
-        used_symbols = set()
+        top_sectors = sector_df.head(MOMENTUM_QUOTA_POLICY.top_sectors)
         
-        for idx, (_, row) in enumerate(top_6.iterrows()):
-            etf_symbol = row["ETF"]
-            holdings = SECTOR_HOLDINGS.get(etf_symbol, [])
-            quota = 2 if idx < 4 else 1
-            
-            sector_stocks = []
-            for symbol in holdings:
-                if symbol in used_symbols:
-                    continue
-                score = get_historical_momentum_score(symbol, current_date)
-                if score is not None:
-                    sector_stocks.append({"symbol": symbol, "score": score})
-            
-            sector_stocks.sort(key=lambda x: x["score"], reverse=True)
-            
-            for stock in sector_stocks[:quota]:
-                all_candidates.append(stock["symbol"])
-                used_symbols.add(stock["symbol"])
+        sector_candidates = {}
+        for _, row in top_sectors.iterrows():
+            scores = {symbol: get_historical_momentum_score(symbol, current_date) for symbol in SECTOR_HOLDINGS.get(row["ETF"], [])}
+            sector_candidates[row["Sektör"]] = [{"Sembol": symbol, "Momentum Puanı": score} for symbol, score in scores.items() if score is not None]
+        picks = construct_portfolio(sector_candidate_frame(sector_candidates), MOMENTUM_QUOTA_POLICY)
+        all_candidates = list(picks["Sembol"]) if not picks.empty else []
         
         if all_candidates:
-            returns = []
-            for symbol in all_candidates:
-                ret = get_historical_stock_return(symbol, current_date, next_date)
-                if ret is not None:
-                    returns.append(ret)
-            
-            if returns:
-                avg_return = sum(returns) / len(returns)
+            period_returns = pd.Series({symbol: get_historical_stock_return(symbol, current_date, next_date) for symbol in all_candidates}, dtype=float)
+            avg_return = weighted_return(period_returns, history_weights(all_candidates, current_date, weighting))
+            if avg_return is not None:
                 portfolio_value = portfolio_value * (1 + avg_return / 100)
         
-        results.append({
-            "Tarih": current_date,
-            "Portföy Değeri": round(portfolio_value, 2),
-            "Seçilen Hisse": len(all_candidates)
+        results.append({
+            "Tarih": current_date,
+            "Portföy Değeri": round(portfolio_value, 2),
+            "Seçilen Hisse": len(all_candidates)
+        })
+        
+        current_date = next_date
+    
+    return pd.DataFrame(results)
+
+MARKET_BENCHMARKS = {"US": "SPY", "BIST": "XU100.IS"}
+BETA_WINDOW_DAYS = 252
+# Yıllık rapor dönem sonundan ancak bu kadar gün sonra yayımlanmış sayılır (ileriye bakmayı önler)
+FMP_REPORT_LAG_DAYS = int(os.environ.get("FMP_REPORT_LAG_DAYS", "90"))
+FMP_PROFILE_FIELDS = {
+    "priceEarningsRatio": "trailing_pe",
+    "priceEarningsToGrowthRatio": "peg_ratio",
+    "dividendYield": "dividend_yield",
+    "debtEquityRatio": "debt_to_equity",
+}
+
+# Çok yıllık paneller büyüktür; birkaç başlangıç tarihi için ve günde bir kez yenilenecek şekilde tutulur
+BACKTEST_PANEL_CACHE_ENTRIES = 4
+
+@st.cache_data(ttl=CANONICAL_FULL_REFRESH_SECONDS, max_entries=BACKTEST_PANEL_CACHE_ENTRIES, show_spinner=False)
+def load_backtest_panel(symbols, start):
+    """Backtest stratejilerinin ortak fiyat/hacim paneli: tüm semboller başlangıçtan bugüne tek toplu istekte"""
+    return download_panel(symbols, start)
+
+def get_backtest_panel(market, start_date, extra_symbols=()):
+    """Piyasanın sektör serileri, hisseleri ve endeksi için panel; en uzun dönem ve beta penceresi kadar geriden başlar"""
+    symbols = list(UNIVERSE.fetch_set(market)) + list(extra_symbols) + [MARKET_BENCHMARKS[market]]
+    if market == "US":
+        symbols = list(US_SECTOR_ETFS.values()) + symbols
+    start = start_date - timedelta(days=CANONICAL_HISTORY_DAYS)
+    try:
+        return load_backtest_panel(tuple(dict.fromkeys(symbols)), start)
+    except Exception:
+        return None
+
+def rebalance_dates(start_date, interval_days):
+    dates = []
+    current_date = start_date
+    today = datetime.now().date()
+    while current_date < today:
+        dates.append(current_date)
+        current_date = current_date + timedelta(days=interval_days)
+    return dates
+
+def bars_before(index, date):
+    """'date' gününden önceki son barın konumu; yoksa -1"""
+    return int(index.searchsorted(pd.Timestamp(date).tz_localize(index.tz), side="left")) - 1
+
+def rolling_mfi(panel, period):
+    """Panelin her sütunu için her gün biten 'period' günlük MFI; calculate_mfi'nin vektörel karşılığı"""
+    typical = (panel["High"] + panel["Low"] + panel["Close"]) / 3
+    money_flow = typical * panel["Volume"]
+    direction = typical.diff()
+    positive = money_flow.where(direction > 0, 0).where(direction.notna()).rolling(period).sum()
+    negative = money_flow.where(direction < 0, 0).where(direction.notna()).rolling(period).sum()
+    mfi = 100 - 100 / (1 + positive / negative)
+    mfi = mfi.mask(negative == 0, 100.0).mask(positive == 0, 0.0).mask((positive == 0) & (negative == 0), 50.0)
+    return mfi.round(2)
+
+def historical_sector_panel(panel, market):
+    """Sektör serileri panel biçiminde (sütunlar sektör anahtarları): ABD'de sektör ETF'leri, BIST'te sentetik endeksler
+    Piyasa değerleri bugüne ait olduğundan BIST endeksleri geçmişte eşit ağırlıklı kurulur"""
+    if market == "US":
+        etfs = [etf for etf in US_SECTOR_ETFS.values() if etf in panel["Close"].columns]
+        return {field: frame[etfs] for field, frame in panel.items()}
+    indices = {}
+    for sector_key, members in BIST_SECTOR_HOLDINGS.items():
+        members = [s for s in members if s in panel["Close"].columns]
+        if members:
+            indices[sector_key] = synthetic_sector_index(panel, members, pd.Series(1.0, index=members))
+    return {field: pd.DataFrame({key: index[field] for key, index in indices.items()}).reindex(panel["Close"].index)
+            for field in ("Close", "High", "Low", "Volume")}
+
+def sector_mfi_history(sector_panel, period_key):
+    """Sektörlerin günlük MFI geçmişi; pencere canlı sector_metrics ile aynı"""
+    fetch_period, lookback_days = PERIOD_OPTIONS.get(period_key, ("2d", 1))
+    window = max(5, lookback_days)
+    if int(fetch_period[:-1]) < window + 1:
+        # Canlı hesapta da dönem penceresi MFI için yetersiz kalır ve nötr (50) döner
+        return pd.DataFrame(50.0, index=sector_panel["Close"].index, columns=sector_panel["Close"].columns)
+    return rolling_mfi(sector_panel, window)
+
+def money_flow_changes(panel):
+    """Her gün için bir önceki güne göre para akışı (fiyat x hacim) değişimi; canlı aday hesabıyla aynı"""
+    closes, volumes = panel["Close"], panel["Volume"]
+    prev_money_flow = closes.shift(1) * volumes.shift(1).where(lambda v: v > 0, 1)
+    return ((closes * volumes - prev_money_flow) / prev_money_flow * 100).mask(prev_money_flow <= 0, 0)
+
+def beta_history(closes, benchmark, window=BETA_WINDOW_DAYS):
+    """Her gün için son 'window' günlük getirilerle endekse göre beta"""
+    returns = closes.pct_change(fill_method=None)
+    market_returns = returns[benchmark]
+    covariance = returns.rolling(window, min_periods=window // 2).cov(market_returns)
+    variance = market_returns.rolling(window, min_periods=window // 2).var()
+    return covariance.div(variance, axis=0)
+
+def fmp_fundamental_reports(symbols):
+    """FMP yıllık rasyolarından profil alanları; her rapor dönem sonundan FMP_REPORT_LAG_DAYS gün sonra kullanılabilir"""
+    frames = []
+    for symbol in symbols:
+        ratios = get_fmp_historical_ratios(symbol)
+        if ratios is None:
+            continue
+        report = ratios.reindex(columns=list(FMP_PROFILE_FIELDS)).rename(columns=FMP_PROFILE_FIELDS).astype(float)
+        report["symbol"] = symbol
+        report["available_from"] = (ratios["date"] + pd.Timedelta(days=FMP_REPORT_LAG_DAYS)).astype("datetime64[ns]")
+        frames.append(report)
+    if not frames:
+        # Boş tablo da dolu olanla aynı tiplerde olmalı; merge_asof nesne tipli tarih sütununu reddeder
+        return pd.DataFrame({"symbol": pd.Series(dtype=object), "available_from": pd.Series(dtype="datetime64[ns]"),
+                             **{column: pd.Series(dtype=float) for column in FMP_PROFILE_FIELDS.values()}})
+    return pd.concat(frames, ignore_index=True)
+
+def point_in_time_fundamentals(reports, dates, symbols):
+    """Her tarih ve sembol için o gün yayımlanmış son rapor: {tarih: sembol indeksli tablo}"""
+    if reports.empty:
+        return {}
+    grid = pd.DataFrame({"as_of": pd.to_datetime(list(dates)).astype("datetime64[ns]")}).merge(pd.DataFrame({"symbol": list(symbols)}), how="cross")
+    known = pd.merge_asof(grid.sort_values("as_of", kind="stable"), reports.dropna(subset=["available_from"]).sort_values("available_from"),
+                          left_on="as_of", right_on="available_from", by="symbol")
+    known = known.dropna(subset=["available_from"])
+    return {as_of.date(): frame.set_index("symbol") for as_of, frame in known.groupby("as_of")}
+
+def run_panel_backtest(panel, start_date, interval_days, select, weighting="equal"):
+    """Ortak panel üzerinde backtest; select(tarih, bar_konumu) o güne kadarki verilerle sembol listesi döndürür,
+    ağırlıklar seçim anından önceki getirilerle kurulur, getiri seçim anındaki kapanıştan bir sonraki yenilemedeki kapanışa kadar panelden hesaplanır"""
+    closes = panel["Close"].ffill()
+    dates = rebalance_dates(start_date, interval_days)
+    today = datetime.now().date()
+    results = []
+    portfolio_value = 100.0
+    
+    for i, current_date in enumerate(dates):
+        next_date = dates[i + 1] if i + 1 < len(dates) else today
+        pos = bars_before(closes.index, current_date)
+        end = bars_before(closes.index, next_date)
+        picks = select(current_date, pos) if pos >= 1 else []
+        
+        if picks and end > pos:
+            period_returns = closes[picks].iloc[end] / closes[picks].iloc[pos] - 1
+            history = panel["Close"][picks].iloc[max(0, pos - RISK_WINDOW_DAYS):pos + 1].pct_change(fill_method=None).iloc[1:]
+            period_return = weighted_return(period_returns, optimize_weights(history, weighting))
+            if period_return is not None:
+                portfolio_value = portfolio_value * (1 + period_return)
+        
+        results.append({
+            "Tarih": current_date,
+            "Portföy Değeri": round(portfolio_value, 2),
+            "Seçilen Hisse": len(picks)
+        })
+    
+    return pd.DataFrame(results)
+
+def money_flow_backtest_holdings(market):
+    """Para akışı backtest'inin sektör üyeleri: ABD'de canlı seçim gibi endeks taramasındaki tüm şirketler, tarama yoksa seçili hisseler
+    Tarama bugünkü endeks bileşenleri ve sektörleridir; geçmişteki bileşen değişiklikleri yansıtılmaz"""
+    if market != "US":
+        return BIST_SECTOR_HOLDINGS
+    screen = load_screen_results(INDEX_BY_MARKET[market])
+    if screen.empty:
+        return SECTOR_HOLDINGS
+    return {etf: list(screen.loc[screen["sector"] == provider_sector, "symbol"]) for etf, provider_sector in US_SECTOR_PROVIDER_SECTORS.items()}
+
+def run_money_flow_backtest(start_date, interval_days, period_key, market="US", weighting="equal"):
+    """Para akışı stratejisinin backtest'i: sektörler tarihsel MFI'ya, hisseler para akışı değişimine göre seçilir (get_money_flow_portfolio mantığı)"""
+    holdings_map = money_flow_backtest_holdings(market)
+    panel = get_backtest_panel(market, start_date, [s for members in holdings_map.values() for s in members])
+    if panel is None:
+        return pd.DataFrame()
+    sector_map = US_SECTOR_ETFS if market == "US" else BIST_SECTORS
+    sector_flow = sector_mfi_history(historical_sector_panel(panel, market), period_key) - 50
+    flow_changes = money_flow_changes(panel)
+    
+    def select(current_date, pos):
+        flows = sector_flow.iloc[pos]
+        flows = pd.Series({name: flows.get(key, np.nan) for name, key in sector_map.items()}).dropna()
+        top_sectors = flows[flows > 0].sort_values(ascending=False, kind="stable").head(MONEY_FLOW_QUOTA_POLICY.top_sectors)
+        changes = flow_changes.iloc[pos]
+        frames = []
+        for rank, sector_name in enumerate(top_sectors.index, start=1):
+            members = [s for s in holdings_map.get(sector_map[sector_name], []) if pd.notna(changes.get(s))]
+            frames.append(pd.DataFrame({"Sembol": members, "sector_rank": rank, "_flow": changes.reindex(members).values}))
+        candidates = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+        if candidates.empty:
+            return []
+        candidates["Para Akışı Puanı"] = group_normalize(candidates["_flow"], candidates["sector_rank"]).round(2)
+        return list(construct_portfolio(candidates, MONEY_FLOW_QUOTA_POLICY)["Sembol"])
+    
+    return run_panel_backtest(panel, start_date, interval_days, select, weighting)
+
+def run_profile_backtest(profile_name, start_date, interval_days, market="US", weighting="equal"):
+    """Yatırımcı profilinin backtest'i: kurallar o gün yayımlanmış FMP rasyolarına ve panelden hesaplanan betaya uygulanır"""
+    panel = get_backtest_panel(market, start_date)
+    if panel is None or profile_name not in INVESTOR_PROFILES:
+        return pd.DataFrame()
+    profile = INVESTOR_PROFILES[profile_name]
+    symbols = [s for s in UNIVERSE.fetch_set(market) if s in panel["Close"].columns]
+    known = point_in_time_fundamentals(fmp_fundamental_reports(symbols), rebalance_dates(start_date, interval_days), symbols)
+    betas = beta_history(panel["Close"], MARKET_BENCHMARKS[market])
+    closes = panel["Close"]
+    
+    def select(current_date, pos):
+        fundamentals = known.get(current_date)
+        if fundamentals is None:
+            return []
+        priced = closes.iloc[pos].dropna().index
+        fundamentals = fundamentals[fundamentals.index.isin(priced)].assign(
+            short_name=None, forward_pe=np.nan, beta=betas.iloc[pos])
+        metrics = profile_metrics(fundamentals)
+        metrics["match"] = profile["match_percent"](metrics)
+        matched = metrics[metrics["match"] >= PROFILE_MIN_MATCH].sort_values(by="match", ascending=False, kind="stable")
+        return list(matched.index[:PROFILE_PICK_COUNT])
+    
+    return run_panel_backtest(panel, start_date, interval_days, select, weighting)
+
+def backtest_methods(market):
+    """Backtest edilebilen stratejiler: etiket -> (çalıştırıcı(başlangıç, aralık_gün, dönem, ağırlıklandırma), FMP anahtarı gerekir mi)"""
+    methods = {}
+    if market == "US":
+        methods["5 Kriterli Tam Analiz (FMP API)"] = (run_fmp_backtest_simulation, True)
+        methods["Momentum Bazlı Basit Test"] = (run_backtest_simulation, False)
+    methods["Para Akışı Stratejisi"] = (lambda start, interval, period, weighting: run_money_flow_backtest(start, interval, period, market, weighting), False)
+    if market == "US":
+        # FMP tarihsel rasyoları BIST hisselerini kapsamaz; BIST profil testi hep boş sonuç verirdi
+        for name in INVESTOR_PROFILES:
+            methods[f"Profil: {name}"] = (lambda start, interval, period, weighting, name=name: run_profile_backtest(name, start, interval, market, weighting), True)
+    return methods
+
+RISK_WINDOW_DAYS = 252
+RISK_MIN_OBSERVATIONS = 60
+VAR_CONFIDENCE = 0.95
+TRADING_DAYS_PER_YEAR = 252
+
+def provider_symbol(symbol, market):
+    """Öneri tablolarındaki BIST sembollerine (ör. THYAO) Yahoo son ekini ekler; evrende BIST hissesi olarak geçmeyenler aynen kalır"""
+    suffixed = f"{symbol}.IS"
+    if market == "BIST" and not symbol.endswith(".IS") and (UNIVERSE.sectors_of(suffixed) or suffixed in UNIVERSE.index_members(INDEX_BY_MARKET[market])):
+        return suffixed
+    return symbol
+
+def get_return_panel(symbols, deadline=None, sources=None, window=RISK_WINDOW_DAYS):
+    """Sembollerin kanonik günlük barlarından son 'window' günün getiri paneli (tarih x sembol); süreye yetişmeyenler attrs['missing']'de"""
+    results, missing = fetch_within({s: daily_bars_request(s, sources) for s in dict.fromkeys(symbols)}, deadline, sources)
+    closes = pd.DataFrame({s: bars["Close"] for s, (bars, _) in results.items() if bars is not None and len(bars) > 1})
+    returns = closes.pct_change(fill_method=None).iloc[1:].tail(window) if not closes.empty else closes
+    return with_missing(returns, missing)
+
+def portfolio_risk(returns, benchmark_returns=None, weights=None, confidence=VAR_CONFIDENCE):
+    """Getiri panelinden portföy riski (NumPy matris işlemleriyle): (özet, sembol tablosu, korelasyon matrisi)
+    Ağırlık verilmezse eşit ağırlık; yeterli gözlemi olmayan semboller çıkarılır, eksik günler sıfır getiri sayılır"""
+    returns = returns.loc[:, returns.notna().sum() >= RISK_MIN_OBSERVATIONS]
+    if returns.shape[1] == 0:
+        return None, pd.DataFrame(), pd.DataFrame()
+    symbols = returns.columns
+    w = np.full(len(symbols), 1.0) if weights is None else weights.reindex(symbols).fillna(0).to_numpy(dtype=float)
+    w = w / w.sum() if w.sum() > 0 else np.full(len(symbols), 1.0 / len(symbols))
+    
+    X = returns.fillna(0).to_numpy()
+    centered = X - X.mean(axis=0)
+    cov = centered.T @ centered / max(len(X) - 1, 1)
+    vols = np.sqrt(np.diag(cov))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        corr = cov / np.outer(vols, vols)
+    port_var = w @ cov @ w
+    risk_contribution = w * (cov @ w) / port_var if port_var > 0 else np.full(len(symbols), np.nan)
+    
+    betas = np.full(len(symbols), np.nan)
+    if benchmark_returns is not None:
+        b = benchmark_returns.reindex(returns.index).fillna(0).to_numpy()
+        b = b - b.mean()
+        if b @ b > 0:
+            betas = centered.T @ b / (b @ b)
+    
+    port = X @ w
+    var_threshold = np.quantile(port, 1 - confidence)
+    off_diagonal = corr[~np.eye(len(symbols), dtype=bool)]
+    summary = {
+        "volatility": float(np.sqrt(port_var * TRADING_DAYS_PER_YEAR) * 100),
+        "beta": float(w @ betas),
+        "var": float(-var_threshold * 100),
+        "cvar": float(-port[port <= var_threshold].mean() * 100),
+        "avg_correlation": float(np.nanmean(off_diagonal)) if len(off_diagonal) else np.nan,
+        "max_weight": float(w.max() * 100),
+    }
+    table = pd.DataFrame({
+        "weight": w * 100,
+        "volatility": vols * np.sqrt(TRADING_DAYS_PER_YEAR) * 100,
+        "beta": betas,
+        "risk_contribution": risk_contribution * 100,
+    }, index=symbols)
+    return summary, table, pd.DataFrame(corr, index=symbols, columns=symbols)
+
+PORTFOLIO_WEIGHTING_OPTIONS = {
+    "Eşit Ağırlık": "equal",
+    "Ters Volatilite": "inverse_vol",
+    "Minimum Varyans": "min_variance",
+    "Risk Paritesi": "risk_parity",
+}
+RISK_PARITY_MAX_ITERATIONS = 200
+
+def covariance_matrix(returns):
+    """Günlük getiri panelinden örnek kovaryans matrisi; eksik günler sıfır getiri sayılır"""
+    X = returns.fillna(0).to_numpy()
+    centered = X - X.mean(axis=0)
+    return centered.T @ centered / max(len(X) - 1, 1)
+
+def min_variance_weights(cov):
+    """Açığa satışsız minimum varyans: Σ⁻¹1 çözümünde negatif çıkan hisseler bırakılıp kalanlar için yeniden çözülür"""
+    active = np.ones(len(cov), dtype=bool)
+    while True:
+        raw = np.linalg.pinv(cov[np.ix_(active, active)]) @ np.ones(active.sum())
+        if (raw >= 0).all():
+            break
+        active[np.flatnonzero(active)[raw < 0]] = False
+    if raw.sum() <= 0:
+        return 1 / np.diag(cov) / (1 / np.diag(cov)).sum()
+    weights = np.zeros(len(cov))
+    weights[active] = raw / raw.sum()
+    return weights
+
+def risk_parity_weights(cov, tolerance=1e-10):
+    """Eşit risk katkısı: döngüsel koordinat inişi, her adımda tek ağırlık için ikinci derece denklemin pozitif kökü"""
+    n = len(cov)
+    diag = np.diag(cov)
+    weights = 1 / np.sqrt(diag)
+    weights = weights / weights.sum()
+    for _ in range(RISK_PARITY_MAX_ITERATIONS):
+        previous = weights.copy()
+        for i in range(n):
+            sigma = np.sqrt(weights @ cov @ weights)
+            cross = cov[i] @ weights - diag[i] * weights[i]
+            weights[i] = (-cross + np.sqrt(cross * cross + 4 * diag[i] * sigma / n)) / (2 * diag[i])
+        if np.abs(weights - previous).max() < tolerance:
+            break
+    return weights / weights.sum()
+
+def optimize_weights(returns, method="equal"):
+    """Getiri panelinin sütunları için açığa satışsız ağırlıklar (toplamı 1): equal, inverse_vol, min_variance, risk_parity
+    Yeterli geçmişi olmayan ya da fiyatı hiç oynamayan hisseler eşit pay alır, kalan pay optimize edilenlere dağıtılır"""
+    symbols = returns.columns
+    if len(symbols) == 0:
+        return pd.Series(dtype=float)
+    weights = pd.Series(1.0 / len(symbols), index=symbols)
+    if method == "equal":
+        return weights
+    usable = symbols[(returns.notna().sum() >= RISK_MIN_OBSERVATIONS).to_numpy()]
+    cov = covariance_matrix(returns[usable])
+    moving = np.diag(cov) > 0
+    usable, cov = usable[moving], cov[np.ix_(moving, moving)]
+    if len(usable) == 0:
+        return weights
+    if method == "inverse_vol":
+        optimized = 1 / np.sqrt(np.diag(cov))
+    elif method == "min_variance":
+        optimized = min_variance_weights(cov)
+    elif method == "risk_parity":
+        optimized = risk_parity_weights(cov)
+    else:
+        raise ValueError(f"Bilinmeyen ağırlıklandırma: {method}")
+    weights[usable] = optimized / optimized.sum() * len(usable) / len(symbols)
+    return weights
+
+def weighted_return(period_returns, weights):
+    """Dönem getirilerinin ağırlıklı ortalaması; getirisi bilinmeyen hisselerin payı diğerlerine dağıtılır, hiçbiri yoksa None"""
+    known = period_returns.dropna()
+    known_weights = weights.reindex(known.index).fillna(0)
+    if known_weights.sum() <= 0:
+        return None
+    return float((known * known_weights).sum() / known_weights.sum())
+
+def pick_weights(symbols, market, method, deadline=None):
+    """Öneri tablosundaki semboller için tablo sırasıyla ağırlıklar; getiriler kanonik günlük barlardan"""
+    if method == "equal":
+        return np.full(len(symbols), 1.0 / len(symbols))
+    provider_symbols = [provider_symbol(s, market) for s in symbols]
+    returns = get_return_panel(provider_symbols, deadline).reindex(columns=provider_symbols)
+    return optimize_weights(returns, method).to_numpy()
+
+def history_weights(symbols, ref_date, method):
+    """Backtest yenilemesinde 'ref_date' öncesi getirilerle ağırlıklar (kanonik bar tablosundan)"""
+    if method == "equal" or not symbols:
+        return pd.Series(1.0 / max(len(symbols), 1), index=symbols)
+    start = ref_date - timedelta(days=RISK_WINDOW_DAYS * 365 // TRADING_DAYS_PER_YEAR)
+    closes = {}
+    for symbol in symbols:
+        try:
+            hist = get_price_history_range(symbol, start, ref_date)
+        except Exception:
+            # Geçmişi alınamayan sembol eşit pay alır; diğerleri yine optimize edilir
+            continue
+        if "Close" in hist:
+            closes[symbol] = hist["Close"]
+    if not closes:
+        return pd.Series(1.0 / len(symbols), index=symbols)
+    returns = pd.DataFrame(closes).reindex(columns=symbols).pct_change(fill_method=None).iloc[1:]
+    return optimize_weights(returns, method)
+
+def show_risk_analysis(symbols, market, weights=None, title="⚠️ Risk Analizi"):
+    """Sembol seti için volatilite, beta, VaR/CVaR özeti, sembol bazında risk tablosu ve korelasyon ısı haritası"""
+    benchmark = MARKET_BENCHMARKS[market]
+    symbols = [provider_symbol(s, market) for s in symbols]
+    if weights is not None:
+        weights = weights.set_axis([provider_symbol(s, market) for s in weights.index]).groupby(level=0).sum()
+    returns = get_return_panel(symbols + [benchmark])
+    benchmark_returns = returns[benchmark] if benchmark in returns.columns else None
+    summary, table, corr = portfolio_risk(returns.drop(columns=[benchmark], errors="ignore"), benchmark_returns, weights)
+    
+    with st.expander(title):
+        show_missing_data_badge(returns)
+        if summary is None:
+            st.info("Risk hesabı için yeterli fiyat geçmişi bulunamadı.")
+            return
+        benchmark_label = benchmark.replace(".IS", "")
+        risk_cols = st.columns(5)
+        risk_cols[0].metric("Yıllık Volatilite", f"%{summary['volatility']:.2f}")
+        risk_cols[1].metric(f"Beta ({benchmark_label})", f"{summary['beta']:.2f}" if pd.notna(summary["beta"]) else "-")
+        risk_cols[2].metric(f"Günlük VaR (%{VAR_CONFIDENCE * 100:.0f})", f"%{summary['var']:.2f}")
+        risk_cols[3].metric(f"Günlük CVaR (%{VAR_CONFIDENCE * 100:.0f})", f"%{summary['cvar']:.2f}")
+        risk_cols[4].metric("Ort. Korelasyon", f"{summary['avg_correlation']:.2f}" if pd.notna(summary["avg_correlation"]) else "-")
+        st.caption(f"Son {len(returns)} işlem gününün getirileri; VaR/CVaR tarihsel, en büyük ağırlık %{summary['max_weight']:.1f}")
+        
+        risk_table = pd.DataFrame({
+            "Sembol": table.index.str.replace(".IS", ""),
+            "Ağırlık (%)": table["weight"].values,
+            "Volatilite (%)": table["volatility"].values,
+            "Beta": table["beta"].values,
+            "Risk Katkısı (%)": table["risk_contribution"].values
         })
-        
-        current_date = next_date
-    
-    return pd.DataFrame(results)
+        col_risk_table, col_heatmap = st.columns(2)
+        with col_risk_table:
+            st.dataframe(risk_table.style.format({col: "{:.2f}" for col in risk_table.columns[1:]}, na_rep="-"), hide_index=True, use_container_width=True)
+        with col_heatmap:
+            labels = list(corr.index.str.replace(".IS", ""))
+            fig_corr = go.Figure(go.Heatmap(
+                z=corr.values, x=labels, y=labels,
+                colorscale="RdBu", zmin=-1, zmax=1, reversescale=True,
+                text=corr.round(2).values, texttemplate="%{text}"
+            ))
+            fig_corr.update_layout(title="Korelasyon Matrisi", template="plotly_dark", height=400)
+            st.plotly_chart(fig_corr, use_container_width=True)
 
 def get_user_portfolio():
     session = get_session()
@@ -1410,6 +2647,206 @@ def remove_stock_from_portfolio(stock_id):
     finally:
         session.close()
 
+# İçe aktarılan dosyalarda kabul edilen sütun adları (küçük harfe çevrilmiş)
+PORTFOLIO_IMPORT_COLUMNS = {
+    "symbol": ["symbol", "sembol", "ticker", "hisse"],
+    "quantity": ["quantity", "adet", "miktar"],
+    "buy_price": ["buy_price", "alış fiyatı", "alis fiyati", "alış fiyatı ($)", "alış fiyatı (₺)", "maliyet"],
+    "sector": ["sector", "sektör", "sektor"],
+}
+
+def weighted_holdings(df, amount, price_col, sector=None, weights=None):
+    """Öneri tablosundaki hisselere tutarı ağırlıklarına göre (verilmezse eşit) bölüştürür; pozisyonlar sütun bazında hesaplanır"""
+    source_col = next((col for col in (price_col, "Fiyat ($)", "Fiyat (₺)") if col in df.columns), None)
+    prices = pd.to_numeric(df[source_col], errors="coerce") if source_col else pd.Series(100.0, index=df.index)
+    if sector is None:
+        sector = df["Sektör"].to_numpy() if "Sektör" in df.columns else "Bilinmiyor"
+    if weights is None:
+        weights = np.full(len(df), 1.0 / len(df))
+    return pd.DataFrame({
+        "symbol": df["Sembol"].to_numpy(),
+        "sector": sector,
+        "quantity": np.where(prices > 0, amount * np.asarray(weights) / prices, 0.0),
+        "buy_price": prices.to_numpy(),
+    })
+
+def with_current_prices(df, price_col, market):
+    """Öneri tablosunun fiyatlarını tek toplu istekle günceller; alış fiyatı anlık görüntü fiyatından değil güncel fiyattan yazılır"""
+    symbols = [provider_symbol(symbol, market) for symbol in df["Sembol"]]
+    quotes, _ = get_quote_snapshot(symbols)
+    prices = quotes["price"].reindex(symbols) if "price" in quotes.columns else pd.Series(np.nan, index=symbols)
+    missing = [symbol for symbol, price in zip(df["Sembol"], prices) if pd.isna(price)]
+    if missing:
+        raise ValueError(f"Güncel fiyat alınamadı: {', '.join(missing)}")
+    return df.assign(**{price_col: prices.round(2).to_numpy()})
+
+def dataframe_records(df):
+    """Toplu INSERT için satır sözlükleri; NaN değerler NULL olarak yazılır"""
+    return df.astype(object).where(df.notna(), None).to_dict("records")
+
+def save_portfolio_holdings(holdings, portfolio_name, time_period=None):
+    """Pozisyonları tek işlemde, tek toplu INSERT ile yazar; hata olursa hiçbiri kaydedilmez"""
+    records = holdings[["symbol", "sector", "quantity", "buy_price"]].assign(portfolio_name=portfolio_name, added_at=datetime.now())
+    if time_period is not None:
+        records = records.assign(time_period=time_period)
+    records = dataframe_records(records)
+    if not records:
+        return 0
+    session = get_session()
+    try:
+        session.execute(insert(UserPortfolio), records)
+        session.commit()
+        return len(records)
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+def read_portfolio_file(uploaded_file):
+    """CSV/Excel dosyasındaki pozisyonları okur: (geçerli pozisyonlar, atlanan satır sayısı) döndürür"""
+    if uploaded_file.name.lower().endswith(".xlsx"):
+        raw = pd.read_excel(uploaded_file)
+    else:
+        raw = pd.read_csv(uploaded_file, sep=None, engine="python")
+    raw.columns = raw.columns.astype(str).str.strip().str.lower()
+    renames = {alias: name for name, aliases in PORTFOLIO_IMPORT_COLUMNS.items() for alias in aliases if alias in raw.columns}
+    raw = raw.rename(columns=renames)
+    missing = [name for name in ("symbol", "quantity", "buy_price") if name not in raw.columns]
+    if missing:
+        raise ValueError(f"Eksik sütun: {', '.join(missing)}")
+    
+    # Boş hücreler "nan" metnine dönüşmesin: sembolsüz satır geçersiz sayılır, sektörsüz satır varsayılanı alır
+    holdings = pd.DataFrame({
+        "symbol": raw["symbol"].fillna("").astype(str).str.strip().str.upper(),
+        "sector": raw["sector"].fillna("İçe Aktarılan").astype(str).str.slice(0, 100) if "sector" in raw.columns else "İçe Aktarılan",
+        "quantity": pd.to_numeric(raw["quantity"], errors="coerce"),
+        "buy_price": pd.to_numeric(raw["buy_price"], errors="coerce"),
+    })
+    valid = holdings["symbol"].str.len().between(1, 10) & (holdings["quantity"] > 0) & (holdings["buy_price"] > 0)
+    return holdings[valid].reset_index(drop=True), int((~valid).sum())
+
+HOLDING_COLUMNS = ["id", "symbol", "sector", "quantity", "buy_price", "portfolio_name", "time_period", "added_at"]
+
+def load_holdings(portfolio_name=None, session=None):
+    """Pozisyonları tek sorguda DataFrame olarak yükler; portföy adı verilirse yalnızca o portföyü"""
+    own_session = session is None
+    if own_session:
+        session = get_session()
+    try:
+        query = session.query(*(getattr(UserPortfolio, column) for column in HOLDING_COLUMNS))
+        if portfolio_name is not None:
+            query = query.filter(UserPortfolio.portfolio_name == portfolio_name)
+        rows = query.order_by(UserPortfolio.id).all()
+    finally:
+        if own_session:
+            session.close()
+    holdings = pd.DataFrame(rows, columns=HOLDING_COLUMNS)
+    holdings["portfolio_name"] = holdings["portfolio_name"].fillna("İsimsiz")
+    holdings["time_period"] = holdings["time_period"].fillna("5 Gün")
+    return holdings
+
+def value_holdings(holdings):
+    """Pozisyonları tek toplu fiyat isteğiyle birleştirir; değer ve K/Z sütunları vektörel hesaplanır"""
+    quotes, stale_age = get_quote_snapshot(holdings["symbol"].unique())
+    valued = price_holdings(holdings, quotes)
+    valued.attrs["stale_age"] = stale_age
+    return valued
+
+def price_holdings(holdings, quotes):
+    """Pozisyon tablosunu verilen fiyat tablosuyla değerler"""
+    valued = holdings.join(quotes.astype(float), on="symbol")
+    priced = valued["price"].notna()
+    buy_price = valued["buy_price"]
+    valued["cost"] = (valued["quantity"] * buy_price).fillna(0)
+    valued["value"] = valued["quantity"] * valued["price"]
+    valued["daily_pnl"] = valued["value"] * valued["change_pct"] / 100
+    valued["pnl"] = (valued["value"] - valued["cost"]).where(valued["cost"] > 0, 0.0)
+    valued["pnl_pct"] = ((valued["price"] - buy_price) / buy_price * 100).where(buy_price > 0, 0.0)
+    # Fiyatı gelmeyen pozisyonların K/Z'si bilinmiyor; sıfır gibi görünmesin
+    valued.loc[~priced, ["daily_pnl", "pnl", "pnl_pct"]] = np.nan
+    return valued
+
+def valuation_totals(valued):
+    """Fiyatı bilinen pozisyonların toplam değeri, maliyeti ve kâr/zararı"""
+    priced = valued[valued["price"].notna()]
+    value = priced["value"].sum()
+    cost = priced["cost"].sum()
+    return {
+        "value": value,
+        "cost": cost,
+        "pnl": value - cost,
+        "pnl_pct": (value - cost) / cost * 100 if cost > 0 else None,
+        "daily_pnl": priced["daily_pnl"].sum(),
+    }
+
+def get_portfolio_summaries(market, weighting="equal"):
+    """Sidebar özeti: pozisyonlar tek sorguda, fiyatlar tek toplu istekte, öneriler zaman aralığı başına bir kez hesaplanır"""
+    holdings = load_holdings()
+    if holdings.empty:
+        return []
+    holdings = value_holdings(holdings)
+    
+    portfolio_periods = holdings.groupby("portfolio_name", sort=False)["time_period"].first()
+    recommended_symbols = {}
+    for period in portfolio_periods.unique():
+        try:
+            recommendations = get_recommendations(period, market, weighting)
+            recommended_symbols[period] = set(recommendations["Sembol"]) if not recommendations.empty else None
+        except:
+            recommended_symbols[period] = None
+    
+    summaries = []
+    for pf_name, positions in holdings.groupby("portfolio_name", sort=False):
+        time_period = portfolio_periods[pf_name]
+        totals = valuation_totals(positions)
+        pf_symbols = set(positions["symbol"])
+        new_symbols = recommended_symbols.get(time_period)
+        summaries.append({
+            "name": pf_name,
+            "created_at": positions["added_at"].min(),
+            "time_period": time_period,
+            "stock_count": len(positions),
+            "total_investment": positions["cost"].sum(),
+            "current_value": totals["value"],
+            "performance": totals["pnl_pct"],
+            "to_remove": pf_symbols - new_symbols if new_symbols else set(),
+            "to_add": new_symbols - pf_symbols if new_symbols else set(),
+            "positions": positions[["symbol", "buy_price", "price", "pnl_pct"]]
+        })
+    return summaries
+
+PERIOD_RETURN_WINDOWS = {"1 Hafta": 7, "1 Ay": 30, "3 Ay": 91, "1 Yıl": 365}
+
+def get_portfolio_history(portfolio_name):
+    """Portföyün günlük kayıtlarından değer geçmişi, getiri endeksi ve tepeden düşüşü; veri sağlayıcısına gidilmez"""
+    session = get_session()
+    try:
+        rows = session.query(PortfolioSnapshot.snapshot_date, PortfolioSnapshot.value, PortfolioSnapshot.cost).filter(
+            PortfolioSnapshot.portfolio_name == portfolio_name
+        ).order_by(PortfolioSnapshot.snapshot_date).all()
+    finally:
+        session.close()
+    history = pd.DataFrame(rows, columns=["snapshot_date", "value", "cost"])
+    history.index = pd.to_datetime(history.pop("snapshot_date"))
+    # Sonradan eklenen pozisyonların maliyeti o günün getirisi sayılmasın
+    flows = history["cost"].diff().fillna(0)
+    returns = ((history["value"] - flows) / history["value"].shift() - 1).replace([np.inf, -np.inf], np.nan)
+    history["index"] = 100 * (1 + returns.fillna(0)).cumprod()
+    history["drawdown"] = (history["index"] / history["index"].cummax() - 1) * 100
+    return history
+
+def period_returns(history):
+    """Getiri endeksinden dönemsel getiriler (%); o kadar eski kayıt yoksa None"""
+    index = history["index"]
+    last_date = index.index[-1]
+    returns = {}
+    for label, days in PERIOD_RETURN_WINDOWS.items():
+        base = index.asof(last_date - timedelta(days=days))
+        returns[label] = (index.iloc[-1] / base - 1) * 100 if pd.notna(base) else None
+    returns["Başlangıçtan"] = index.iloc[-1] - 100
+    return returns
+
 def get_alerts():
     session = get_session()
     try:
@@ -1436,6 +2873,7 @@ def add_alert(symbol, alert_type, target_price):
         )
         session.add(alert)
         session.commit()
+        get_alert_engine().track(alert.id, alert.symbol, alert.alert_type, alert.target_price, alert.created_at)
         return True
     except:
         session.rollback()
@@ -1450,6 +2888,7 @@ def remove_alert(alert_id):
         if alert:
             session.delete(alert)
             session.commit()
+            get_alert_engine().index.remove(alert_id)
             return True
         return False
     except:
@@ -1458,47 +2897,804 @@ def remove_alert(alert_id):
     finally:
         session.close()
 
-def check_and_trigger_alerts():
+def get_triggered_alerts_since(since):
     session = get_session()
-    triggered = []
     try:
-        alerts = session.query(PriceAlert).filter(PriceAlert.is_triggered == False).all()
-        for alert in alerts:
-            current_price, _ = get_stock_price(alert.symbol)
-            if current_price:
-                should_trigger = False
-                if alert.alert_type == "above" and current_price >= alert.target_price:
-                    should_trigger = True
-                elif alert.alert_type == "below" and current_price <= alert.target_price:
-                    should_trigger = True
-                
-                if should_trigger:
-                    alert.is_triggered = True
-                    alert.triggered_at = datetime.now()
-                    triggered.append({
-                        "symbol": alert.symbol,
-                        "type": alert.alert_type,
-                        "target": alert.target_price,
-                        "current": current_price
-                    })
-        session.commit()
+        alerts = session.query(PriceAlert).filter(PriceAlert.is_triggered == True, PriceAlert.triggered_at > since).order_by(PriceAlert.triggered_at).all()
+        return alerts
+    finally:
+        session.close()
+
+ALERT_CHECK_INTERVAL_SECONDS = int(os.environ.get("ALERT_CHECK_INTERVAL_SECONDS", "30"))
+ALERT_INDEX_RESYNC_SECONDS = int(os.environ.get("ALERT_INDEX_RESYNC_SECONDS", "300"))
+ALERT_INTRADAY_LOOKBACK_MINUTES = 60
+# Yahoo 1 dakikalık barları yalnızca son 7 gün için verir; daha eski başlangıç isteği reddedilir
+ALERT_INTRADAY_MAX_LOOKBACK = pd.Timedelta(days=7) - pd.Timedelta(hours=1)
+# Birden fazla kopya çalışırken her işçi sembollerin yalnızca kendi payını değerlendirir
+ALERT_WORKER_COUNT = max(1, int(os.environ.get("ALERT_WORKER_COUNT", "1")))
+ALERT_WORKER_INDEX = int(os.environ.get("ALERT_WORKER_INDEX", "0")) % ALERT_WORKER_COUNT
+
+def alert_shard(symbol, worker_count=ALERT_WORKER_COUNT):
+    """Sembolün hangi alarm işçisine düştüğünü süreçler arası kararlı bir özetle belirler"""
+    return zlib.crc32(symbol.encode("utf-8")) % worker_count
+
+def claim_alerts(session, alert_ids):
+    """Tetiklenecek alarmları satır kilidiyle sahiplenir; başka işçinin kilitlediği satırları atlar"""
+    query = session.query(PriceAlert.id).filter(PriceAlert.id.in_(alert_ids), PriceAlert.is_triggered == False)
+    if session.get_bind().dialect.name == "postgresql":
+        query = query.with_for_update(skip_locked=True)
+    # SQLite satır kilidi desteklemez; yazıcılar zaten sıralı çalıştığından koşullu UPDATE tek seferliği garanti eder
+    return {row.id for row in query.all()}
+
+def first_bar_after(bar_times, created_at):
+    """Alarm oluşturulduktan sonra başlayan ilk barın konumu; anlık fiyatta (bar zamanı yok) ya da zaman bilinmiyorsa 0"""
+    if created_at is None or bar_times[0] is None:
+        return 0
+    # Oluşturulma zamanı sunucunun yerel saatiyle yazılır
+    return int(bar_times.searchsorted(pd.Timestamp(created_at.astimezone()), side="left"))
+
+class AlertIndex:
+    """Sembol başına sıralı 'above'/'below' eşik listeleri; bir fiyat için aşılan alarmları O(log n + k) bulur"""
+
+    def __init__(self):
+        self.above = {}
+        self.below = {}
+        self.by_id = {}
+        self.lock = threading.Lock()
+
+    def _book(self, alert_type):
+        return self.above if alert_type == "above" else self.below
+
+    def add(self, alert_id, symbol, alert_type, target_price, created_at=None):
+        with self.lock:
+            if alert_id in self.by_id:
+                return
+            self.by_id[alert_id] = (symbol, alert_type, target_price, created_at)
+            insort(self._book(alert_type).setdefault(symbol, []), (target_price, alert_id))
+
+    def remove(self, alert_id):
+        with self.lock:
+            entry = self.by_id.pop(alert_id, None)
+            if entry is None:
+                return
+            symbol, alert_type, target_price, _ = entry
+            book = self._book(alert_type)
+            thresholds = book.get(symbol, [])
+            i = bisect_left(thresholds, (target_price, alert_id))
+            if i < len(thresholds) and thresholds[i] == (target_price, alert_id):
+                del thresholds[i]
+            if not thresholds:
+                book.pop(symbol, None)
+
+    def replace_all(self, rows):
+        """Dizini veritabanındaki (id, sembol, tip, hedef, oluşturulma) satırlarıyla yeniden kurar"""
+        above, below, by_id = {}, {}, {}
+        for alert_id, symbol, alert_type, target_price, created_at in rows:
+            by_id[alert_id] = (symbol, alert_type, target_price, created_at)
+            book = above if alert_type == "above" else below
+            book.setdefault(symbol, []).append((target_price, alert_id))
+        for thresholds in list(above.values()) + list(below.values()):
+            thresholds.sort()
+        with self.lock:
+            self.above, self.below, self.by_id = above, below, by_id
+
+    def symbols(self):
+        with self.lock:
+            return set(self.above) | set(self.below)
+
+    def created_at(self, alert_id):
+        with self.lock:
+            entry = self.by_id.get(alert_id)
+        return entry[3] if entry is not None else None
+
+    def crossed(self, symbol, price):
+        """Fiyatın aştığı alarmları (id, tip, hedef) olarak döndürür: 'above' hedef <= fiyat, 'below' hedef >= fiyat"""
+        return self.crossed_range(symbol, price, price)
+
+    def crossed_range(self, symbol, low, high):
+        """Bir fiyat aralığının (bar düşük/yüksek) aştığı alarmları döndürür"""
+        with self.lock:
+            above = self.above.get(symbol, [])
+            below = self.below.get(symbol, [])
+            hits = [(alert_id, "above", target) for target, alert_id in above[:bisect_right(above, (high, float("inf")))]]
+            hits += [(alert_id, "below", target) for target, alert_id in below[bisect_left(below, (low, float("-inf"))):]]
+        return hits
+
+    def __len__(self):
+        return len(self.by_id)
+
+class AlertEngine:
+    """Fiyat alarmlarını sayfa çiziminden bağımsız, kendi zamanlamasıyla değerlendiren arka plan işçisi"""
+
+    def __init__(self, session_factory, data_cache, breaker, intraday_breaker, interval=ALERT_CHECK_INTERVAL_SECONDS,
+                 worker_index=ALERT_WORKER_INDEX, worker_count=ALERT_WORKER_COUNT):
+        self.session_factory = session_factory
+        self.worker_index = worker_index
+        self.worker_count = worker_count
+        self.data_cache = data_cache
+        self.breaker = breaker
+        # Dakikalık uç nokta ayrı devre kesiciyle izlenir; hataları sayfa fiyat isteklerini kesmez
+        self.intraday_breaker = intraday_breaker
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last_run_at = None
+        self.index = AlertIndex()
+        self.index_loaded_at = None
+        self.last_bar_at = {}
+        self.settled = []
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="alarm-motoru", daemon=True)
+            self.thread.start()
+
+    def owns(self, symbol):
+        return alert_shard(symbol, self.worker_count) == self.worker_index
+
+    def track(self, alert_id, symbol, alert_type, target_price, created_at=None):
+        """Yeni alarmı, bu işçinin payına düşüyorsa dizine ekler"""
+        if self.owns(symbol):
+            self.index.add(alert_id, symbol, alert_type, target_price, created_at)
+
+    def reload_index(self):
+        """Dizini veritabanıyla eşitler; başka süreçlerde eklenen/silinen alarmlar da böylece görülür"""
+        session = self.session_factory()
+        try:
+            rows = session.query(PriceAlert.id, PriceAlert.symbol, PriceAlert.alert_type, PriceAlert.target_price, PriceAlert.created_at).filter(PriceAlert.is_triggered == False).all()
+        finally:
+            session.close()
+        self.index.replace_all([row for row in rows if self.owns(row.symbol)])
+        self.index_loaded_at = time.monotonic()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                if self.index_loaded_at is None or time.monotonic() - self.index_loaded_at >= ALERT_INDEX_RESYNC_SECONDS:
+                    self.reload_index()
+                self.evaluate_once()
+            except Exception:
+                pass
+            self.stop_event.wait(self.interval)
+
+    def fetch_quotes(self, symbols):
+        provider, key, loader, ttl = quote_snapshot_request(symbols)
+        quotes, _ = self.data_cache.get((provider,) + key, loader, ttl, self.breaker)
+        return quotes
+
+    def fetch_intraday_bars(self, symbols, since):
+        """Tüm alarm sembolleri için 'since' sonrasındaki 1 dakikalık barları tek toplu istekle çeker"""
+        if not self.intraday_breaker.allow_request():
+            return None
+        symbols = sorted(symbols)
+        try:
+            bars = yf.download(symbols, start=since.to_pydatetime(), interval="1m", group_by="ticker", auto_adjust=True, progress=False, threads=True)
+        except Exception:
+            self.intraday_breaker.record_failure()
+            return None
+        # Piyasa kapalıyken yeni bar gelmemesi hata değildir
+        self.intraday_breaker.record_success()
+        if bars.empty:
+            return bars
+        if not isinstance(bars.columns, pd.MultiIndex):
+            bars.columns = pd.MultiIndex.from_product([symbols, bars.columns])
+        return bars
+
+    def evaluate_once(self):
+        """Son değerlendirmeden bu yana gelen dakikalık barların yüksek/düşük değerlerini eşiklerle karşılaştırır"""
+        symbols = self.index.symbols()
+        if not symbols:
+            return []
+        now = pd.Timestamp.now(tz="UTC")
+        default_since = now - pd.Timedelta(minutes=ALERT_INTRADAY_LOOKBACK_MINUTES)
+        oldest_allowed = now - ALERT_INTRADAY_MAX_LOOKBACK
+        # Her sembol kendi son barından devam eder; bir sembolün taze barı diğerlerinin boşluğunu atlatmaz
+        since_by_symbol = {symbol: max(self.last_bar_at.get(symbol, default_since), oldest_allowed) for symbol in symbols}
+        bars = self.fetch_intraday_bars(symbols, min(since_by_symbol.values()))
+        
+        session = self.session_factory()
+        triggered = []
+        self.settled = []
+        try:
+            latest_bars = {}
+            if bars is not None:
+                for symbol in bars.columns.get_level_values(0).unique():
+                    if symbol not in since_by_symbol:
+                        continue
+                    frame = bars[symbol].dropna(subset=["High", "Low"])
+                    # Son barı tekrar kontrol et: değerlendirme anında henüz kapanmamış olabilir
+                    frame = frame[frame.index >= since_by_symbol[symbol]]
+                    if frame.empty:
+                        continue
+                    triggered.extend(self.on_bars(session, symbol, frame.index, frame["High"].to_numpy(), frame["Low"].to_numpy()))
+                    latest_bars[symbol] = frame.index[-1].tz_convert("UTC")
+            else:
+                # Dakikalık veri alınamazsa son fiyatla değerlendir
+                quotes = self.fetch_quotes(symbols)
+                if quotes is not None:
+                    for symbol, price in quotes["price"].items():
+                        triggered.extend(self.on_price(session, symbol, price))
+            # Bildirimler tetikleme ile aynı işlemde kuyruğa yazılır; biri kalıcı olursa diğeri de olur
+            for alert in triggered:
+                direction = "yukarı çıktı" if alert["type"] == "above" else "aşağı düştü"
+                bar_text = f" ({alert['bar_at'].strftime('%H:%M')} barı)" if alert["bar_at"] else ""
+                queue_notification(session, f"🚨 <b>ALARM:</b> {alert['symbol']} ${alert['target']:.2f} seviyesinin {direction}{bar_text}! Fiyat: ${alert['current']:.2f}")
+            session.commit()
+            # Dizinden çıkarma da kalıcı işlemden sonra; geri alınan tur alarmları kaybettirmez
+            for alert_id in self.settled:
+                self.index.remove(alert_id)
+            # İlerleme yalnızca işlem kalıcı olduktan sonra kaydedilir; başarısız turun barları yeniden değerlendirilir
+            self.last_bar_at = {symbol: bar_at for symbol, bar_at in {**self.last_bar_at, **latest_bars}.items() if symbol in since_by_symbol}
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        self.last_run_at = datetime.now()
         return triggered
-    except:
+
+    def on_price(self, session, symbol, price):
+        """Bir sembolün yeni fiyatı için yalnızca aşılan alarmları işaretler"""
+        return self.on_bars(session, symbol, [None], np.array([price]), np.array([price]))
+
+    def on_bars(self, session, symbol, bar_times, highs, lows):
+        """Bar dizisinde aşılan alarmları bulur ve her biri için eşiği ilk aşan barı kaydeder"""
+        hits = self.index.crossed_range(symbol, lows.min(), highs.max())
+        if not hits:
+            return []
+        targets = np.array([target for _, _, target in hits])
+        is_above = np.array([alert_type == "above" for _, alert_type, _ in hits])
+        # Alarm kurulmadan önce başlayan barlar sayılmaz; her alarm oluşturulduktan sonraki ilk bardan taranır
+        starts = np.array([first_bar_after(bar_times, self.index.created_at(alert_id)) for alert_id, _, _ in hits])
+        bar_positions = np.full(len(hits), len(highs))
+        for start in np.unique(starts):
+            group = np.flatnonzero(starts == start)
+            # Kümülatif maksimum artan, kümülatif minimum azalan dizidir; ilk aşan bar ikili aramayla bulunur
+            first_above = np.searchsorted(np.maximum.accumulate(highs[start:]), targets[group], side="left")
+            first_below = np.searchsorted(-np.minimum.accumulate(lows[start:]), -targets[group], side="left")
+            bar_positions[group] = start + np.where(is_above[group], first_above, first_below)
+        crossed = bar_positions < len(highs)
+        hits = [hit for hit, is_crossed in zip(hits, crossed) if is_crossed]
+        bar_positions = bar_positions[crossed]
+        if not hits:
+            return []
+        
+        claimed = claim_alerts(session, [alert_id for alert_id, _, _ in hits])
+        triggered = []
+        now = datetime.now()
+        for (alert_id, alert_type, target), position in zip(hits, bar_positions):
+            # Sahiplenilemeyen alarmlar ya tetiklenmiş ya da başka bir işçide işleniyor; dizin eşitlemesi temizler
+            if alert_id not in claimed:
+                continue
+            self.settled.append(alert_id)
+            bar_time = bar_times[position]
+            bar_at = bar_time.to_pydatetime().astimezone().replace(tzinfo=None) if bar_time is not None else None
+            bar_price = float(highs[position] if alert_type == "above" else lows[position])
+            # Koşullu güncelleme: alarm başka bir çalıştırmada işaretlendiyse dokunma
+            result = session.execute(
+                update(PriceAlert)
+                .where(PriceAlert.id == alert_id, PriceAlert.is_triggered == False)
+                .values(is_triggered=True, triggered_at=now, trigger_bar_at=bar_at, trigger_price=bar_price)
+            )
+            if result.rowcount == 1:
+                triggered.append({"symbol": symbol, "type": alert_type, "target": target, "current": bar_price, "bar_at": bar_at})
+        return triggered
+
+@st.cache_resource
+def get_alert_engine():
+    engine = AlertEngine(get_session_factory(), get_data_cache(), get_circuit_breaker("yahoo"), get_circuit_breaker("yahoo-intraday"))
+    engine.start()
+    return engine
+
+SNAPSHOT_CHECK_INTERVAL_SECONDS = int(os.environ.get("SNAPSHOT_CHECK_INTERVAL_SECONDS", "600"))
+# ABD kapanışından sonra günde bir kez; BIST o saatte çoktan kapanmış olur
+SNAPSHOT_CLOSE_NY = (16, 30)
+
+class PortfolioSnapshotJob:
+    """Her işlem günü kapanıştan sonra portföy ve pozisyon değerlerini kalıcı olarak kaydeden arka plan işi"""
+
+    def __init__(self, session_factory, data_cache, breaker, interval=SNAPSHOT_CHECK_INTERVAL_SECONDS):
+        self.session_factory = session_factory
+        self.data_cache = data_cache
+        self.breaker = breaker
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.last_snapshot_date = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="portfoy-goruntusu", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                snapshot_date = self.due_date()
+                if snapshot_date is not None:
+                    self.take_snapshot(snapshot_date)
+            except Exception:
+                pass
+            self.stop_event.wait(self.interval)
+
+    def due_date(self):
+        """Kapanış sonrası ve bugünün kaydı henüz alınmadıysa bugünün tarihi"""
+        now = pd.Timestamp.now(tz="America/New_York")
+        if now.weekday() >= 5 or (now.hour, now.minute) < SNAPSHOT_CLOSE_NY:
+            return None
+        return None if now.date() == self.last_snapshot_date else now.date()
+
+    def take_snapshot(self, snapshot_date):
+        """Tüm pozisyonları tek sorgu ve tek toplu fiyat isteğiyle değerleyip günün kaydını yazar"""
+        session = self.session_factory()
+        try:
+            # Başka bir kopya bugünün kaydını zaten aldıysa tekrar yazma
+            if session.query(PortfolioSnapshot.id).filter(PortfolioSnapshot.snapshot_date == snapshot_date).first() is None:
+                holdings = load_holdings(session=session)
+                if not holdings.empty:
+                    provider, key, loader, _ = quote_snapshot_request(holdings["symbol"].unique())
+                    # Sayfaların önbelleğe koyduğu değer kapanıştan önceki olabilir; kapanış fiyatı doğrudan indirilir
+                    quotes = self.data_cache.load_now((provider,) + key, loader, self.breaker)
+                    if quotes is None:
+                        # Kapanış fiyatı henüz alınamadı; bir sonraki denemede tekrar
+                        return 0
+                    valued = price_holdings(holdings, quotes)
+                    valued["cost"] = valued["cost"].where(valued["price"].notna())
+                    positions = valued[["portfolio_name", "symbol", "quantity", "price", "value", "cost"]].assign(snapshot_date=snapshot_date)
+                    totals = positions.groupby("portfolio_name", as_index=False).agg(
+                        value=("value", "sum"), cost=("cost", "sum"), position_count=("symbol", "size")
+                    ).assign(snapshot_date=snapshot_date, created_at=datetime.now())
+                    session.execute(insert(PortfolioSnapshot), dataframe_records(totals))
+                    session.execute(insert(PositionSnapshot), dataframe_records(positions))
+                    session.commit()
+                    self.last_snapshot_date = snapshot_date
+                    return len(totals)
+            self.last_snapshot_date = snapshot_date
+            return 0
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+@st.cache_resource
+def get_snapshot_job():
+    job = PortfolioSnapshotJob(get_session_factory(), get_data_cache(), get_circuit_breaker("yahoo-background"))
+    job.start()
+    return job
+
+FUNDAMENTAL_FIELDS = {
+    "short_name": "shortName",
+    "sector": "sector",
+    "beta": "beta",
+    "forward_pe": "forwardPE",
+    "trailing_pe": "trailingPE",
+    "peg_ratio": "pegRatio",
+    "dividend_yield": "dividendYield",
+    "debt_to_equity": "debtToEquity",
+    "revenue_growth": "revenueGrowth",
+    "profit_margin": "profitMargins",
+    "recommendation_mean": "recommendationMean",
+    "market_cap": "marketCap",
+}
+FUNDAMENTAL_TEXT_FIELDS = ("short_name", "sector")
+# Temel veriler gün içinde değişmez; endeks taraması yalnızca süresi dolanları yeniden indirir
+FUNDAMENTALS_TTL_SECONDS = int(os.environ.get("FUNDAMENTALS_TTL_SECONDS", "86400"))
+SCREEN_BATCH_SIZE = 100
+SCREEN_REFRESH_SECONDS = int(os.environ.get("SCREEN_REFRESH_SECONDS", "3600"))
+SCREEN_CHECK_INTERVAL_SECONDS = 60
+SCREEN_RESULT_COLUMNS = [
+    "symbol", "short_name", "sector", "price", "daily_change", "momentum", "volume_change", "money_flow_change",
+    "valuation_score", "growth_score", "profitability_score", "momentum_score", "revision_score", "total_score", "money_flow_score",
+]
+
+def load_fundamentals(session, symbols):
+    """Önbellekteki temel verileri sembol dizinli tablo olarak döndürür"""
+    columns = ["symbol", *FUNDAMENTAL_FIELDS, "updated_at"]
+    rows = session.query(*(getattr(SymbolFundamentals, column) for column in columns)).filter(
+        SymbolFundamentals.symbol.in_(list(symbols))
+    ).all()
+    return pd.DataFrame(rows, columns=columns).set_index("symbol")
+
+def fundamentals_record(symbol, info):
+    record = {"symbol": symbol, "updated_at": datetime.now()}
+    for column, key in FUNDAMENTAL_FIELDS.items():
+        value = info.get(key)
+        if column in FUNDAMENTAL_TEXT_FIELDS:
+            record[column] = str(value)[:100] if value else None
+            continue
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            value = None
+        record[column] = value if value is not None and np.isfinite(value) else None
+    return record
+
+def refresh_fundamentals(session_factory, symbols, executor, breaker, max_age=FUNDAMENTALS_TTL_SECONDS):
+    """Süresi dolmuş ya da hiç alınmamış sembollerin şirket bilgilerini paralel indirip yazar; yazılan sayısını döndürür"""
+    session = session_factory()
+    try:
+        cutoff = datetime.now() - timedelta(seconds=max_age)
+        fresh = {symbol for symbol, in session.query(SymbolFundamentals.symbol).filter(
+            SymbolFundamentals.symbol.in_(list(symbols)), SymbolFundamentals.updated_at >= cutoff
+        )}
+    finally:
+        session.close()
+    stale = [symbol for symbol in symbols if symbol not in fresh]
+
+    def fetch(symbol):
+        if not breaker.allow_request():
+            return None
+        try:
+            info = yf.Ticker(symbol).info
+        except Exception:
+            breaker.record_failure()
+            return None
+        breaker.record_success()
+        return fundamentals_record(symbol, info or {})
+
+    records = [record for record in executor.map(fetch, stale) if record is not None]
+    if not records:
+        return 0
+    session = session_factory()
+    try:
+        advisory_xact_lock(session, FUNDAMENTALS_WRITE_LOCK_KEY)
+        session.query(SymbolFundamentals).filter(
+            SymbolFundamentals.symbol.in_([record["symbol"] for record in records])
+        ).delete(synchronize_session=False)
+        session.execute(insert(SymbolFundamentals), records)
+        session.commit()
+    except Exception:
         session.rollback()
-        return []
+        raise
+    finally:
+        session.close()
+    return len(records)
+
+def bulk_price_panel(symbols, breaker, period="1mo"):
+    """Sembolleri SCREEN_BATCH_SIZE'lık toplu isteklerle indirir: (kapanış tablosu, hacim tablosu)"""
+    closes, volumes = [], []
+    for start in range(0, len(symbols), SCREEN_BATCH_SIZE):
+        batch = list(symbols[start:start + SCREEN_BATCH_SIZE])
+        if not breaker.allow_request():
+            break
+        try:
+            data = yf.download(batch, period=period, group_by="ticker", auto_adjust=True, progress=False, threads=True)
+            if data.empty:
+                raise ValueError("Toplu fiyat isteği boş döndü")
+        except Exception:
+            breaker.record_failure()
+            continue
+        breaker.record_success()
+        if isinstance(data.columns, pd.MultiIndex):
+            closes.append(data.xs("Close", axis=1, level=1))
+            volumes.append(data.xs("Volume", axis=1, level=1))
+        else:
+            closes.append(data[["Close"]].set_axis(batch, axis=1))
+            volumes.append(data[["Volume"]].set_axis(batch, axis=1))
+    if not closes:
+        return pd.DataFrame(), pd.DataFrame()
+    return pd.concat(closes, axis=1), pd.concat(volumes, axis=1)
+
+def price_signals(closes, volumes, lookback=10):
+    """Kapanış/hacim panellerinden sembol başına fiyat, günlük değişim, momentum, hacim ve para akışı değişimi"""
+    window = closes.iloc[-lookback:]
+    window_volumes = volumes.reindex(index=window.index, columns=window.columns)
+    bar_count = window.count()
+    filled = window.ffill()
+    current = filled.iloc[-1]
+    previous = filled.iloc[-2] if len(filled) >= 2 else current
+    first = window.bfill().iloc[0]
+    current_volume = window_volumes.iloc[-1].fillna(0)
+    prev_volume = window_volumes.iloc[-2].fillna(0) if len(window_volumes) >= 2 else current_volume
+    volume_base = prev_volume.where(prev_volume > 0, 1)
+    prev_money_flow = previous * prev_volume
+    daily_change = (current - previous) / previous * 100
+    signals = pd.DataFrame({
+        "price": current,
+        "daily_change": daily_change,
+        "momentum": ((current - first) / first * 100).where(bar_count >= 5, daily_change),
+        "volume_change": (current_volume - volume_base) / volume_base * 100,
+        "money_flow_change": ((current * current_volume - prev_money_flow) / prev_money_flow * 100).where(prev_money_flow > 0, 0),
+    })
+    return signals[bar_count >= 2].replace([np.inf, -np.inf], np.nan).dropna(subset=["price", "daily_change"])
+
+def group_normalize(values, groups):
+    """Değerleri her grup içinde 0-100 aralığına ölçekler; grup içi değerler eşitse 50 verir"""
+    grouped = values.groupby(groups)
+    low = grouped.transform("min")
+    span = grouped.transform("max") - low
+    return ((values - low) / span.where(span > 0) * 100).fillna(50)
+
+def score_universe(frame):
+    """Beş kriteri (%20'şer) ve para akışı puanını sağlayıcı sektörü içinde normalize ederek puanlar"""
+    sectors = frame["sector"].fillna("Diğer")
+    forward_pe = frame["forward_pe"].fillna(0)
+    recommendation = frame["recommendation_mean"].replace(0, np.nan).fillna(3)
+    criteria = {
+        "valuation_score": (100 - forward_pe.clip(upper=100)).where(forward_pe > 0, 50),
+        "growth_score": frame["revenue_growth"].fillna(0) * 100,
+        "profitability_score": frame["profit_margin"].fillna(0) * 100,
+        "momentum_score": frame["momentum"].fillna(0),
+        "revision_score": (5 - recommendation) / 4 * 100,
+    }
+    scored = frame.copy()
+    for column, values in criteria.items():
+        scored[column] = group_normalize(values, sectors).round(2)
+    scored["total_score"] = (scored[list(criteria)] * 0.20).sum(axis=1).round(2)
+    scored["money_flow_score"] = group_normalize(frame["money_flow_change"].fillna(0), sectors).round(2)
+    return scored.sort_values("total_score", ascending=False)
+
+class ScreeningJob:
+    """Endeks bileşenlerinin tamamını toplu fiyat, önbellekli temel veri ve vektörel puanlama aşamalarıyla tarayan arka plan işi"""
+
+    def __init__(self, session_factory, executor, breaker, registry, interval=SCREEN_REFRESH_SECONDS):
+        self.session_factory = session_factory
+        self.executor = executor
+        self.breaker = breaker
+        self.registry = registry
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="endeks-tarama", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.refresh_universe()
+            except Exception:
+                pass
+            for index_name in INDEX_BY_MARKET.values():
+                try:
+                    if self.is_due(index_name):
+                        self.screen(index_name)
+                except Exception:
+                    pass
+            self.stop_event.wait(SCREEN_CHECK_INTERVAL_SECONDS)
+
+    def is_due(self, index_name):
+        """Son tarama aralıktan eskiyse; başka bir kopyanın yazdığı taze sonuç yeniden hesaplanmaz"""
+        session = self.session_factory()
+        try:
+            latest = session.query(ScreenResult.as_of).filter(ScreenResult.index_name == index_name).order_by(ScreenResult.as_of.desc()).first()
+        finally:
+            session.close()
+        return latest is None or datetime.now() - latest[0] >= timedelta(seconds=self.interval)
+
+    def refresh_universe(self):
+        """Profil seçiminin okuduğu sektör hisselerinin temel verilerini tazeler; yalnızca süresi dolanlar indirilir"""
+        for market in INDEX_BY_MARKET:
+            refresh_fundamentals(self.session_factory, self.registry.fetch_set(market), self.executor, self.breaker)
+
+    def screen(self, index_name):
+        """Toplu fiyat → temel veri yenileme → puanlama; sıralama tek işlemde eskisinin yerine yazılır"""
+        symbols = self.registry.index_members(index_name)
+        if not symbols:
+            return 0
+        closes, volumes = bulk_price_panel(symbols, self.breaker)
+        if closes.empty:
+            return 0
+        signals = price_signals(closes, volumes)
+        refresh_fundamentals(self.session_factory, list(signals.index), self.executor, self.breaker)
+        session = self.session_factory()
+        try:
+            fundamentals = load_fundamentals(session, signals.index)
+            scored = score_universe(signals.join(fundamentals, how="left"))
+            results = scored.rename_axis("symbol").reset_index()[SCREEN_RESULT_COLUMNS]
+            results = results.assign(index_name=index_name, as_of=datetime.now(), rank=range(1, len(results) + 1))
+            advisory_xact_lock(session, SCREEN_WRITE_LOCK_KEY)
+            session.query(ScreenResult).filter(ScreenResult.index_name == index_name).delete(synchronize_session=False)
+            session.execute(insert(ScreenResult), dataframe_records(results))
+            session.commit()
+            return len(results)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+@st.cache_resource
+def get_screening_executor():
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="temel-veri")
+
+@st.cache_resource
+def get_screening_job():
+    # Arka plan toplu istekleri ayrı devre kesiciyle izlenir; hataları sayfa isteklerini kesmez
+    job = ScreeningJob(get_session_factory(), get_screening_executor(), get_circuit_breaker("yahoo-background"), get_universe())
+    job.start()
+    return job
+
+def read_screen_results(session_factory, index_name):
+    """Arka plan taramasının son sıralaması; tarama henüz yoksa boş tablo"""
+    columns = ["rank", "as_of", *SCREEN_RESULT_COLUMNS]
+    session = session_factory()
+    try:
+        rows = session.query(*(getattr(ScreenResult, column) for column in columns)).filter(
+            ScreenResult.index_name == index_name
+        ).order_by(ScreenResult.rank).all()
+    finally:
+        session.close()
+    return pd.DataFrame(rows, columns=columns)
+
+@st.cache_data(ttl=60)
+def load_screen_results(index_name):
+    return read_screen_results(get_session_factory(), index_name)
+
+RECOMMENDATION_REFRESH_SECONDS = int(os.environ.get("RECOMMENDATION_REFRESH_SECONDS", "3600"))
+RECOMMENDATION_CHECK_INTERVAL_SECONDS = 60
+# Arka plan işi durmuşsa eski görüntü yerine hat canlı hesaplanır
+RECOMMENDATION_MAX_AGE_SECONDS = int(os.environ.get("RECOMMENDATION_MAX_AGE_SECONDS", str(3 * RECOMMENDATION_REFRESH_SECONDS)))
+# Arka plan işi sayfa bütçesiyle sınırlı değildir; eksik veriyle görüntü yazılmaz
+RECOMMENDATION_FETCH_SECONDS = 120
+RECOMMENDATION_STRATEGIES = {
+    "score": get_portfolio_data,
+    "money_flow": get_money_flow_portfolio,
+}
+RECOMMENDATION_COLUMNS = ["period", "as_of", "rank", "symbol", "company", "sector", "price", "daily_change", "total_score", "money_flow_score"]
+
+def recommendation_records(picks, as_of, market, period, weighting, strategy):
+    """Seçim tablosunu sıralı anlık görüntü satırlarına çevirir; seçimlerin dayandığı sektör metrikleri de yazılır"""
+    price_col = "Fiyat ($)" if market == "US" else "Fiyat (₺)"
+    sectors = {sector["Sektör"]: sector for sector in picks.attrs.get("sectors", [])}
+    records = []
+    for rank, pick in enumerate(picks.to_dict("records"), start=1):
+        sector = sectors.get(pick["Sektör"], {})
+        records.append({
+            "as_of": as_of, "market": market, "period": period, "weighting": weighting, "strategy": strategy,
+            "rank": rank,
+            "symbol": pick["Sembol"],
+            "company": pick["Şirket"],
+            "sector": pick["Sektör"],
+            "price": pick[price_col],
+            "daily_change": pick["Günlük Değişim (%)"],
+            "total_score": pick.get("Toplam Puan"),
+            "money_flow_score": pick.get("Para Akışı Puanı"),
+            "sector_change": sector.get("Değişim (%)"),
+            "sector_volume_change": sector.get("Hacim Değişim (%)"),
+            "sector_money_flow": sector.get("Para Akışı (%)"),
+        })
+    return records
+
+class RecommendationSnapshotJob:
+    """Öneri hattını her pazar x dönem x ağırlık için zamanlı çalıştırıp sıralı seçimleri kalıcı olarak kaydeden arka plan işi"""
+
+    def __init__(self, session_factory, sources, interval=RECOMMENDATION_REFRESH_SECONDS):
+        self.session_factory = session_factory
+        self.sources = sources
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="oneri-goruntusu", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                if self.is_due():
+                    self.take_snapshot()
+            except Exception:
+                pass
+            self.stop_event.wait(RECOMMENDATION_CHECK_INTERVAL_SECONDS)
+
+    def is_due(self):
+        """Son görüntü aralıktan eskiyse; başka bir kopyanın yazdığı taze görüntü yeniden hesaplanmaz"""
+        session = self.session_factory()
+        try:
+            latest = session.query(func.max(RecommendationSnapshot.as_of)).scalar()
+        finally:
+            session.close()
+        return latest is None or datetime.now() - latest >= timedelta(seconds=self.interval)
+
+    def take_snapshot(self):
+        """Tüm kombinasyonları hesaplar ve tek işlemde aynı as_of ile yazar; yazılan satır sayısını döndürür"""
+        as_of = datetime.now()
+        records = []
+        for market in MARKET_OPTIONS.values():
+            weightings = list(SECTOR_WEIGHTING_OPTIONS.values()) if market == "BIST" else ["equal"]
+            for weighting in weightings:
+                for period in PERIOD_OPTIONS:
+                    for strategy, build in RECOMMENDATION_STRATEGIES.items():
+                        try:
+                            picks = build(period, market, deadline=time.monotonic() + RECOMMENDATION_FETCH_SECONDS, weighting=weighting, sources=self.sources)
+                        except Exception:
+                            continue
+                        if picks.empty or picks.attrs.get("missing"):
+                            continue
+                        records.extend(recommendation_records(picks, as_of, market, period, weighting, strategy))
+        if not records:
+            return 0
+        session = self.session_factory()
+        try:
+            session.execute(insert(RecommendationSnapshot), records)
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        return len(records)
+
+@st.cache_resource
+def get_recommendation_job():
+    job = RecommendationSnapshotJob(get_session_factory(), get_data_sources())
+    job.start()
+    return job
+
+@st.cache_data(ttl=60)
+def load_recommendations(market, weighting="equal", strategy="score"):
+    """Her dönemin en son öneri görüntüsünü tek sorguda döndürür"""
+    key_filter = (
+        (RecommendationSnapshot.market == market)
+        & (RecommendationSnapshot.weighting == weighting)
+        & (RecommendationSnapshot.strategy == strategy)
+    )
+    session = get_session()
+    try:
+        latest = session.query(
+            RecommendationSnapshot.period, func.max(RecommendationSnapshot.as_of).label("as_of")
+        ).filter(key_filter).group_by(RecommendationSnapshot.period).subquery()
+        rows = session.query(*(getattr(RecommendationSnapshot, column) for column in RECOMMENDATION_COLUMNS)).join(
+            latest, (RecommendationSnapshot.period == latest.c.period) & (RecommendationSnapshot.as_of == latest.c.as_of)
+        ).filter(key_filter).order_by(RecommendationSnapshot.period, RecommendationSnapshot.rank).all()
     finally:
         session.close()
+    return pd.DataFrame(rows, columns=RECOMMENDATION_COLUMNS)
+
+def get_recommendations(period_key, market, weighting="equal", strategy="score"):
+    """Sayfa ve sidebar önerileri: o dönemin görüntüsü varsa ondan okunur, yoksa ya da RECOMMENDATION_MAX_AGE_SECONDS'tan eskiyse hat canlı hesaplanır"""
+    rows = load_recommendations(market, weighting, strategy)
+    rows = rows[rows["period"] == period_key]
+    if rows.empty or datetime.now() - rows["as_of"].iloc[0] > timedelta(seconds=RECOMMENDATION_MAX_AGE_SECONDS):
+        return RECOMMENDATION_STRATEGIES[strategy](period_key, market, weighting=weighting)
+    price_col = "Fiyat ($)" if market == "US" else "Fiyat (₺)"
+    picks = pd.DataFrame({
+        "Sembol": rows["symbol"].values,
+        "Şirket": rows["company"].values,
+        "Sektör": rows["sector"].values,
+        price_col: rows["price"].values,
+        "Günlük Değişim (%)": rows["daily_change"].values,
+        "Toplam Puan": rows["total_score"].values,
+        "Para Akışı Puanı": rows["money_flow_score"].values
+    })
+    picks.attrs["as_of"] = rows["as_of"].iloc[0]
+    return with_missing(picks, [])
+
+def show_snapshot_caption(picks):
+    as_of = picks.attrs.get("as_of")
+    if as_of is not None:
+        st.caption(f"🕒 Öneriler {as_of.strftime('%d/%m %H:%M')} tarihli anlık görüntüden")
 
-triggered_alerts = check_and_trigger_alerts()
-if triggered_alerts:
-    for alert in triggered_alerts:
-        direction = "yukari cikti" if alert["type"] == "above" else "asagi dustu"
-        st.toast(f"🚨 ALARM: {alert['symbol']} ${alert['target']:.2f} seviyesinin {direction}! Guncel: ${alert['current']:.2f}", icon="🔔")
+get_alert_engine()
+get_notification_sender()
+get_snapshot_job()
+get_screening_job()
+get_recommendation_job()
+if "alerts_seen_at" not in st.session_state:
+    st.session_state.alerts_seen_at = datetime.now()
+recent_triggers = get_triggered_alerts_since(st.session_state.alerts_seen_at)
+for alert in recent_triggers:
+    direction = "yukari cikti" if alert.alert_type == "above" else "asagi dustu"
+    crossed_at = alert.trigger_bar_at or alert.triggered_at
+    price_text = f" Fiyat: ${alert.trigger_price:.2f}" if alert.trigger_price else ""
+    st.toast(f"🚨 ALARM: {alert.symbol} ${alert.target_price:.2f} seviyesinin {direction}! ({crossed_at.strftime('%H:%M')}){price_text}", icon="🔔")
+if recent_triggers:
+    st.session_state.alerts_seen_at = recent_triggers[-1].triggered_at
 
 with st.spinner("Piyasa verileri yükleniyor..."):
     if selected_market == "US":
-        vix_val, vix_change = get_vix_data()
-        if vix_val < 15:
+        vix_val, vix_change, market_stale_age = get_vix_data()
+        if vix_val is None:
+            market_status = "VERİ YOK"
+            strategy = "Bekle"
+            strategy_detail = "VIX verisi alınamadı. Piyasa durumu veri gelene kadar değerlendirilemiyor."
+        elif vix_val < 15:
             market_status = "REHAVET"
             strategy = "Dikkatli Ol"
             strategy_detail = "Piyasa 'pahalı' olabilir. Yeni büyük pozisyonlar için riskli."
@@ -1515,10 +3711,16 @@ with st.spinner("Piyasa verileri yükleniyor..."):
             strategy = "Fırsat Alımı"
             strategy_detail = "Kontrariyan yatırımcılar için en güvenli alım bölgesi."
     else:
-        bist_val, bist_change = get_bist100_data()
-        usd_val, usd_change = get_usdtry_data()
-        market_status = "POZİTİF" if bist_change > 0 else "NEGATİF"
-        strategy = "Stratejik Alım" if bist_change > 0 else "Temkinli Ol"
+        bist_val, bist_change, market_stale_age = get_bist100_data()
+        usd_val, usd_change, usd_stale_age = get_usdtry_data()
+        if usd_stale_age is not None:
+            market_stale_age = max(market_stale_age or 0, usd_stale_age)
+        if bist_val is None:
+            market_status = "VERİ YOK"
+            strategy = "Bekle"
+        else:
+            market_status = "POZİTİF" if bist_change > 0 else "NEGATİF"
+            strategy = "Stratejik Alım" if bist_change > 0 else "Temkinli Ol"
         strategy_detail = ""
 
 from datetime import time as dt_time
@@ -1553,18 +3755,30 @@ col1.metric("Borsa Durumu", f"{market_status_icon} {market_status_text}")
 col2.metric("Piyasa Durumu", market_status, delta=None)
 
 if selected_market == "US":
-    col3.metric("VIX (Korku Endeksi)", f"{vix_val:.2f}", delta=f"{vix_change:+.2f}%")
+    if vix_val is not None:
+        col3.metric("VIX (Korku Endeksi)", f"{vix_val:.2f}", delta=f"{vix_change:+.2f}%")
+    else:
+        col3.metric("VIX (Korku Endeksi)", "-")
     col4.metric("Önerilen Strateji", strategy)
     if strategy_detail:
         st.info(f"💡 **{strategy}:** {strategy_detail}")
     if not market_open:
         st.caption("⏰ ABD Borsası: 16:30 - 23:00 (TR saati) | Veriler son kapanışı gösteriyor")
 else:
-    col3.metric("BIST-100", f"{bist_val:,.0f}", delta=f"{bist_change:+.2f}%")
-    col4.metric("USD/TRY", f"₺{usd_val:.2f}", delta=f"{usd_change:+.2f}%")
+    if bist_val is not None:
+        col3.metric("BIST-100", f"{bist_val:,.0f}", delta=f"{bist_change:+.2f}%")
+    else:
+        col3.metric("BIST-100", "-")
+    if usd_val is not None:
+        col4.metric("USD/TRY", f"₺{usd_val:.2f}", delta=f"{usd_change:+.2f}%")
+    else:
+        col4.metric("USD/TRY", "-")
     if not market_open:
         st.caption("⏰ BIST: 10:00 - 18:00 (TR saati) | Veriler son kapanışı gösteriyor")
 
+if market_stale_age is not None:
+    st.caption(f"⏳ Veri sağlayıcı yanıt vermiyor - {format_stale_age(market_stale_age)} önceki son geçerli veri gösteriliyor")
+
 if investor_profile != "Seçiniz":
     st.divider()
     st.header(f"👤 {investor_profile} Yatırımcı Profili")
@@ -1573,26 +3787,10 @@ if investor_profile != "Seçiniz":
     st.info(f"**Hedef:** {profile_info['description']} | **Tercih:** {profile_info['preferred']}")
     
     with st.expander("📋 Profil Kriterleri", expanded=False):
-        crit_col1, crit_col2, crit_col3 = st.columns(3)
-        with crit_col1:
-            if "beta_min" in profile_info:
-                st.write(f"**Beta:** {profile_info['beta_min']} - {profile_info['beta_max']}")
-            if "pe_max" in profile_info:
-                st.write(f"**F/K:** < {profile_info['pe_max']}")
-            elif "pe_min" in profile_info:
-                st.write(f"**F/K:** > {profile_info['pe_min']}")
-        with crit_col2:
-            if "dividend_min" in profile_info:
-                st.write(f"**Temettü:** > %{profile_info['dividend_min']}")
-            elif "dividend_max" in profile_info:
-                st.write(f"**Temettü:** < %{profile_info['dividend_max']}")
-            if "debt_equity_max" in profile_info:
-                st.write(f"**Borç/Özkaynak:** < {profile_info['debt_equity_max']}")
-        with crit_col3:
-            if "peg_max" in profile_info:
-                st.write(f"**PEG:** < {profile_info['peg_max']}")
-            if "peg_min" in profile_info and "peg_max" in profile_info:
-                st.write(f"**PEG:** {profile_info['peg_min']} - {profile_info['peg_max']}")
+        crit_cols = st.columns(3)
+        for i, rule in enumerate(profile_info["rules"]):
+            with crit_cols[i % 3]:
+                st.write(describe_rule(rule))
     
     with st.spinner(f"{investor_profile} profiline uygun hisseler aranıyor..."):
         profile_stocks = get_profile_based_stocks(investor_profile, selected_market)
@@ -1612,6 +3810,7 @@ if investor_profile != "Seçiniz":
             format_dict_pf["Uyum (%)"] = "{:.0f}"
         styled_profile = profile_stocks.style.format(format_dict_pf).map(color_profile_stocks, subset=['Günlük Değişim (%)'])
         st.dataframe(styled_profile, hide_index=True, use_container_width=True)
+        show_risk_analysis(list(profile_stocks["Sembol"]), selected_market)
         
         st.subheader("💼 Profil Portföyünü Kaydet")
         session = get_session()
@@ -1622,11 +3821,13 @@ if investor_profile != "Seçiniz":
         default_pf_name = f"{investor_profile} Portföy {next_pf_num}"
         
         with st.form("save_profile_portfolio_form"):
-            col_prf1, col_prf2 = st.columns(2)
+            col_prf1, col_prf2, col_prf3 = st.columns(3)
             with col_prf1:
                 profile_pf_name = st.text_input("Portföy Adı", value=default_pf_name, key="profile_pf_name")
             with col_prf2:
                 profile_investment = st.text_input("Toplam Yatırım (USD)", value="10.000", key="profile_investment")
+            with col_prf3:
+                profile_weighting = st.selectbox("Ağırlıklandırma", options=list(PORTFOLIO_WEIGHTING_OPTIONS.keys()), key="profile_weighting")
             save_profile_btn = st.form_submit_button("💾 Profil Portföyü Oluştur", type="primary")
             
             if save_profile_btn:
@@ -1643,36 +3844,20 @@ if investor_profile != "Seçiniz":
                     st.error("Portföy adı boş olamaz.")
                     st.stop()
                 
-                session = get_session()
                 try:
-                    stock_count_pf = len(profile_stocks)
-                    per_stock_pf = pf_amount / stock_count_pf
                     price_col = "Fiyat ($)" if selected_market == "US" else "Fiyat (₺)"
-                    
-                    for _, row in profile_stocks.iterrows():
-                        symbol = row['Sembol']
-                        current_price = row[price_col] if price_col in row else 100
-                        quantity = per_stock_pf / current_price if current_price > 0 else 0
-                        
-                        new_holding = UserPortfolio(
-                            symbol=symbol,
-                            sector=investor_profile,
-                            quantity=quantity,
-                            buy_price=current_price,
-                            portfolio_name=profile_pf_name.strip()
-                        )
-                        session.add(new_holding)
-                    
-                    session.commit()
-                    st.success(f"✅ '{profile_pf_name}' portföyü {stock_count_pf} hisse ile oluşturuldu!")
+                    weights = pick_weights(list(profile_stocks["Sembol"]), selected_market, PORTFOLIO_WEIGHTING_OPTIONS[profile_weighting])
+                    holdings = weighted_holdings(with_current_prices(profile_stocks, price_col, selected_market), pf_amount, price_col, sector=investor_profile, weights=weights)
+                    stock_count_pf = save_portfolio_holdings(holdings, profile_pf_name.strip())
+                    st.success(f"✅ '{profile_pf_name}' portföyü {stock_count_pf} hisse ile oluşturuldu! ({profile_weighting})")
                     st.rerun()
                 except Exception as e:
-                    session.rollback()
                     st.error(f"Hata: {str(e)}")
-                finally:
-                    session.close()
     else:
-        st.warning("Bu kriterlere uygun hisse bulunamadı. Lütfen farklı bir profil deneyin.")
+        if profile_stocks.attrs.get("pending"):
+            st.info("Şirket temel verileri arka planda hazırlanıyor; profil seçimi hazır olunca burada listelenecek.")
+        else:
+            st.warning("Bu kriterlere uygun hisse bulunamadı. Lütfen farklı bir profil deneyin.")
 
 st.divider()
 
@@ -1686,12 +3871,18 @@ selected_period = st.radio(
 )
 
 with st.spinner("Sektör verileri yükleniyor..."):
-    sector_data = get_sector_data(selected_period, selected_market)
+    sector_data = get_sector_data(selected_period, selected_market, weighting=BIST_SECTOR_WEIGHTING)
+
+if sector_data.empty:
+    st.warning("Sektör verisi şu anda alınamıyor. Veri sağlayıcı yanıt verdiğinde grafikler güncellenecek.")
+elif sector_data.attrs.get("stale_age") is not None:
+    st.caption(f"⏳ Sektör verileri {format_stale_age(sector_data.attrs['stale_age'])} önceki son geçerli değerlerden gösteriliyor")
+show_missing_data_badge(sector_data)
 
 sorted_sector_data = sector_data.sort_values(by="Değişim (%)", ascending=False)
 
 if "selected_sector_name" not in st.session_state or st.session_state.get("last_market") != selected_market or st.session_state.get("last_period") != selected_period:
-    if "Para Akışı (%)" in sector_data.columns:
+    if not sector_data.empty:
         top_mf_sector = sector_data.sort_values(by="Para Akışı (%)", ascending=False).iloc[0]["Sektör"]
         st.session_state.selected_sector_name = top_mf_sector
     else:
@@ -1789,6 +3980,7 @@ if selected_sector:
     sector_key = CURRENT_SECTOR_MAP.get(selected_sector, "")
     with st.spinner(f"{selected_sector} şirketleri yükleniyor..."):
         holdings_data = get_sector_holdings_data(sector_key, selected_market)
+    show_missing_data_badge(holdings_data)
     
     if not holdings_data.empty:
         def color_holdings(val):
@@ -1811,7 +4003,9 @@ market_name = "ABD" if selected_market == "US" else "BIST"
 st.success(f"**{market_name} için en iyi 10 hisse önerisi**")
 
 with st.spinner("Hisse verileri yükleniyor..."):
-    portfolio = get_portfolio_data(selected_period, selected_market)
+    portfolio = get_recommendations(selected_period, selected_market, BIST_SECTOR_WEIGHTING)
+show_missing_data_badge(portfolio)
+show_snapshot_caption(portfolio)
 
 if not portfolio.empty:
     def color_portfolio(val):
@@ -1824,6 +4018,7 @@ if not portfolio.empty:
     format_dict = {col: "{:.2f}" for col in numeric_cols}
     styled_portfolio = portfolio.style.format(format_dict).map(color_portfolio, subset=['Günlük Değişim (%)'])
     st.dataframe(styled_portfolio, hide_index=True, use_container_width=True)
+    show_risk_analysis(list(portfolio["Sembol"]), selected_market)
     
     st.subheader("💼 Portföyüm Olarak Kaydet")
     
@@ -1835,7 +4030,7 @@ if not portfolio.empty:
     default_name = f"Portföy {next_portfolio_num}"
     
     with st.form("save_system_portfolio_form"):
-        col_pf1, col_pf2 = st.columns(2)
+        col_pf1, col_pf2, col_pf3 = st.columns(3)
         with col_pf1:
             portfolio_name_input = st.text_input(
                 "Portföy Adı",
@@ -1848,6 +4043,12 @@ if not portfolio.empty:
                 value="10.000",
                 help="Binlik ayırıcı olarak nokta kullanın (örn: 10.000)"
             )
+        with col_pf3:
+            weighting_input = st.selectbox(
+                "Ağırlıklandırma",
+                options=list(PORTFOLIO_WEIGHTING_OPTIONS.keys()),
+                help="Ters volatilite, minimum varyans ve risk paritesi son bir yılın günlük getirilerinden hesaplanır"
+            )
         save_portfolio_btn = st.form_submit_button("💾 Yeni Portföy Oluştur", type="primary")
         
         if save_portfolio_btn:
@@ -1864,39 +4065,38 @@ if not portfolio.empty:
                 st.error("Portföy adı boş olamaz.")
                 st.stop()
                 
-            session = get_session()
             try:
-                stock_count = len(portfolio)
-                per_stock_amount = investment_amount / stock_count
-                
-                for _, row in portfolio.iterrows():
-                    symbol = row['Sembol']
-                    price_col = PRICE_COL_NAME
-                    current_price = row[price_col] if price_col in row else row.get('Fiyat ($)', row.get('Fiyat (₺)', 100))
-                    quantity = per_stock_amount / current_price if current_price > 0 else 0
-                    sector = row.get('Sektör', 'Bilinmiyor')
-                    
-                    new_holding = UserPortfolio(
-                        symbol=symbol,
-                        sector=sector,
-                        quantity=quantity,
-                        buy_price=current_price,
-                        portfolio_name=portfolio_name_input.strip(),
-                        time_period=selected_period
-                    )
-                    session.add(new_holding)
-                
-                session.commit()
-                st.success(f"✅ '{portfolio_name_input}' adlı portföy {stock_count} hisse ile oluşturuldu! Toplam: ${investment_amount:,}")
+                weights = pick_weights(list(portfolio["Sembol"]), selected_market, PORTFOLIO_WEIGHTING_OPTIONS[weighting_input])
+                holdings = weighted_holdings(with_current_prices(portfolio, PRICE_COL_NAME, selected_market), investment_amount, PRICE_COL_NAME, weights=weights)
+                stock_count = save_portfolio_holdings(holdings, portfolio_name_input.strip(), time_period=selected_period)
+                st.success(f"✅ '{portfolio_name_input}' adlı portföy {stock_count} hisse ile oluşturuldu! Toplam: ${investment_amount:,} ({weighting_input})")
                 st.rerun()
             except Exception as e:
-                session.rollback()
                 st.error(f"Portföy oluşturulurken hata: {str(e)}")
-            finally:
-                session.close()
 else:
     st.info("Portföy verisi bulunamadı.")
 
+index_name = INDEX_BY_MARKET[selected_market]
+with st.expander(f"🔭 Endeks Taraması ({index_name})"):
+    screen = load_screen_results(index_name)
+    if screen.empty:
+        st.info(f"{index_name} taraması arka planda hazırlanıyor; ilk sonuçlar hazır olunca burada listelenecek.")
+    else:
+        st.caption(f"{len(screen)} hisse tarandı · Son tarama: {screen['as_of'].iloc[0].strftime('%d/%m %H:%M')} · Puanlar sektör içinde normalize edilir")
+        screen_display = screen.head(50)[["rank", "symbol", "short_name", "sector", "price", "daily_change", "momentum", "total_score", "money_flow_score"]].rename(columns={
+            "rank": "Sıra",
+            "symbol": "Sembol",
+            "short_name": "Şirket",
+            "sector": "Sektör",
+            "price": PRICE_COL_NAME,
+            "daily_change": "Günlük Değişim (%)",
+            "momentum": "Momentum (%)",
+            "total_score": "Toplam Puan",
+            "money_flow_score": "Para Akışı Puanı"
+        })
+        screen_display["Sembol"] = screen_display["Sembol"].str.replace(".IS", "", regex=False)
+        st.dataframe(screen_display.round(2), hide_index=True, use_container_width=True)
+
 st.divider()
 
 st.header("💰 Para Akışına Göre Seçimler")
@@ -1904,7 +4104,10 @@ market_name_mf = "ABD" if selected_market == "US" else "BIST"
 st.success(f"**{market_name_mf} için para girişi en yüksek sektörlerden 10 hisse**")
 
 with st.spinner("Para akışı verileri yükleniyor..."):
-    mf_portfolio = get_money_flow_portfolio(selected_period, selected_market)
+    mf_portfolio = get_recommendations(selected_period, selected_market, BIST_SECTOR_WEIGHTING, strategy="money_flow")
+    mf_portfolio = mf_portfolio.drop(columns=["Para Akışı Puanı"], errors="ignore")
+show_missing_data_badge(mf_portfolio)
+show_snapshot_caption(mf_portfolio)
 
 if not mf_portfolio.empty:
     def color_mf_portfolio(val):
@@ -1917,6 +4120,7 @@ if not mf_portfolio.empty:
     format_dict_mf = {col: "{:.2f}" for col in numeric_cols_mf}
     styled_mf_portfolio = mf_portfolio.style.format(format_dict_mf).map(color_mf_portfolio, subset=['Günlük Değişim (%)'])
     st.dataframe(styled_mf_portfolio, hide_index=True, use_container_width=True)
+    show_risk_analysis(list(mf_portfolio["Sembol"]), selected_market)
     
     st.subheader("💼 Para Akışı Portföyünü Kaydet")
     
@@ -1928,7 +4132,7 @@ if not mf_portfolio.empty:
     default_name_mf = f"Para Akışı {next_portfolio_num_mf}"
     
     with st.form("save_mf_portfolio_form"):
-        col_mf1, col_mf2 = st.columns(2)
+        col_mf1, col_mf2, col_mf3 = st.columns(3)
         with col_mf1:
             mf_portfolio_name = st.text_input(
                 "Portföy Adı",
@@ -1943,6 +4147,13 @@ if not mf_portfolio.empty:
                 help="Binlik ayırıcı olarak nokta kullanın",
                 key="mf_investment"
             )
+        with col_mf3:
+            mf_weighting = st.selectbox(
+                "Ağırlıklandırma",
+                options=list(PORTFOLIO_WEIGHTING_OPTIONS.keys()),
+                help="Ters volatilite, minimum varyans ve risk paritesi son bir yılın günlük getirilerinden hesaplanır",
+                key="mf_weighting"
+            )
         save_mf_btn = st.form_submit_button("💾 Para Akışı Portföyü Oluştur", type="primary")
         
         if save_mf_btn:
@@ -1959,35 +4170,14 @@ if not mf_portfolio.empty:
                 st.error("Portföy adı boş olamaz.")
                 st.stop()
                 
-            session = get_session()
             try:
-                stock_count_mf = len(mf_portfolio)
-                per_stock_mf = mf_amount / stock_count_mf
-                
-                for _, row in mf_portfolio.iterrows():
-                    symbol = row['Sembol']
-                    price_col = PRICE_COL_NAME
-                    current_price = row[price_col] if price_col in row else row.get('Fiyat ($)', row.get('Fiyat (₺)', 100))
-                    quantity = per_stock_mf / current_price if current_price > 0 else 0
-                    sector = row.get('Sektör', 'Bilinmiyor')
-                    
-                    new_holding = UserPortfolio(
-                        symbol=symbol,
-                        sector=sector,
-                        quantity=quantity,
-                        buy_price=current_price,
-                        portfolio_name=mf_portfolio_name.strip()
-                    )
-                    session.add(new_holding)
-                
-                session.commit()
-                st.success(f"✅ '{mf_portfolio_name}' adlı portföy {stock_count_mf} hisse ile oluşturuldu! Toplam: ${mf_amount:,}")
+                weights = pick_weights(list(mf_portfolio["Sembol"]), selected_market, PORTFOLIO_WEIGHTING_OPTIONS[mf_weighting])
+                holdings = weighted_holdings(with_current_prices(mf_portfolio, PRICE_COL_NAME, selected_market), mf_amount, PRICE_COL_NAME, weights=weights)
+                stock_count_mf = save_portfolio_holdings(holdings, mf_portfolio_name.strip())
+                st.success(f"✅ '{mf_portfolio_name}' adlı portföy {stock_count_mf} hisse ile oluşturuldu! Toplam: ${mf_amount:,} ({mf_weighting})")
                 st.rerun()
             except Exception as e:
-                session.rollback()
                 st.error(f"Portföy oluşturulurken hata: {str(e)}")
-            finally:
-                session.close()
 else:
     st.info("Para akışı verisi bulunamadı.")
 
@@ -1995,27 +4185,33 @@ st.divider()
 
 st.header("📈 Strateji Performans Testi")
 
-backtest_method = st.radio(
-    "Test Yöntemi Seçin:",
-    options=["5 Kriterli Tam Analiz (FMP API)", "Momentum Bazlı Basit Test"],
-    horizontal=True,
-    help="5 Kriterli analiz FMP API kullanır ve daha doğru sonuçlar verir"
+BACKTEST_METHODS = backtest_methods(selected_market)
+backtest_selection = st.multiselect(
+    "Test Edilecek Stratejiler:",
+    options=list(BACKTEST_METHODS.keys()),
+    default=[next(label for label, (_, needs_fmp) in BACKTEST_METHODS.items() if FMP_API_KEY or not needs_fmp)],
+    help="Seçilen stratejiler aynı dönem ve yenileme aralığında tek çalıştırmada karşılaştırılır. 5 Kriterli analiz ve profiller FMP API kullanır"
 )
 
-if backtest_method == "5 Kriterli Tam Analiz (FMP API)":
+if any(BACKTEST_METHODS[label][1] for label in backtest_selection):
     if FMP_API_KEY:
-        st.success("✅ FMP API bağlantısı aktif - Tam 5 kriterli analiz kullanılacak")
-        st.info("""**5 Kriter:** Değerleme (P/E), Büyüme (gelir), Karlılık (net marj), Momentum (fiyat), Revizyonlar (EPS büyümesi)
-        
-Bu test, canlı sistemdeki aynı kriterleri tarihsel verilere uygular.""")
+        st.success("✅ FMP API bağlantısı aktif - Tam 5 kriterli analiz ve tarihsel profil verileri kullanılacak")
     else:
         st.error("❌ FMP API anahtarı bulunamadı. Lütfen FMP_API_KEY ortam değişkenini ayarlayın.")
-else:
+if "5 Kriterli Tam Analiz (FMP API)" in backtest_selection and FMP_API_KEY:
+    st.info("""**5 Kriter:** Değerleme (P/E), Büyüme (gelir), Karlılık (net marj), Momentum (fiyat), Revizyonlar (EPS büyümesi)
+        
+Bu test, canlı sistemdeki aynı kriterleri tarihsel verilere uygular.""")
+if "Momentum Bazlı Basit Test" in backtest_selection:
     st.warning("""**Momentum Bazlı Test:** Sadece sektör performansı + fiyat momentumu kullanır.
     
 Tarihsel P/E, gelir büyümesi gibi temel veriler dahil edilmez.""")
+if "Para Akışı Stratejisi" in backtest_selection:
+    st.info("**Para Akışı:** Sektörler seçili dönemin tarihsel MFI değerine, hisseler günlük para akışı değişimine göre seçilir.")
+if any(label.startswith("Profil: ") for label in backtest_selection):
+    st.info(f"**Profiller:** Kurallar her yenileme gününde o güne kadar yayımlanmış FMP rasyolarına (dönem sonundan {FMP_REPORT_LAG_DAYS} gün sonra) ve son bir yılın günlük getirilerinden hesaplanan betaya uygulanır.")
 
-col_bt1, col_bt2, col_bt3 = st.columns(3)
+col_bt1, col_bt2, col_bt3, col_bt4 = st.columns(4)
 
 with col_bt1:
     min_date = datetime.now().date() - timedelta(days=365*2)
@@ -2035,46 +4231,73 @@ with col_bt2:
     )
 
 with col_bt3:
+    backtest_weighting = st.selectbox(
+        "Ağırlıklandırma",
+        options=list(PORTFOLIO_WEIGHTING_OPTIONS.keys()),
+        help="Ağırlıklar her yenilemede o güne kadarki son bir yılın günlük getirilerinden hesaplanır"
+    )
+
+with col_bt4:
     st.write("")
     st.write("")
     run_backtest = st.button("🚀 Simülasyonu Başlat", type="primary")
 
 if run_backtest:
     interval_days = BACKTEST_INTERVALS[backtest_interval]
+    currency = "$" if selected_market == "US" else "₺"
     
-    if backtest_method == "5 Kriterli Tam Analiz (FMP API)" and FMP_API_KEY:
-        with st.spinner("5 kriterli simülasyon çalışıyor... FMP verileri çekiliyor, bu işlem biraz zaman alabilir."):
-            backtest_results = run_fmp_backtest_simulation(backtest_start, interval_days, selected_period)
-    else:
-        with st.spinner("Momentum simülasyonu çalışıyor..."):
-            backtest_results = run_backtest_simulation(backtest_start, interval_days, selected_period)
+    backtest_runs = {}
+    with st.spinner("Simülasyon çalışıyor... Tarihsel veriler çekiliyor, bu işlem biraz zaman alabilir."):
+        for label in backtest_selection:
+            runner, needs_fmp = BACKTEST_METHODS[label]
+            if needs_fmp and not FMP_API_KEY:
+                continue
+            results = runner(backtest_start, interval_days, selected_period, PORTFOLIO_WEIGHTING_OPTIONS[backtest_weighting])
+            if not results.empty:
+                backtest_runs[label] = results
     
-    if not backtest_results.empty:
-        final_value = backtest_results["Portföy Değeri"].iloc[-1]
-        total_return = ((final_value - 100) / 100) * 100
-        
-        col_res1, col_res2, col_res3 = st.columns(3)
-        col_res1.metric("Başlangıç Değeri", "$100.00")
-        col_res2.metric("Son Değer", f"${final_value:.2f}")
-        col_res3.metric("Toplam Getiri", f"%{total_return:.2f}", delta=f"{total_return:.2f}%")
+    if backtest_runs:
+        if len(backtest_runs) == 1:
+            method_label, backtest_results = next(iter(backtest_runs.items()))
+            final_value = backtest_results["Portföy Değeri"].iloc[-1]
+            total_return = ((final_value - 100) / 100) * 100
+            
+            col_res1, col_res2, col_res3 = st.columns(3)
+            col_res1.metric("Başlangıç Değeri", f"{currency}100.00")
+            col_res2.metric("Son Değer", f"{currency}{final_value:.2f}")
+            col_res3.metric("Toplam Getiri", f"%{total_return:.2f}", delta=f"{total_return:.2f}%")
+        else:
+            method_label = "Karşılaştırmalı"
+            summary = pd.DataFrame([{
+                "Strateji": label,
+                "Son Değer": results["Portföy Değeri"].iloc[-1],
+                "Toplam Getiri (%)": results["Portföy Değeri"].iloc[-1] - 100,
+                "Ort. Hisse Sayısı": results["Seçilen Hisse"].mean()
+            } for label, results in backtest_runs.items()]).sort_values(by="Son Değer", ascending=False)
+            st.dataframe(summary.style.format({"Son Değer": "{:.2f}", "Toplam Getiri (%)": "{:.2f}", "Ort. Hisse Sayısı": "{:.1f}"}),
+                         hide_index=True, use_container_width=True)
+            backtest_results = pd.concat(
+                [results.set_index("Tarih")["Portföy Değeri"].rename(label) for label, results in backtest_runs.items()], axis=1
+            ).reset_index()
         
         fig_backtest = go.Figure()
-        fig_backtest.add_trace(go.Scatter(
-            x=backtest_results["Tarih"],
-            y=backtest_results["Portföy Değeri"],
-            mode='lines+markers',
-            name='Portföy Değeri',
-            line=dict(color='#00D4AA', width=2),
-            marker=dict(size=6)
-        ))
+        line_colors = ['#00D4AA', '#FF6B6B', '#4D96FF', '#FFD93D', '#C77DFF', '#FF9F45', '#6BCB77']
+        for trace_idx, (label, results) in enumerate(backtest_runs.items()):
+            fig_backtest.add_trace(go.Scatter(
+                x=results["Tarih"],
+                y=results["Portföy Değeri"],
+                mode='lines+markers',
+                name=label if len(backtest_runs) > 1 else 'Portföy Değeri',
+                line=dict(color=line_colors[trace_idx % len(line_colors)], width=2),
+                marker=dict(size=6)
+            ))
         
-        fig_backtest.add_hline(y=100, line_dash="dash", line_color="gray", annotation_text="Başlangıç: $100")
+        fig_backtest.add_hline(y=100, line_dash="dash", line_color="gray", annotation_text=f"Başlangıç: {currency}100")
         
-        method_label = "5 Kriterli" if (backtest_method == "5 Kriterli Tam Analiz (FMP API)" and FMP_API_KEY) else "Momentum"
         fig_backtest.update_layout(
-            title=f"{method_label} Strateji Performansı ({backtest_start} - Bugün)",
+            title=f"{method_label} Strateji Performansı - {backtest_weighting} ({backtest_start} - Bugün)",
             xaxis_title="Tarih",
-            yaxis_title="Portföy Değeri ($)",
+            yaxis_title=f"Portföy Değeri ({currency})",
             template="plotly_dark",
             height=400
         )
@@ -2105,65 +4328,92 @@ if portfolio_names:
         index=0
     )
     
-    session = get_session()
-    user_stocks = session.query(UserPortfolio).filter(UserPortfolio.portfolio_name == selected_portfolio_name).all()
-    session.close()
+    user_holdings = load_holdings(selected_portfolio_name)
     
-    if user_stocks:
-        portfolio_data = []
-        total_value = 0
-        total_cost = 0
-        
-        for stock in user_stocks:
-            current_price, daily_change = get_stock_price(stock.symbol)
-            if current_price:
-                current_value = current_price * stock.quantity
-                cost_basis = stock.buy_price * stock.quantity if stock.buy_price else 0
-                profit_loss = current_value - cost_basis if cost_basis > 0 else 0
-                profit_loss_pct = ((current_price - stock.buy_price) / stock.buy_price * 100) if stock.buy_price else 0
-                daily_pnl = current_value * (daily_change / 100) if daily_change else 0
-                total_value += current_value
-                total_cost += cost_basis
-                
-                portfolio_data.append({
-                    "ID": stock.id,
-                    "Sembol": stock.symbol,
-                    "Sektör": stock.sector or "-",
-                    "Adet": round(stock.quantity, 4),
-                    "Maliyet ($)": round(cost_basis, 2),
-                    "Güncel Fiyat ($)": round(current_price, 2),
-                    "Günlük (%)": round(daily_change, 2) if daily_change else 0,
-                    "Günlük K/Z ($)": round(daily_pnl, 2),
-                    "Toplam (%)": round(profit_loss_pct, 2),
-                    "Toplam K/Z ($)": round(profit_loss, 2)
-                })
-            else:
-                portfolio_data.append({
-                    "ID": stock.id,
-                    "Sembol": stock.symbol,
-                    "Sektör": stock.sector or "-",
-                    "Adet": round(stock.quantity, 4),
-                    "Maliyet ($)": "-",
-                    "Güncel Fiyat ($)": "-",
-                    "Günlük (%)": "-",
-                    "Günlük K/Z ($)": "-",
-                    "Toplam (%)": "-",
-                    "Toplam K/Z ($)": "-"
-                })
-        
-        user_df = pd.DataFrame(portfolio_data)
+    if not user_holdings.empty:
+        valued = value_holdings(user_holdings)
+        priced = valued["price"].notna()
+        user_df = pd.DataFrame({
+            "ID": valued["id"],
+            "Sembol": valued["symbol"],
+            "Sektör": valued["sector"].fillna("-"),
+            "Adet": valued["quantity"].round(4),
+            "Maliyet ($)": valued["cost"].where(priced).round(2),
+            "Güncel Fiyat ($)": valued["price"].round(2),
+            "Günlük (%)": valued["change_pct"].round(2),
+            "Günlük K/Z ($)": valued["daily_pnl"].round(2),
+            "Toplam (%)": valued["pnl_pct"].round(2),
+            "Toplam K/Z ($)": valued["pnl"].round(2)
+        })
+        totals = valuation_totals(valued)
         
+        if valued.attrs["stale_age"] is not None:
+            st.caption(f"⏳ Fiyatlar {format_stale_age(valued.attrs['stale_age'])} önceki son geçerli değerlerden gösteriliyor")
         col_summary1, col_summary2, col_summary3 = st.columns(3)
-        col_summary1.metric("Toplam Değer", f"${total_value:,.2f}")
-        col_summary2.metric("Toplam Maliyet", f"${total_cost:,.2f}")
-        total_profit = total_value - total_cost
-        col_summary3.metric("Toplam Kar/Zarar", f"${total_profit:,.2f}", delta=f"{(total_profit/total_cost*100) if total_cost > 0 else 0:.2f}%")
+        col_summary1.metric("Toplam Değer", f"${totals['value']:,.2f}")
+        col_summary2.metric("Toplam Maliyet", f"${totals['cost']:,.2f}")
+        col_summary3.metric("Toplam Kar/Zarar", f"${totals['pnl']:,.2f}", delta=f"{totals['pnl_pct'] or 0:.2f}%")
         
         display_df = user_df.drop(columns=['ID'])
         numeric_cols = display_df.select_dtypes(include=['float64', 'float32', 'int64', 'int32']).columns.tolist()
         format_dict = {col: "{:.2f}" for col in numeric_cols}
         styled_user_df = display_df.style.format(format_dict, na_rep="-")
         st.dataframe(styled_user_df, hide_index=True, use_container_width=True)
+        position_values = valued.groupby("symbol")["value"].sum()
+        show_risk_analysis(list(position_values.index), selected_market, weights=position_values if position_values.sum() > 0 else None)
+        
+        st.subheader("📈 Portföy Geçmişi")
+        portfolio_history = get_portfolio_history(selected_portfolio_name)
+        if len(portfolio_history) < 2:
+            st.info("Geçmiş grafikleri için en az iki günlük kayıt gerekir. Kayıtlar her işlem günü kapanıştan sonra otomatik alınır.")
+        else:
+            history_returns = period_returns(portfolio_history)
+            return_cols = st.columns(len(history_returns))
+            for return_col, (label, period_return) in zip(return_cols, history_returns.items()):
+                return_col.metric(label, f"{period_return:+.2f}%" if period_return is not None else "-")
+            
+            col_equity, col_drawdown = st.columns(2)
+            with col_equity:
+                fig_equity = go.Figure()
+                fig_equity.add_trace(go.Scatter(
+                    x=portfolio_history.index,
+                    y=portfolio_history["value"],
+                    mode='lines',
+                    name='Değer',
+                    line=dict(color='#00D4AA', width=2)
+                ))
+                fig_equity.add_trace(go.Scatter(
+                    x=portfolio_history.index,
+                    y=portfolio_history["cost"],
+                    mode='lines',
+                    name='Maliyet',
+                    line=dict(color='gray', width=1, dash='dash')
+                ))
+                fig_equity.update_layout(
+                    title="Portföy Değeri",
+                    xaxis_title="Tarih",
+                    yaxis_title="Değer ($)",
+                    template="plotly_dark",
+                    height=350
+                )
+                st.plotly_chart(fig_equity, use_container_width=True)
+            with col_drawdown:
+                fig_drawdown = go.Figure(go.Scatter(
+                    x=portfolio_history.index,
+                    y=portfolio_history["drawdown"],
+                    mode='lines',
+                    fill='tozeroy',
+                    name='Düşüş',
+                    line=dict(color='#FF4B4B', width=1)
+                ))
+                fig_drawdown.update_layout(
+                    title="Tepeden Düşüş (%)",
+                    xaxis_title="Tarih",
+                    yaxis_title="Düşüş (%)",
+                    template="plotly_dark",
+                    height=350
+                )
+                st.plotly_chart(fig_drawdown, use_container_width=True)
         
         col_action1, col_action2 = st.columns(2)
         
@@ -2173,7 +4423,7 @@ if portfolio_names:
             with col_del1:
                 stock_to_delete = st.selectbox(
                     "Silinecek hisse seçin",
-                    options=[(s.id, f"{s.symbol} - {s.quantity:.4f} adet") for s in user_stocks],
+                    options=[(int(s.id), f"{s.symbol} - {s.quantity:.4f} adet") for s in user_holdings.itertuples()],
                     format_func=lambda x: x[1]
                 )
             with col_del2:
@@ -2239,6 +4489,31 @@ with st.form("add_stock_form"):
         else:
             st.warning("Lütfen hisse sembolü girin.")
 
+st.subheader("Dosyadan İçe Aktar")
+
+with st.form("import_portfolio_form"):
+    import_file = st.file_uploader("CSV veya Excel (Sembol, Adet, Alış Fiyatı, Sektör)", type=["csv", "xlsx"])
+    import_name = st.text_input("Portföy Adı", value="İçe Aktarılan Portföy")
+    import_submitted = st.form_submit_button("📥 İçe Aktar", type="primary")
+    
+    if import_submitted:
+        if import_file is None:
+            st.warning("Lütfen bir dosya seçin.")
+        elif not import_name.strip():
+            st.error("Portföy adı boş olamaz.")
+        else:
+            try:
+                holdings, skipped = read_portfolio_file(import_file)
+                if holdings.empty:
+                    st.error("Dosyada geçerli pozisyon bulunamadı.")
+                else:
+                    imported = save_portfolio_holdings(holdings, import_name.strip())
+                    st.success(f"✅ {imported} pozisyon '{import_name.strip()}' portföyüne aktarıldı!" + (f" ({skipped} geçersiz satır atlandı)" if skipped else ""))
+                    st.cache_data.clear()
+                    st.rerun()
+            except Exception as e:
+                st.error(f"İçe aktarma hatası: {str(e)}")
+
 st.divider()
 
 st.header("🔔 Fiyat Alarmları")
@@ -2251,14 +4526,15 @@ col_alerts1, col_alerts2 = st.columns(2)
 with col_alerts1:
     st.subheader("Aktif Alarmlar")
     if active_alerts:
+        alert_quotes, _ = get_quote_snapshot({alert.symbol for alert in active_alerts})
         for alert in active_alerts:
-            current_price, _ = get_stock_price(alert.symbol)
+            current_price = alert_quotes["price"].get(alert.symbol, 0)
             direction = "yukarı" if alert.alert_type == "above" else "aşağı"
             icon = "📈" if alert.alert_type == "above" else "📉"
             
             col_a, col_b = st.columns([4, 1])
             with col_a:
-                st.write(f"{icon} **{alert.symbol}**: ${alert.target_price:.2f} {direction} (Güncel: ${current_price:.2f if current_price else 0:.2f})")
+                st.write(f"{icon} **{alert.symbol}**: ${alert.target_price:.2f} {direction} (Güncel: ${current_price:.2f})")
             with col_b:
                 if st.button("❌", key=f"del_alert_{alert.id}"):
                     if remove_alert(alert.id):
@@ -2272,7 +4548,8 @@ with col_alerts2:
         for alert in triggered_history:
             direction = "yukarı çıktı" if alert.alert_type == "above" else "aşağı düştü"
             icon = "✅"
-            triggered_time = alert.triggered_at.strftime("%d/%m %H:%M") if alert.triggered_at else "-"
+            crossed_at = alert.trigger_bar_at or alert.triggered_at
+            triggered_time = crossed_at.strftime("%d/%m %H:%M") if crossed_at else "-"
             st.write(f"{icon} **{alert.symbol}**: ${alert.target_price:.2f} {direction} ({triggered_time})")
     else:
         st.info("Henüz tetiklenen alarm yok.")
@@ -2313,56 +4590,28 @@ with st.form("add_alert_form"):
 st.divider()
 
 st.sidebar.header("📁 Portföylerim")
-session_pf = get_session()
 try:
-    from sqlalchemy import func
-    portfolio_summary = session_pf.query(
-        UserPortfolio.portfolio_name,
-        func.min(UserPortfolio.added_at).label('created_at'),
-        func.count(UserPortfolio.id).label('stock_count'),
-        func.sum(UserPortfolio.quantity * UserPortfolio.buy_price).label('total_investment')
-    ).group_by(UserPortfolio.portfolio_name).all()
-    
-    if portfolio_summary:
-        for pf in portfolio_summary:
-            pf_name = pf.portfolio_name or "İsimsiz"
-            created_date = pf.created_at.strftime("%d/%m/%Y") if pf.created_at else "-"
-            stock_count = pf.stock_count or 0
-            total_inv = pf.total_investment or 0
-            
-            pf_stocks = session_pf.query(UserPortfolio).filter(UserPortfolio.portfolio_name == pf_name).all()
-            current_value = 0
-            for stock in pf_stocks:
-                price, _ = get_stock_price(stock.symbol)
-                if price:
-                    current_value += stock.quantity * price
+    portfolio_summaries = get_portfolio_summaries(selected_market, BIST_SECTOR_WEIGHTING)
+    
+    if portfolio_summaries:
+        for pf in portfolio_summaries:
+            pf_name = pf["name"]
+            created_date = pf["created_at"].strftime("%d/%m/%Y") if pd.notna(pf["created_at"]) else "-"
+            stock_count = pf["stock_count"]
+            total_inv = pf["total_investment"]
+            current_value = pf["current_value"]
+            pf_time_period = pf["time_period"]
+            to_remove = pf["to_remove"]
+            to_add = pf["to_add"]
+            has_changes = len(to_remove) > 0 or len(to_add) > 0
             
-            if total_inv > 0:
-                performance = ((current_value - total_inv) / total_inv) * 100
+            if pf["performance"] is not None:
+                performance = pf["performance"]
                 perf_color = "🟢" if performance >= 0 else "🔴"
                 perf_text = f"{perf_color} {performance:+.1f}%"
             else:
                 perf_text = "-"
             
-            pf_time_period = pf_stocks[0].time_period if pf_stocks and hasattr(pf_stocks[0], 'time_period') and pf_stocks[0].time_period else "5 Gün"
-            pf_symbols = set([s.symbol for s in pf_stocks])
-            
-            try:
-                current_recommendations = get_portfolio_data(pf_time_period, selected_market)
-                if not current_recommendations.empty:
-                    new_symbols = set(current_recommendations['Sembol'].tolist())
-                    to_remove = pf_symbols - new_symbols
-                    to_add = new_symbols - pf_symbols
-                    has_changes = len(to_remove) > 0 or len(to_add) > 0
-                else:
-                    has_changes = False
-                    to_remove = set()
-                    to_add = set()
-            except:
-                has_changes = False
-                to_remove = set()
-                to_add = set()
-            
             alert_icon = "🔔" if has_changes else "📊"
             
             with st.sidebar.expander(f"{alert_icon} {pf_name}", expanded=False):
@@ -2398,23 +4647,22 @@ try:
                         msg += f"📈 Performans: {perf_text}\n\n"
                         msg += "\n".join(change_messages)
                         if send_telegram_message(msg):
-                            st.success("✅ Telegram'a gönderildi!")
+                            st.success("✅ Telegram kuyruğuna eklendi!")
                         else:
-                            st.error("Gönderilemedi. Token/Chat ID kontrol edin.")
+                            st.error("Kuyruğa eklenemedi. Token/Chat ID kontrol edin.")
                 
                 st.markdown("---")
                 st.markdown("**Hisse Detayları:**")
-                for stock in pf_stocks:
-                    s_price, _ = get_stock_price(stock.symbol)
-                    if s_price and stock.buy_price > 0:
-                        s_perf = ((s_price - stock.buy_price) / stock.buy_price) * 100
-                        s_icon = "🟢" if s_perf >= 0 else "🔴"
-                        st.caption(f"{s_icon} {stock.symbol}: ${stock.buy_price:.2f} → ${s_price:.2f} ({s_perf:+.1f}%)")
+                for stock in pf["positions"].itertuples():
+                    if pd.notna(stock.price) and stock.buy_price > 0:
+                        s_icon = "🟢" if stock.pnl_pct >= 0 else "🔴"
+                        st.caption(f"{s_icon} {stock.symbol}: ${stock.buy_price:.2f} → ${stock.price:.2f} ({stock.pnl_pct:+.1f}%)")
                     else:
                         st.caption(f"⚪ {stock.symbol}: ${stock.buy_price:.2f}")
                 
                 st.markdown("---")
                 if st.button(f"🗑️ Portföyü Sil", key=f"del_pf_{pf_name}"):
+                    session_pf = get_session()
                     try:
                         session_pf.query(UserPortfolio).filter(UserPortfolio.portfolio_name == pf_name).delete()
                         session_pf.commit()
@@ -2422,12 +4670,12 @@ try:
                         st.rerun()
                     except:
                         session_pf.rollback()
+                    finally:
+                        session_pf.close()
     else:
         st.sidebar.info("Henüz portföy oluşturmadınız.")
 except Exception as e:
     st.sidebar.warning("Portföy bilgisi yüklenemedi.")
-finally:
-    session_pf.close()
 
 st.sidebar.divider()
 
@@ -2459,7 +4707,7 @@ if TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID:
     st.sidebar.success("✅ Telegram bağlı")
     if st.sidebar.button("🔔 Test Mesajı Gönder"):
         if send_telegram_message("✅ Morning Alpha Dashboard bağlantısı başarılı!"):
-            st.sidebar.success("Test mesajı gönderildi!")
+            st.sidebar.success("Test mesajı kuyruğa eklendi!")
         else:
             st.sidebar.error("Mesaj gönderilemedi")
 else:
@@ -2496,4 +4744,15 @@ if st.sidebar.button("🔄 Verileri Yenile"):
     st.cache_data.clear()
     st.rerun()
 
+@st.fragment(run_every=PARTIAL_REFRESH_SECONDS)
+def complete_partial_sections():
+    """Eksik veriyle çizilen bölümlerin indirmeleri bitince sayfayı yeniden çizer"""
+    pending = st.session_state.get("partial_futures", [])
+    if pending and all(f.done() for f in pending):
+        st.session_state.partial_futures = []
+        st.rerun()
+
+if st.session_state.partial_futures:
+    complete_partial_sections()
+
 st.caption("Bu veriler sadece eğitim amaçlıdır. Yatırım tavsiyesi içermez. Veriler Yahoo Finance'tan alınmaktadır.")